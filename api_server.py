@@ -0,0 +1,398 @@
+"""
+Headless HTTP/JSON API over the generators.
+
+Runs on the shared asyncio loop with no dependencies beyond the standard
+library and the model backend. Endpoints:
+
+    GET  /health                 liveness, in-flight request counts and model health
+    GET  /metrics                Prometheus-format LLM telemetry
+    POST /v1/script              {"topic", "genre"}
+    POST /v1/story               {"topic", "genre", "style", "word_count"}
+    POST /v1/poem                {"topic", "style", "poem_type"}
+    POST /v1/chat                {"messages": [{"role", "content"}], "system_prompt"}
+
+Every POST also accepts "model" ("auto" picks the fastest suitable one),
+"temperature" and "stream"; content endpoints accept "use_cache". Non-streaming responses are JSON objects
+with "content", "thinking", "model", "truncated" and "elapsed". With "stream": true the
+response is a server-sent event stream of {"type": "thinking" | "answer",
+"text"} events followed by a final "done" event. A response that was cut
+off, or broke off and could not be resumed, is returned as far as it got
+with "truncated": true.
+
+Usage:
+    python api_server.py --port 8000 --workers 16
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from utils.aio import get_event_loop
+from utils.groq_client import GroqGenerator, IncompleteResponseError, ThinkingStreamParser
+from utils.health import ModelUnavailableError, get_breakers
+from utils.models import (AUTO_MODEL, AVAILABLE_MODELS, DEFAULT_MODEL, DEFAULT_TEMPERATURE, MAX_TEMPERATURE,
+                          MIN_TEMPERATURE, THINKING_MODELS)
+from utils.prompting import CONTENT_TYPE_PROMPTS, CONVERSATION_SYSTEM_PROMPT, PROMPTS, job_variables
+from utils.routing import route_model
+from utils.telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 1 << 20
+
+# Seconds an idle keep-alive connection may wait for its next request
+IDLE_TIMEOUT = 30.0
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error", 502: "Bad Gateway",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    """An error answered with an HTTP status and a JSON message."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    """A parsed HTTP request."""
+
+    def __init__(self, method: str, path: str, version: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        """Whether the client wants the connection kept open afterwards."""
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self) -> Dict:
+        """Decode the body as a JSON object."""
+        try:
+            payload = json.loads(self.body or b"{}")
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise HTTPError(400, f"Invalid JSON body: {e}") from e
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return payload
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """
+    Read one request from a connection.
+
+    Args:
+        reader: The connection's stream reader
+
+    Returns:
+        The request, or None if the client closed the connection
+    """
+    try:
+        line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    if not line.strip():
+        return None
+    try:
+        method, path, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    body = b""
+    if method == "POST":
+        if "chunked" in headers.get("transfer-encoding", "").lower() or "content-length" not in headers:
+            raise HTTPError(411, "Content-Length is required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, f"Request body is limited to {MAX_BODY_SIZE} bytes")
+        body = await reader.readexactly(length)
+    return Request(method, path.split("?", 1)[0], version, headers, body)
+
+
+def _head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send(writer: asyncio.StreamWriter, status: int, body: bytes,
+               content_type: str = "application/json", keep_alive: bool = True):
+    """Write a complete response."""
+    writer.write(_head(status, {
+        "Content-Type": content_type,
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+    }) + body)
+    await writer.drain()
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: Dict, keep_alive: bool = True):
+    """Write a JSON response."""
+    await send(writer, status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), keep_alive=keep_alive)
+
+
+async def send_events(writer: asyncio.StreamWriter, events: AsyncIterator[Tuple[str, Dict]]):
+    """
+    Stream server-sent events using chunked transfer encoding.
+
+    Args:
+        writer: The connection's stream writer
+        events: Pairs of (event name, JSON data)
+    """
+    writer.write(_head(200, {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "Transfer-Encoding": "chunked",
+        "Connection": "keep-alive",
+    }))
+    try:
+        async for event, data in events:
+            payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+            writer.write(f"{len(payload):x}\r\n".encode("latin-1") + payload + b"\r\n")
+            # Waits while a slow client catches up
+            await writer.drain()
+    finally:
+        # Stops the generation if the client disconnects mid-stream
+        await events.aclose()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+class APIServer:
+    """Routes requests to the generators with a bounded number in flight."""
+
+    def __init__(self, workers: int = 16, max_pending: int = 256):
+        """
+        Initialize the server.
+
+        Args:
+            workers: Maximum generations running at once
+            max_pending: Maximum requests waiting for a worker before
+                new ones are turned away with 503
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(workers)
+        self.active = 0
+        self.pending = 0
+
+    def _generator(self, payload: Dict, content_type: str, variables: Optional[Dict] = None) -> GroqGenerator:
+        """Create a generator for the request's model and temperature, routing "auto" requests."""
+        try:
+            temperature = float(payload.get("temperature", DEFAULT_TEMPERATURE))
+        except (TypeError, ValueError):
+            raise HTTPError(400, "temperature must be a number")
+        # NaN fails both comparisons, so check for the range rather than outside it
+        if not MIN_TEMPERATURE <= temperature <= MAX_TEMPERATURE:
+            raise HTTPError(400, f"temperature must be between {MIN_TEMPERATURE} and {MAX_TEMPERATURE}")
+        model = payload.get("model", DEFAULT_MODEL)
+        if model != AUTO_MODEL and model not in AVAILABLE_MODELS:
+            raise HTTPError(400, f"model must be one of: {', '.join(AVAILABLE_MODELS + [AUTO_MODEL])}")
+        if model == AUTO_MODEL:
+            route = route_model(content_type, variables or {})
+            route.record()
+            model = route.model
+        return GroqGenerator(model_name=model, temperature=temperature, content_type=content_type)
+
+    def _content_call(self, content_type: str, payload: Dict):
+        """Build the generator, prompt and variables for a content request."""
+        spec = PROMPTS.get(CONTENT_TYPE_PROMPTS[content_type])
+        try:
+            variables = job_variables(spec, payload)
+        except ValueError as e:
+            raise HTTPError(400, str(e)) from e
+        return self._generator(payload, content_type, variables), spec, variables
+
+    def _chat_call(self, payload: Dict):
+        """Build the generator and validated messages for a chat request."""
+        messages = payload.get("messages")
+        if not isinstance(messages, list) or not messages or not all(
+                isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+                for m in messages):
+            raise HTTPError(400, "messages must be a non-empty list of {'role': 'user' | 'assistant', 'content'}")
+        system_prompt = payload.get("system_prompt", CONVERSATION_SYSTEM_PROMPT)
+        if system_prompt is not None and not isinstance(system_prompt, str):
+            raise HTTPError(400, "system_prompt must be a string")
+        return self._generator(payload, "chat"), messages, system_prompt
+
+    async def handle(self, request: Request, writer: asyncio.StreamWriter):
+        """Answer one request."""
+        if request.path == "/health":
+            await send_json(writer, 200, {"status": "ok", "active": self.active, "pending": self.pending,
+                                          "workers": self.workers, "models": get_breakers().snapshot()},
+                            request.keep_alive)
+            return
+        if request.path == "/metrics":
+            await send(writer, 200, get_telemetry().render_prometheus().encode("utf-8"),
+                       "text/plain; version=0.0.4", request.keep_alive)
+            return
+
+        content_type = request.path[len("/v1/"):] if request.path.startswith("/v1/") else ""
+        if content_type not in CONTENT_TYPE_PROMPTS and content_type != "chat":
+            raise HTTPError(404, f"No endpoint at {request.path}")
+        if request.method != "POST":
+            raise HTTPError(405, "Use POST")
+        payload = request.json()
+
+        if content_type == "chat":
+            generator, messages, system_prompt = self._chat_call(payload)
+            make_stream = lambda: generator.astream_chat_with_history(messages, system_prompt)
+            make_call = lambda: generator.achat_with_history(messages, system_prompt)
+        else:
+            generator, spec, variables = self._content_call(content_type, payload)
+            use_cache = bool(payload.get("use_cache", True))
+            make_stream = lambda: generator.astream_content(spec.template, use_cache=use_cache, **variables)
+            make_call = lambda: generator.agenerate_content(spec.template, use_cache=use_cache, **variables)
+
+        if self.pending >= self.max_pending:
+            raise HTTPError(503, "Server busy, try again later")
+        self.pending += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.pending -= 1
+        self.active += 1
+        try:
+            if payload.get("stream"):
+                await send_events(writer, self._events(generator, make_stream))
+            else:
+                await send_json(writer, 200, await self._complete(generator, make_call), request.keep_alive)
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    async def _complete(self, generator: GroqGenerator, make_call) -> Dict:
+        """Run a non-streaming generation."""
+        started = time.perf_counter()
+        truncated = False
+        try:
+            response = await make_call()
+        except ModelUnavailableError as e:
+            raise HTTPError(503, str(e)) from e
+        except IncompleteResponseError as e:
+            # Return what arrived so the client can continue it
+            logger.warning("Generation broke off: %s", e)
+            response, truncated = e.partial, True
+        except Exception as e:
+            logger.warning("Generation failed: %s", e)
+            raise HTTPError(502, str(e)) from e
+        thinking = ""
+        if generator.model_name in THINKING_MODELS:
+            thinking, response = GroqGenerator.parse_deepseek_thinking(response)
+        return {"content": response, "thinking": thinking, "model": generator.model_name,
+                "truncated": truncated or generator.truncated, "elapsed": round(time.perf_counter() - started, 3)}
+
+    async def _events(self, generator: GroqGenerator, make_stream) -> AsyncIterator[Tuple[str, Dict]]:
+        """Turn a generation stream into thinking and answer events."""
+        started = time.perf_counter()
+        parser = ThinkingStreamParser() if generator.model_name in THINKING_MODELS else None
+        stream = make_stream()
+        answered = False
+        truncated = False
+        try:
+            async for chunk in stream:
+                for kind, text in parser.feed(chunk) if parser else [(ThinkingStreamParser.ANSWER, chunk)]:
+                    answered = answered or kind == ThinkingStreamParser.ANSWER
+                    yield "delta", {"type": kind, "text": text}
+        except IncompleteResponseError as e:
+            # The deltas sent so far are the response; mark it for continuation
+            logger.warning("Streamed generation broke off: %s", e)
+            truncated = True
+        except Exception as e:
+            # Headers are already sent; report the failure in-band
+            logger.warning("Streamed generation failed: %s", e)
+            yield "error", {"error": str(e)}
+            return
+        finally:
+            await stream.aclose()
+        if parser is not None and not answered:
+            # Held back while it could have been a tag, or an unclosed thinking block
+            yield "delta", {"type": ThinkingStreamParser.ANSWER, "text": parser.finish()[1]}
+        yield "done", {"model": generator.model_name, "truncated": truncated or generator.truncated,
+                       "elapsed": round(time.perf_counter() - started, 3)}
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer requests on one connection until it closes."""
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    keep_alive = request.keep_alive
+                    await self.handle(request, writer)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": e.message}, keep_alive)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    logger.exception("Error handling request")
+                    await send_json(writer, 500, {"error": str(e)}, keep_alive=False)
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The client went away; any generation in progress has been closed
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, workers: int, max_pending: int):
+    """Run the API server until cancelled."""
+    api = APIServer(workers, max_pending)
+    server = await asyncio.start_server(api.serve_connection, host, port, limit=MAX_BODY_SIZE)
+    logger.info("Serving on http://%s:%d with %d workers", host, port, workers)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Serve the script, story, poem and chat generators over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("-w", "--workers", type=int, default=16, help="Maximum generations in flight")
+    parser.add_argument("--max-pending", type=int, default=256,
+                        help="Requests allowed to wait for a worker before returning 503")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # Pooled async clients are bound to the shared loop, so the server runs on it too
+    future = asyncio.run_coroutine_threadsafe(serve(args.host, args.port, args.workers, args.max_pending),
+                                              get_event_loop())
+    try:
+        future.result()
+    except KeyboardInterrupt:
+        future.cancel()
+
+
+if __name__ == "__main__":
+    main()
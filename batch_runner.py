@@ -0,0 +1,197 @@
+"""
+Headless batch generation over JSONL job files.
+
+Each input line is a job spec such as:
+
+    {"id": "poem-1", "content_type": "poem", "topic": "Autumn leaves",
+     "style": "Robert Frost", "poem_type": "Haiku", "model": "gemma2-9b-it",
+     "temperature": 0.7}
+
+A model of "auto" sends the job to the fastest model suited to it.
+
+Results are appended to the output JSONL as each job finishes. Responses
+cut off by the length limit are marked "truncated"; a response that broke
+off and could not be resumed is kept as far as it got with status
+"incomplete". Re-running with the same output file skips jobs that already
+completed, and runs incomplete ones again.
+
+Usage:
+    python batch_runner.py jobs.jsonl -o results.jsonl --concurrency 4
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Set
+from dotenv import load_dotenv
+from utils.groq_client import THINKING_MODELS, GroqGenerator, IncompleteResponseError
+from utils.models import AUTO_MODEL, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from utils.prompting import CONTENT_TYPE_PROMPTS, PROMPTS, job_variables
+from utils.routing import route_model
+from utils.telemetry import get_telemetry
+
+
+def load_jobs(path: str) -> List[Dict]:
+    """
+    Read job specs from a JSONL file, assigning ids to jobs without one.
+
+    Args:
+        path: Path of the input JSONL file
+
+    Returns:
+        The list of job dictionaries
+    """
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job.setdefault("id", f"job-{line_number}")
+            jobs.append(job)
+    return jobs
+
+
+def completed_job_ids(path: str) -> Set[str]:
+    """
+    Collect the ids of jobs that already succeeded in an output file.
+
+    Args:
+        path: Path of the output JSONL file
+
+    Returns:
+        The set of completed job ids
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def run_job(job: Dict, use_cache: bool = True) -> Dict:
+    """
+    Execute one job through GroqGenerator.
+
+    Args:
+        job: The job spec
+        use_cache: Whether the response cache may serve this job
+
+    Returns:
+        The result record to write
+    """
+    model = job.get("model", DEFAULT_MODEL)
+    record = {
+        "id": job["id"],
+        "content_type": job.get("content_type"),
+        "model": model,
+        "status": "ok",
+        "content": "",
+        "thinking": "",
+        "truncated": False,
+        "error": "",
+    }
+    started = time.perf_counter()
+    try:
+        prompt_name = CONTENT_TYPE_PROMPTS.get(job.get("content_type"))
+        if prompt_name is None:
+            raise ValueError(f"Unknown content_type: {job.get('content_type')!r}")
+        spec = PROMPTS.get(prompt_name)
+        variables = job_variables(spec, job)
+        if model == AUTO_MODEL:
+            route = route_model(job["content_type"], variables)
+            route.record()
+            model = record["model"] = route.model
+
+        generator = GroqGenerator(model_name=model, temperature=job.get("temperature", DEFAULT_TEMPERATURE),
+                                  content_type=job.get("content_type"))
+        try:
+            response = generator.generate_content(spec.template, use_cache=use_cache, **variables)
+        except IncompleteResponseError as e:
+            # Keep the text that arrived instead of failing the job outright
+            response = e.partial
+            record["status"] = "incomplete"
+            record["error"] = str(e)
+        if model in THINKING_MODELS:
+            record["thinking"], response = generator.parse_deepseek_thinking(response)
+        record["content"] = response
+        record["truncated"] = generator.truncated
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+    record["elapsed"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_batch(jobs: List[Dict], output_path: str, concurrency: int = 4, use_cache: bool = True) -> Dict:
+    """
+    Run jobs with bounded concurrency, streaming results to the output file.
+
+    Args:
+        jobs: Job specs to run
+        output_path: Output JSONL file, appended to as jobs finish
+        concurrency: Maximum number of jobs in flight
+        use_cache: Whether the response cache may serve jobs
+
+    Returns:
+        Summary counters for the run
+    """
+    done = completed_job_ids(output_path)
+    pending = [job for job in jobs if job["id"] not in done]
+    summary = {"total": len(jobs), "skipped": len(jobs) - len(pending), "ok": 0, "incomplete": 0, "error": 0}
+    write_lock = threading.Lock()
+
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_job, job, use_cache) for job in pending]
+        for future in concurrent.futures.as_completed(futures):
+            record = future.result()
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            summary[record["status"]] += 1
+            print(f"[{summary['ok'] + summary['incomplete'] + summary['error']}/{len(pending)}] {record['id']}: "
+                  f"{record['status']} ({record['elapsed']:.1f}s)", file=sys.stderr)
+
+    summary["elapsed"] = time.perf_counter() - started
+    finished = summary["ok"] + summary["incomplete"] + summary["error"]
+    summary["jobs_per_minute"] = finished * 60.0 / summary["elapsed"] if summary["elapsed"] else 0.0
+    return summary
+
+
+def main():
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Generate scripts, stories and poems from a JSONL job file.")
+    parser.add_argument("jobs", help="Input JSONL file of job specs")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="Output JSONL file")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Maximum jobs in flight")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--metrics", help="Write Prometheus-format LLM telemetry to this file at the end")
+    args = parser.parse_args()
+
+    load_dotenv()
+    summary = run_batch(load_jobs(args.jobs), args.output, args.concurrency, not args.no_cache)
+    print(
+        f"Finished {summary['ok']} ok, {summary['incomplete']} incomplete, {summary['error']} failed, "
+        f"{summary['skipped']} skipped "
+        f"in {summary['elapsed']:.1f}s ({summary['jobs_per_minute']:.1f} jobs/minute)"
+    )
+    if args.metrics:
+        get_telemetry().write_prometheus(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
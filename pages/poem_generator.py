@@ -2,8 +2,14 @@
 Poetry Generator Page
 """
 import streamlit as st
-from utils.groq_client import GroqGenerator, AVAILABLE_MODELS
+from utils.models import AUTO_MODEL, AVAILABLE_MODELS, THINKING_MODELS
 from utils.prompting import POEM_TEMPLATE, CONVERSATION_SYSTEM_PROMPT
+from utils.history import HistoryManager
+from utils.poetry import POEM_FORMS, repair_poem, validate_form
+from utils.similarity import SERVE_THRESHOLD, get_similarity_index
+from utils.ui_components import (find_similar, open_conversation, queue_status, render_candidates, render_comparison,
+                                  model_label, render_continue, render_history, render_message, render_revision,
+                                  render_similar, render_stream, resolve_model, run_candidates, run_comparison)
 
 # List of famous poets for style selection
 FAMOUS_POETS = [
@@ -40,6 +46,131 @@ POEM_TYPES = [
     "Tanka"
 ]
 
+def keep_comparison_result(result: dict):
+    """Continue the conversation with the chosen side-by-side result."""
+    st.session_state.poem_messages.append({"role": "user", "content": st.session_state.poem_comparison["request"]})
+    st.session_state.poem_messages.append({"role": "assistant", "content": result["content"],
+                                           "thinking": result["thinking"], "model": result["answered_by"],
+                                           "truncated": result["truncated"]})
+    st.session_state.poem_generated = True
+    st.session_state.poem_comparison = None
+
+def keep_similar_result(match):
+    """Continue the conversation with an earlier result for a similar request."""
+    st.session_state.poem_messages.append({"role": "user", "content": match.request})
+    st.session_state.poem_messages.append({"role": "assistant", "content": match.content, "thinking": match.thinking,
+                                          "reused": match.similarity})
+    st.session_state.poem_generated = True
+
+def keep_candidate_result(result: dict):
+    """Continue the conversation with the chosen candidate."""
+    candidates = st.session_state.poem_candidates
+    st.session_state.poem_messages.append({"role": "user", "content": candidates["request"]})
+    st.session_state.poem_messages.append({"role": "assistant", "content": result["content"],
+                                           "thinking": result["thinking"], "model": result["answered_by"],
+                                           "truncated": result["truncated"]})
+    st.session_state.poem_generated = True
+    st.session_state.poem_candidates = None
+    
+    # Offer the chosen version for similar requests later; cut-off text stays out, as it does of the cache
+    if not result["truncated"]:
+        get_similarity_index().add("poem", candidates["attributes"], candidates["topic"], candidates["request"],
+                                   result["content"], result["thinking"], result["answered_by"])
+
+def fit_form(generator, response: str, poem_type: str, topic: str, style: str) -> dict:
+    """
+    Check a complete poem's form and rewrite only the lines that break it.
+    
+    Returns:
+        Message fields with the possibly repaired content, the number of
+        rewritten lines and the form issues that remain
+    """
+    repair = None
+    form_issues = []
+    if poem_type in POEM_FORMS:
+        with st.spinner(f"Checking the {poem_type} form..."):
+            repair = repair_poem(generator, response, poem_type, topic, style)
+        if repair is not None:
+            response = repair.content
+        report = repair.report if repair is not None else validate_form(response, poem_type)
+        form_issues = [str(issue) for issue in report.issues]
+    return {"content": response, "repaired": len(repair.lines) if repair is not None else 0,
+            "form_issues": form_issues}
+
+def fit_continued_form(generator, message: dict) -> dict:
+    """Run the form check a cut-off poem skipped, now that Continue has finished it."""
+    pending = message.get("pending_form")
+    if not pending:
+        return message
+    message = dict(message, **fit_form(generator, message["content"], **pending))
+    del message["pending_form"]
+    return message
+
+@st.fragment
+def show_conversation(model: str, temperature: float, revise: bool):
+    """Display the poem conversation; chat turns rerun only this fragment."""
+    st.subheader("Conversation")
+    render_history(st.session_state.poem_messages, "poem")
+    render_continue(st.session_state.poem_messages, "poem", model, temperature,
+                    st.session_state.poem_history, CONVERSATION_SYSTEM_PROMPT, on_complete=fit_continued_form)
+    
+    # Results of a side-by-side comparison waiting for the user to pick one
+    if st.session_state.poem_comparison:
+        render_comparison(st.session_state.poem_comparison, "poem", on_select=keep_comparison_result)
+    
+    # Ranked candidates waiting for the user to pick one
+    if st.session_state.poem_candidates:
+        render_candidates(st.session_state.poem_candidates, "poem", on_select=keep_candidate_result)
+    
+    # New turns render here, above the chat input
+    new_turn = st.container()
+    
+    # Chat input for conversation after poem generation
+    if st.session_state.poem_generated:
+        user_input = st.chat_input("Ask about your poem or request changes...")
+        
+        if user_input:
+            with new_turn:
+                from utils.groq_client import GroqGenerator
+                
+                # Add user message to chat history
+                st.session_state.poem_messages.append({"role": "user", "content": user_input})
+                render_message({"role": "user", "content": user_input})
+                
+                try:
+                    # Create generator instance with current settings
+                    generator = GroqGenerator(model_name=model, temperature=temperature, on_queue=queue_status())
+                    
+                    # Apply small change requests as targeted edits to the latest draft
+                    revision = render_revision(generator, st.session_state.poem_messages, user_input) if revise else None
+                    
+                    if revision is not None:
+                        st.session_state.poem_messages.append(revision)
+                    else:
+                        # Fit the conversation into the model's token budget, summarizing older turns
+                        window = st.session_state.poem_history.fit_conversation(
+                            st.session_state.poem_messages, CONVERSATION_SYSTEM_PROMPT, model
+                        )
+                        
+                        # Stream the response
+                        chunks = generator.stream_chat_with_history(window.messages, system_prompt=window.system_prompt)
+                        
+                        # Render tokens as they arrive, splitting out DeepSeek thinking
+                        thinking, response = render_stream(chunks, parse_thinking=model in THINKING_MODELS)
+                        
+                        # Add response to chat history
+                        st.session_state.poem_messages.append({
+                            "role": "assistant", 
+                            "content": response,
+                            "thinking": thinking,
+                            "tokens_saved": window.tokens_saved,
+                            "model": generator.answered_by,
+                            "truncated": generator.truncated
+                        })
+                
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+
 def show():
     """Display the Poetry Generator page."""
     st.header("Poetry Generator")
@@ -48,12 +179,21 @@ def show():
     Enter the details below and click "Generate Poem" to create your verse.
     """)
     
-    # Initialize session state for chat history
+    # Load the latest messages of this session's saved conversation
     if "poem_messages" not in st.session_state:
-        st.session_state.poem_messages = []
+        st.session_state.poem_messages = open_conversation("poem")
     
     if "poem_generated" not in st.session_state:
-        st.session_state.poem_generated = False
+        st.session_state.poem_generated = len(st.session_state.poem_messages) > 0
+    
+    if "poem_history" not in st.session_state:
+        st.session_state.poem_history = HistoryManager()
+    
+    if "poem_comparison" not in st.session_state:
+        st.session_state.poem_comparison = None
+    
+    if "poem_candidates" not in st.session_state:
+        st.session_state.poem_candidates = None
     
     # Input form
     with st.container():
@@ -79,103 +219,136 @@ def show():
         col1, col2 = st.columns(2)
         
         with col1:
-            model = st.selectbox("Model", AVAILABLE_MODELS, 
-                               help="Select the AI model to use for generation",
+            model = st.selectbox("Model", AVAILABLE_MODELS + [AUTO_MODEL], format_func=model_label,
+                               help="Select the AI model to use for generation, or let auto pick the fastest suitable one",
                                key="poem_model")
         
         with col2:
             temperature = st.slider("Temperature", 0.1, 1.0, 0.7, 0.1,
                                   help="Lower values for more predictable outputs, higher for more creative",
                                   key="poem_temp")
+        
+        use_cache = st.checkbox("Reuse cached results", value=True,
+                                help="Serve identical low-temperature requests from the response cache, "
+                                     "and near-identical ones from earlier results",
+                                key="poem_use_cache")
+        
+        revise = st.checkbox("Apply change requests as edits", value=True, key="poem_revise",
+                             help="Return follow-up changes as small edits to the latest draft instead of rewriting it")
+        
+        best_of = st.checkbox("Generate several candidates", key="poem_best_of",
+                              help="Generate several versions at once and rank them, best first")
+        candidate_count = 1
+        if best_of:
+            candidate_count = st.slider("Candidates", 2, 5, 3, key="poem_candidate_count")
+        
+        compare = st.checkbox("Compare models side by side", key="poem_compare",
+                              help="Run the same request on several models concurrently")
+        compare_models = []
+        if compare:
+            compare_models = st.multiselect("Models to compare", AVAILABLE_MODELS,
+                                            default=["llama-3.3-70b-versatile", "gemma2-9b-it", "qwen-qwq-32b"],
+                                            key="poem_compare_models")
+    
+    # Earlier results for a similar topic with the same settings
+    attributes = {"poem_type": poem_type, "style": style}
+    similar = find_similar(st.session_state.poem_messages, attributes, topic)
+    if similar is not None:
+        render_similar(similar, "poem", on_select=keep_similar_result)
+    
+    # Pick a model for "auto" from the current inputs
+    model, route = resolve_model(model, "poem", attributes)
     
     # Generate button
     generate_pressed = st.button("Generate Poem", use_container_width=True)
     
-    # Display chat history
-    st.subheader("Conversation")
-    for message in st.session_state.poem_messages:
-        with st.chat_message(message["role"]):
-            if message["role"] == "assistant" and "thinking" in message and message["thinking"]:
-                with st.expander("View thinking process"):
-                    st.markdown(message["thinking"])
-            st.markdown(message["content"])
+    # Conversation; chat turns rerun only this fragment
+    show_conversation(model, temperature, revise)
     
-    # Handle poem generation
-    if generate_pressed and topic and style:
-        with st.spinner("Generating your poem..."):
-            try:
-                # Create generator instance
-                generator = GroqGenerator(model_name=model, temperature=temperature)
-                
-                # Generate the poem
-                response = generator.generate_content(
-                    POEM_TEMPLATE,
-                    topic=topic,
-                    style=style,
-                    poem_type=poem_type
-                )
-                
-                # Check if we need to extract thinking for DeepSeek model
-                thinking = ""
-                if model == "deepseek-r1-distill-llama-70b":
-                    thinking, response = generator.parse_deepseek_thinking(response)
-                
-                # Store the user query and response in session state
-                st.session_state.poem_messages.append({
-                    "role": "user", 
-                    "content": f"Please write a {poem_type} poem about '{topic}' in the style of {style}."
-                })
-                st.session_state.poem_messages.append({
-                    "role": "assistant", 
-                    "content": response,
-                    "thinking": thinking
-                })
-                st.session_state.poem_generated = True
-                
-                # Force refresh to show new messages
-                st.rerun()
-            
-            except Exception as e:
-                st.error(f"Error generating poem: {str(e)}")
+    request_message = f"Please write a {poem_type} poem about '{topic}' in the style of {style}."
     
-    # Chat input for conversation after poem generation
-    if st.session_state.poem_generated:
-        user_input = st.chat_input("Ask about your poem or request changes...")
+    # Compare several models on the same request
+    if generate_pressed and compare and compare_models and topic and style:
+        results = run_comparison(compare_models, temperature, lambda generator: generator.agenerate_content(
+            POEM_TEMPLATE, use_cache=use_cache, topic=topic, style=style, poem_type=poem_type))
+        st.session_state.poem_comparison = {"request": request_message, "results": results}
+        st.rerun()
+    
+    # Serve a near-identical request from its earlier result
+    elif generate_pressed and use_cache and similar is not None and similar.similarity >= SERVE_THRESHOLD:
+        keep_similar_result(similar)
+        st.rerun()
+    
+    # Generate several candidates concurrently and rank them
+    elif generate_pressed and best_of and topic and style:
+        if route is not None:
+            route.record()
+        results = run_candidates(
+            model,
+            temperature,
+            lambda generator: generator.agenerate_content(
+                POEM_TEMPLATE, use_cache=False, topic=topic, style=style, poem_type=poem_type),
+            candidate_count,
+            poem_type=poem_type
+        )
+        st.session_state.poem_candidates = {"request": request_message, "results": results,
+                                          "topic": topic, "attributes": attributes}
+        st.rerun()
+    
+    # Handle poem generation
+    elif generate_pressed and topic and style:
+        from utils.groq_client import GroqGenerator
         
-        if user_input:
-            # Add user message to chat history
-            st.session_state.poem_messages.append({"role": "user", "content": user_input})
+        try:
+            if route is not None:
+                route.record()
             
-            with st.spinner("Thinking..."):
-                try:
-                    # Create generator instance with current settings
-                    generator = GroqGenerator(model_name=model, temperature=temperature)
-                    
-                    # Convert session state messages to format needed for the API
-                    api_messages = [{"role": "system", "content": CONVERSATION_SYSTEM_PROMPT}]
-                    for msg in st.session_state.poem_messages[:-1]:  # Exclude latest user message
-                        api_messages.append({"role": msg["role"], "content": msg["content"]})
-                    
-                    # Add the latest user message
-                    api_messages.append({"role": "user", "content": user_input})
-                    
-                    # Get response
-                    response = generator.chat_with_history(api_messages[1:], system_prompt=CONVERSATION_SYSTEM_PROMPT)
-                    
-                    # Check if we need to extract thinking for DeepSeek model
-                    thinking = ""
-                    if model == "deepseek-r1-distill-llama-70b":
-                        thinking, response = generator.parse_deepseek_thinking(response)
-                    
-                    # Add response to chat history
-                    st.session_state.poem_messages.append({
-                        "role": "assistant", 
-                        "content": response,
-                        "thinking": thinking
-                    })
-                    
-                    # Force refresh to show new messages
-                    st.rerun()
-                
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
\ No newline at end of file
+            # Create generator instance
+            generator = GroqGenerator(model_name=model, temperature=temperature, on_queue=queue_status())
+            
+            # Generate the poem
+            chunks = generator.stream_content(
+                POEM_TEMPLATE,
+                use_cache=use_cache,
+                topic=topic,
+                style=style,
+                poem_type=poem_type
+            )
+            
+            # Render tokens as they arrive, splitting out DeepSeek thinking
+            thinking, response = render_stream(chunks, parse_thinking=model in THINKING_MODELS)
+            truncated = generator.truncated
+            answered_by = generator.answered_by
+            
+            # Check fixed forms locally and rewrite only the lines that break them,
+            # waiting for Continue to finish a cut-off poem first
+            if truncated:
+                form = {"content": response, "pending_form": {"poem_type": poem_type, "topic": topic, "style": style}}
+            else:
+                form = fit_form(generator, response, poem_type, topic, style)
+            response = form["content"]
+            
+            # Store the user query and response in session state
+            st.session_state.poem_messages.append({
+                "role": "user", 
+                "content": request_message
+            })
+            st.session_state.poem_messages.append({
+                "role": "assistant", 
+                "thinking": thinking,
+                **form,
+                "routed": route.describe() if route is not None else "",
+                "model": answered_by,
+                "truncated": truncated
+            })
+            st.session_state.poem_generated = True
+            
+            # Offer this result for similar requests later; cut-off text stays out, as it does of the cache
+            if not truncated:
+                get_similarity_index().add("poem", attributes, topic, request_message, response, thinking, answered_by)
+            
+            # Force refresh to show new messages
+            st.rerun()
+        
+        except Exception as e:
+            st.error(f"Error generating poem: {str(e)}")
\ No newline at end of file
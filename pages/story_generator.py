@@ -2,8 +2,13 @@
 Short Story Generator Page
 """
 import streamlit as st
-from utils.groq_client import GroqGenerator, AVAILABLE_MODELS
+from utils.models import AUTO_MODEL, AVAILABLE_MODELS, THINKING_MODELS
 from utils.prompting import SHORT_STORY_TEMPLATE, CONVERSATION_SYSTEM_PROMPT
+from utils.history import HistoryManager
+from utils.similarity import SERVE_THRESHOLD, get_similarity_index
+from utils.ui_components import (find_similar, open_conversation, queue_status, render_candidates, render_comparison,
+                                  model_label, render_continue, render_history, render_message, render_revision,
+                                  render_similar, render_stream, resolve_model, run_candidates, run_comparison)
 
 # List of famous authors for style selection
 FAMOUS_AUTHORS = [
@@ -24,6 +29,102 @@ FAMOUS_AUTHORS = [
     "Agatha Christie"
 ]
 
+def keep_comparison_result(result: dict):
+    """Continue the conversation with the chosen side-by-side result."""
+    st.session_state.story_messages.append({"role": "user", "content": st.session_state.story_comparison["request"]})
+    st.session_state.story_messages.append({"role": "assistant", "content": result["content"],
+                                            "thinking": result["thinking"], "model": result["answered_by"],
+                                            "truncated": result["truncated"]})
+    st.session_state.story_generated = True
+    st.session_state.story_comparison = None
+
+def keep_similar_result(match):
+    """Continue the conversation with an earlier result for a similar request."""
+    st.session_state.story_messages.append({"role": "user", "content": match.request})
+    st.session_state.story_messages.append({"role": "assistant", "content": match.content, "thinking": match.thinking,
+                                          "reused": match.similarity})
+    st.session_state.story_generated = True
+
+def keep_candidate_result(result: dict):
+    """Continue the conversation with the chosen candidate."""
+    candidates = st.session_state.story_candidates
+    st.session_state.story_messages.append({"role": "user", "content": candidates["request"]})
+    st.session_state.story_messages.append({"role": "assistant", "content": result["content"],
+                                            "thinking": result["thinking"], "model": result["answered_by"],
+                                            "truncated": result["truncated"]})
+    st.session_state.story_generated = True
+    st.session_state.story_candidates = None
+    
+    # Offer the chosen version for similar requests later; cut-off text stays out, as it does of the cache
+    if not result["truncated"]:
+        get_similarity_index().add("story", candidates["attributes"], candidates["topic"], candidates["request"],
+                                   result["content"], result["thinking"], result["answered_by"])
+
+@st.fragment
+def show_conversation(model: str, temperature: float, revise: bool):
+    """Display the story conversation; chat turns rerun only this fragment."""
+    st.subheader("Conversation")
+    render_history(st.session_state.story_messages, "story")
+    render_continue(st.session_state.story_messages, "story", model, temperature,
+                    st.session_state.story_history, CONVERSATION_SYSTEM_PROMPT)
+    
+    # Results of a side-by-side comparison waiting for the user to pick one
+    if st.session_state.story_comparison:
+        render_comparison(st.session_state.story_comparison, "story", on_select=keep_comparison_result)
+    
+    # Ranked candidates waiting for the user to pick one
+    if st.session_state.story_candidates:
+        render_candidates(st.session_state.story_candidates, "story", on_select=keep_candidate_result)
+    
+    # New turns render here, above the chat input
+    new_turn = st.container()
+    
+    # Chat input for conversation after story generation
+    if st.session_state.story_generated:
+        user_input = st.chat_input("Ask about your story or request changes...")
+        
+        if user_input:
+            with new_turn:
+                from utils.groq_client import GroqGenerator
+                
+                # Add user message to chat history
+                st.session_state.story_messages.append({"role": "user", "content": user_input})
+                render_message({"role": "user", "content": user_input})
+                
+                try:
+                    # Create generator instance with current settings
+                    generator = GroqGenerator(model_name=model, temperature=temperature, on_queue=queue_status())
+                    
+                    # Apply small change requests as targeted edits to the latest draft
+                    revision = render_revision(generator, st.session_state.story_messages, user_input) if revise else None
+                    
+                    if revision is not None:
+                        st.session_state.story_messages.append(revision)
+                    else:
+                        # Fit the conversation into the model's token budget, summarizing older turns
+                        window = st.session_state.story_history.fit_conversation(
+                            st.session_state.story_messages, CONVERSATION_SYSTEM_PROMPT, model
+                        )
+                        
+                        # Stream the response
+                        chunks = generator.stream_chat_with_history(window.messages, system_prompt=window.system_prompt)
+                        
+                        # Render tokens as they arrive, splitting out DeepSeek thinking
+                        thinking, response = render_stream(chunks, parse_thinking=model in THINKING_MODELS)
+                        
+                        # Add response to chat history
+                        st.session_state.story_messages.append({
+                            "role": "assistant", 
+                            "content": response,
+                            "thinking": thinking,
+                            "tokens_saved": window.tokens_saved,
+                            "model": generator.answered_by,
+                            "truncated": generator.truncated
+                        })
+                
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+
 def show():
     """Display the Short Story Generator page."""
     st.header("Short Story Generator")
@@ -32,12 +133,21 @@ def show():
     Enter the details below and click "Generate Story" to create your narrative.
     """)
     
-    # Initialize session state for chat history
+    # Load the latest messages of this session's saved conversation
     if "story_messages" not in st.session_state:
-        st.session_state.story_messages = []
+        st.session_state.story_messages = open_conversation("story")
     
     if "story_generated" not in st.session_state:
-        st.session_state.story_generated = False
+        st.session_state.story_generated = len(st.session_state.story_messages) > 0
+    
+    if "story_history" not in st.session_state:
+        st.session_state.story_history = HistoryManager()
+    
+    if "story_comparison" not in st.session_state:
+        st.session_state.story_comparison = None
+    
+    if "story_candidates" not in st.session_state:
+        st.session_state.story_candidates = None
     
     # Input form
     with st.container():
@@ -65,8 +175,8 @@ def show():
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            model = st.selectbox("Model", AVAILABLE_MODELS, 
-                               help="Select the AI model to use for generation",
+            model = st.selectbox("Model", AVAILABLE_MODELS + [AUTO_MODEL], format_func=model_label,
+                               help="Select the AI model to use for generation, or let auto pick the fastest suitable one",
                                key="story_model")
         
         with col2:
@@ -79,96 +189,145 @@ def show():
                                         options=[300, 500, 750, 1000, 1500, 2000],
                                         value=750,
                                         help="Select the approximate length of the story")
+        
+        use_cache = st.checkbox("Reuse cached results", value=True,
+                                help="Serve identical low-temperature requests from the response cache, "
+                                     "and near-identical ones from earlier results",
+                                key="story_use_cache")
+        
+        revise = st.checkbox("Apply change requests as edits", value=True, key="story_revise",
+                             help="Return follow-up changes as small edits to the latest draft instead of rewriting it")
+        
+        long_form = st.checkbox("Long-form mode (outline, then parallel sections)", key="story_long_form",
+                                help="Plan an outline first, then write all sections at the same time")
+        
+        best_of = st.checkbox("Generate several candidates", key="story_best_of",
+                              help="Generate several versions at once and rank them, best first")
+        candidate_count = 1
+        if best_of:
+            candidate_count = st.slider("Candidates", 2, 5, 3, key="story_candidate_count")
+        
+        compare = st.checkbox("Compare models side by side", key="story_compare",
+                              help="Run the same request on several models concurrently")
+        compare_models = []
+        if compare:
+            compare_models = st.multiselect("Models to compare", AVAILABLE_MODELS,
+                                            default=["llama-3.3-70b-versatile", "gemma2-9b-it", "qwen-qwq-32b"],
+                                            key="story_compare_models")
+    
+    # Earlier results for a similar topic with the same settings
+    attributes = {"genre": genre, "style": style, "word_count": word_count}
+    similar = find_similar(st.session_state.story_messages, attributes, topic)
+    if similar is not None:
+        render_similar(similar, "story", on_select=keep_similar_result)
+    
+    # Pick a model for "auto" from the current inputs
+    model, route = resolve_model(model, "story", attributes)
     
     # Generate button
     generate_pressed = st.button("Generate Story", use_container_width=True)
     
-    # Display chat history
-    st.subheader("Conversation")
-    for message in st.session_state.story_messages:
-        with st.chat_message(message["role"]):
-            if message["role"] == "assistant" and "thinking" in message and message["thinking"]:
-                with st.expander("View thinking process"):
-                    st.markdown(message["thinking"])
-            st.markdown(message["content"])
+    # Conversation; chat turns rerun only this fragment
+    show_conversation(model, temperature, revise)
+    
+    request_message = f"Please write a {word_count}-word {genre} short story about '{topic}' in the style of {style}."
+    
+    # Compare several models on the same request
+    if generate_pressed and compare and compare_models and topic and genre and style:
+        results = run_comparison(compare_models, temperature, lambda generator: generator.agenerate_content(
+            SHORT_STORY_TEMPLATE, use_cache=use_cache, topic=topic, genre=genre, style=style, word_count=word_count))
+        st.session_state.story_comparison = {"request": request_message, "results": results}
+        st.rerun()
+    
+    # Serve a near-identical request from its earlier result
+    elif generate_pressed and use_cache and similar is not None and similar.similarity >= SERVE_THRESHOLD:
+        keep_similar_result(similar)
+        st.rerun()
+    
+    # Generate several candidates concurrently and rank them
+    elif generate_pressed and best_of and topic and genre and style:
+        if route is not None:
+            route.record()
+        results = run_candidates(
+            model,
+            temperature,
+            lambda generator: generator.agenerate_content(
+                SHORT_STORY_TEMPLATE, use_cache=False, topic=topic, genre=genre, style=style, word_count=word_count),
+            candidate_count,
+            word_count=word_count
+        )
+        st.session_state.story_candidates = {"request": request_message, "results": results,
+                                          "topic": topic, "attributes": attributes}
+        st.rerun()
     
     # Handle story generation
-    if generate_pressed and topic and genre and style:
-        with st.spinner("Generating your short story..."):
-            try:
-                # Create generator instance
-                generator = GroqGenerator(model_name=model, temperature=temperature)
+    elif generate_pressed and topic and genre and style:
+        from utils.groq_client import GroqGenerator
+        
+        try:
+            if route is not None:
+                route.record()
+            
+            # Create generator instance
+            generator = GroqGenerator(model_name=model, temperature=temperature, on_queue=queue_status())
+            
+            if long_form:
+                from utils.longform import LongFormWriter
                 
-                # Generate the story
-                response = generator.generate_content(
+                # Outline first, then write the sections concurrently
+                writer = LongFormWriter(generator, target_words=word_count)
+                chunks = writer.stream(
                     SHORT_STORY_TEMPLATE,
+                    use_cache=use_cache,
                     topic=topic,
                     genre=genre,
                     style=style,
                     word_count=word_count
                 )
                 
-                # Check if we need to extract thinking for DeepSeek model
-                thinking = ""
-                if model == "deepseek-r1-distill-llama-70b":
-                    thinking, response = generator.parse_deepseek_thinking(response)
+                # Sections arrive with their thinking already removed
+                thinking, _ = render_stream(chunks, parse_thinking=False)
+                response = writer.content
                 
-                # Store the user query and response in session state
-                st.session_state.story_messages.append({
-                    "role": "user", 
-                    "content": f"Please write a {word_count}-word {genre} short story about '{topic}' in the style of {style}."
-                })
-                st.session_state.story_messages.append({
-                    "role": "assistant", 
-                    "content": response,
-                    "thinking": thinking
-                })
-                st.session_state.story_generated = True
+                # The stored text is the consistency-edited one, not the streamed sections
+                details = {"model": writer.answered_by, "truncated": writer.truncated,
+                           "cut_sections": writer.cut_sections, "consistency_edits": writer.consistency_edits}
+            else:
+                # Generate the story
+                chunks = generator.stream_content(
+                    SHORT_STORY_TEMPLATE,
+                    use_cache=use_cache,
+                    topic=topic,
+                    genre=genre,
+                    style=style,
+                    word_count=word_count
+                )
                 
-                # Force refresh to show new messages
-                st.rerun()
+                # Render tokens as they arrive, splitting out DeepSeek thinking
+                thinking, response = render_stream(chunks, parse_thinking=model in THINKING_MODELS)
+                details = {"model": generator.answered_by, "truncated": generator.truncated}
             
-            except Exception as e:
-                st.error(f"Error generating story: {str(e)}")
-    
-    # Chat input for conversation after story generation
-    if st.session_state.story_generated:
-        user_input = st.chat_input("Ask about your story or request changes...")
-        
-        if user_input:
-            # Add user message to chat history
-            st.session_state.story_messages.append({"role": "user", "content": user_input})
+            # Store the user query and response in session state
+            st.session_state.story_messages.append({
+                "role": "user", 
+                "content": request_message
+            })
+            st.session_state.story_messages.append({
+                "role": "assistant", 
+                "content": response,
+                "thinking": thinking,
+                "routed": route.describe() if route is not None else "",
+                **details
+            })
+            st.session_state.story_generated = True
             
-            with st.spinner("Thinking..."):
-                try:
-                    # Create generator instance with current settings
-                    generator = GroqGenerator(model_name=model, temperature=temperature)
-                    
-                    # Convert session state messages to format needed for the API
-                    api_messages = [{"role": "system", "content": CONVERSATION_SYSTEM_PROMPT}]
-                    for msg in st.session_state.story_messages[:-1]:  # Exclude latest user message
-                        api_messages.append({"role": msg["role"], "content": msg["content"]})
-                    
-                    # Add the latest user message
-                    api_messages.append({"role": "user", "content": user_input})
-                    
-                    # Get response
-                    response = generator.chat_with_history(api_messages[1:], system_prompt=CONVERSATION_SYSTEM_PROMPT)
-                    
-                    # Check if we need to extract thinking for DeepSeek model
-                    thinking = ""
-                    if model == "deepseek-r1-distill-llama-70b":
-                        thinking, response = generator.parse_deepseek_thinking(response)
-                    
-                    # Add response to chat history
-                    st.session_state.story_messages.append({
-                        "role": "assistant", 
-                        "content": response,
-                        "thinking": thinking
-                    })
-                    
-                    # Force refresh to show new messages
-                    st.rerun()
-                
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
\ No newline at end of file
+            # Offer this result for similar requests later; cut-off text stays out, as it does of the cache
+            if not details["truncated"] and not details.get("cut_sections"):
+                get_similarity_index().add("story", attributes, topic, request_message, response, thinking,
+                                           details["model"])
+            
+            # Force refresh to show new messages
+            st.rerun()
+        
+        except Exception as e:
+            st.error(f"Error generating story: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""
+Shared background event loop for async model calls.
+
+Pooled clients hold async HTTP connections that are bound to the event
+loop that opened them, so every coroutine that talks to the models runs on
+this single long-lived loop. Synchronous callers (Streamlit pages, worker
+threads) submit work with run_async and wait on the returned future.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="intellectai-async", daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+def run_async(coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+    """
+    Schedule a coroutine on the shared background loop.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        A thread-safe future resolving to the coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_sync(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    Run a coroutine on the shared background loop and wait for its result.
+
+    Args:
+        coro: The coroutine to run
+        timeout: Optional number of seconds to wait
+
+    Returns:
+        The coroutine's result
+    """
+    return run_async(coro).result(timeout)
@@ -0,0 +1,355 @@
+"""
+Offline chat model backends for testing and benchmarking.
+
+Select a backend with the INTELLECTAI_BACKEND environment variable:
+
+- groq: the live Groq API (default)
+- fake: synthesized responses with configurable latency and error rates
+- replay: responses replayed from a cassette file
+- record: live Groq responses, recorded to a cassette file
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+from utils.models import BACKENDS, DEFAULT_BACKEND
+from utils.tokens import estimate_tokens
+
+DEFAULT_CASSETTE_PATH = os.environ.get("INTELLECTAI_CASSETTE", os.path.join(".cache", "cassette.jsonl"))
+
+# Length of a synthesized response when the prompt asks for none
+DEFAULT_FAKE_WORDS = 250
+
+_WORD_COUNT_PATTERN = re.compile(r"(\d+)(?:\s*-\s*\d+)?\s*words", re.IGNORECASE)
+_CHUNK_PATTERN = re.compile(r"\S+\s*")
+
+_FAKE_VOCABULARY = (
+    "the light of morning falls across a quiet town where every story begins "
+    "with a question and ends with something learned along the way through "
+    "memory and wonder we follow characters who change as the world around them shifts"
+).split()
+
+
+class FakeBackendError(Exception):
+    """Simulated provider error, shaped like an API status error."""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = None
+
+
+def _message_key(model_name: str, messages: List[BaseMessage], stop: Optional[List[str]]) -> str:
+    """Build the cassette key identifying a request."""
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "messages": [[message.type, message.content] for message in messages],
+            "stop": stop or [],
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _usage(messages: List[BaseMessage], content: str) -> Dict[str, int]:
+    """Estimate usage metadata for an offline response."""
+    input_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+    output_tokens = estimate_tokens(content)
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens}
+
+
+class Cassette:
+    """JSONL file of recorded responses keyed by request."""
+
+    def __init__(self, path: str = DEFAULT_CASSETTE_PATH):
+        """
+        Load a cassette, creating an empty one if the file does not exist.
+
+        Args:
+            path: Path of the cassette file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._responses: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._responses[record["key"]] = record["response"]
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the recorded response for a key, if any."""
+        return self._responses.get(key)
+
+    def record(self, key: str, model_name: str, response: str):
+        """
+        Append a response to the cassette.
+
+        Args:
+            key: Request key
+            model_name: Model that produced the response
+            response: The response text
+        """
+        with self._lock:
+            self._responses[key] = response
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "model": model_name, "response": response}) + "\n")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Synthesizes responses locally with a configurable latency profile.
+
+    Responses are deterministic per prompt, sized from any "N words" hint
+    in the prompt, and start with a <thinking> block when thinking is set.
+    Like the live API, they end at a stop sequence or after max_tokens.
+    """
+
+    model_name: str = "fake"
+    time_to_first_token: float = 0.2
+    tokens_per_second: float = 250.0
+    error_rate: float = 0.0
+    thinking: bool = False
+    max_tokens: Optional[int] = None
+    stop: Optional[List[str]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "intellectai-fake"
+
+    def _response_text(self, messages: List[BaseMessage]) -> str:
+        """Synthesize a deterministic response for the prompt."""
+        prompt = "\n".join(str(message.content) for message in messages)
+        rng = random.Random(hashlib.sha256((self.model_name + prompt).encode("utf-8")).digest())
+        counts = [int(match) for match in _WORD_COUNT_PATTERN.findall(prompt)]
+        target = min(max(counts), 3000) if counts else DEFAULT_FAKE_WORDS
+        topic_words = [word for word in re.findall(r"[A-Za-z]{4,}", str(messages[-1].content))][:12]
+        vocabulary = list(_FAKE_VOCABULARY) + topic_words
+
+        paragraphs = []
+        written = 0
+        while written < target:
+            sentences = []
+            for _ in range(rng.randint(3, 5)):
+                words = [rng.choice(vocabulary) for _ in range(rng.randint(8, 16))]
+                sentences.append(" ".join(words).capitalize() + ".")
+                written += len(words)
+            paragraphs.append(" ".join(sentences))
+        text = "\n\n".join(paragraphs)
+
+        if self.thinking:
+            text = (f"<thinking>\nThe request is about {' '.join(topic_words[:6]) or 'the topic'}. "
+                    f"I will plan the structure, then write about {target} words.\n</thinking>\n\n{text}")
+        return text
+
+    def _limited_text(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> Tuple[str, str]:
+        """Synthesize a response cut at stop sequences and max_tokens, with its finish reason."""
+        text = self._response_text(messages)
+        for sequence in (stop or []) + (self.stop or []):
+            index = text.find(sequence)
+            if index >= 0:
+                text = text[:index]
+        if self.max_tokens is None or estimate_tokens(text) <= self.max_tokens:
+            return text, "stop"
+        pieces, tokens = [], 0
+        for piece in _CHUNK_PATTERN.findall(text):
+            tokens += estimate_tokens(piece)
+            if tokens > self.max_tokens:
+                break
+            pieces.append(piece)
+        return "".join(pieces), "length"
+
+    def _maybe_fail(self):
+        """Raise a simulated provider error at the configured rate."""
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeBackendError(f"Simulated failure from {self.model_name}")
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._maybe_fail()
+        text, finish_reason = self._limited_text(messages, stop)
+        chunks = _CHUNK_PATTERN.findall(text)
+        time.sleep(self.time_to_first_token + len(chunks) / self.tokens_per_second)
+        message = AIMessage(content=text, usage_metadata=_usage(messages, text),
+                            response_metadata={"finish_reason": finish_reason, "model_name": self.model_name})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._maybe_fail()
+        text, finish_reason = self._limited_text(messages, stop)
+        chunks = _CHUNK_PATTERN.findall(text)
+        await asyncio.sleep(self.time_to_first_token + len(chunks) / self.tokens_per_second)
+        message = AIMessage(content=text, usage_metadata=_usage(messages, text),
+                            response_metadata={"finish_reason": finish_reason, "model_name": self.model_name})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self._maybe_fail()
+        text, finish_reason = self._limited_text(messages, stop)
+        time.sleep(self.time_to_first_token)
+        for piece in _CHUNK_PATTERN.findall(text):
+            time.sleep(1.0 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata=_usage(messages, text),
+            response_metadata={"finish_reason": finish_reason, "model_name": self.model_name},
+        ))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        self._maybe_fail()
+        text, finish_reason = self._limited_text(messages, stop)
+        await asyncio.sleep(self.time_to_first_token)
+        for piece in _CHUNK_PATTERN.findall(text):
+            await asyncio.sleep(1.0 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata=_usage(messages, text),
+            response_metadata={"finish_reason": finish_reason, "model_name": self.model_name},
+        ))
+
+
+class ReplayChatModel(BaseChatModel):
+    """Replays recorded responses from a cassette; unknown requests fail."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model_name: str = "replay"
+    cassette: Cassette
+
+    @property
+    def _llm_type(self) -> str:
+        return "intellectai-replay"
+
+    def _lookup(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> str:
+        """Return the recorded response for a request."""
+        response = self.cassette.get(_message_key(self.model_name, messages, stop))
+        if response is None:
+            raise KeyError(f"No recorded response for this {self.model_name} request in {self.cassette.path}")
+        return response
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = self._lookup(messages, stop)
+        message = AIMessage(content=text, usage_metadata=_usage(messages, text),
+                            response_metadata={"finish_reason": "stop", "model_name": self.model_name})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text = self._lookup(messages, stop)
+        for piece in _CHUNK_PATTERN.findall(text):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata=_usage(messages, text),
+            response_metadata={"finish_reason": "stop", "model_name": self.model_name},
+        ))
+
+
+class RecordingChatModel(BaseChatModel):
+    """Forwards requests to a live model and records its responses to a cassette."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model_name: str = "record"
+    delegate: BaseChatModel
+    cassette: Cassette
+
+    @property
+    def _llm_type(self) -> str:
+        return "intellectai-record"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        message = self.delegate.invoke(messages, stop=stop, **kwargs)
+        self.cassette.record(_message_key(self.model_name, messages, stop), self.model_name, message.content)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        message = await self.delegate.ainvoke(messages, stop=stop, **kwargs)
+        self.cassette.record(_message_key(self.model_name, messages, stop), self.model_name, message.content)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        parts = []
+        for message_chunk in self.delegate.stream(messages, stop=stop, **kwargs):
+            parts.append(message_chunk.content)
+            chunk = ChatGenerationChunk(message=message_chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(message_chunk.content, chunk=chunk)
+            yield chunk
+        self.cassette.record(_message_key(self.model_name, messages, stop), self.model_name, "".join(parts))
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path: str = DEFAULT_CASSETTE_PATH) -> Cassette:
+    """Return the shared cassette for a path."""
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+
+def create_backend_model(backend: str, model_name: str, thinking: bool,
+                         live_model: Callable[[], BaseChatModel], max_tokens: Optional[int] = None,
+                         stop: Optional[List[str]] = None) -> BaseChatModel:
+    """
+    Construct a chat model for a non-default backend.
+
+    Args:
+        backend: One of BACKENDS other than "groq"
+        model_name: The model being simulated, replayed or recorded
+        thinking: Whether the model emits a <thinking> block
+        live_model: Factory for the live Groq model, used when recording
+        max_tokens: Output limit of simulated responses
+        stop: Stop sequences of simulated responses
+
+    Returns:
+        The chat model instance
+    """
+    if backend == "fake":
+        return FakeChatModel(
+            model_name=model_name,
+            thinking=thinking,
+            time_to_first_token=float(os.environ.get("INTELLECTAI_FAKE_TTFT", 0.2)),
+            tokens_per_second=float(os.environ.get("INTELLECTAI_FAKE_TPS", 250)),
+            error_rate=float(os.environ.get("INTELLECTAI_FAKE_ERROR_RATE", 0)),
+            max_tokens=max_tokens,
+            stop=stop,
+        )
+    if backend == "replay":
+        return ReplayChatModel(model_name=model_name, cassette=get_cassette())
+    if backend == "record":
+        return RecordingChatModel(model_name=model_name, delegate=live_model(), cassette=get_cassette())
+    raise ValueError(f"Unknown backend: {backend!r}. Expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,190 @@
+"""
+Output budgets: how much a single request may generate.
+
+Each content type's form inputs (word count, poem type, section length)
+are translated into a max_tokens limit, stop sequences that cut off
+trailing commentary, and for thinking models a cap on the <thinking>
+block. Limits are rounded up to a few fixed steps so requests with
+similar budgets share a pooled client.
+"""
+import os
+from typing import Dict, Optional, Tuple
+from utils.models import THINKING_MODELS
+from utils.poetry import POEM_FORMS
+from utils.tokens import context_window, estimate_tokens
+
+# Output tokens per English word, a little above the usual 1.3
+TOKENS_PER_WORD = 1.35
+
+# Requested lengths are approximate, so budgets leave room above them
+LENGTH_HEADROOM = 1.3
+
+# Budget for chat replies and prompts without a content-specific budget
+DEFAULT_MAX_TOKENS = int(os.environ.get("INTELLECTAI_MAX_TOKENS", 4096))
+
+# Cap on a thinking model's <thinking> block
+THINKING_TOKENS = int(os.environ.get("INTELLECTAI_THINKING_TOKENS", 1024))
+
+# Steps max_tokens is rounded up to, ending at the largest budget allowed
+BUDGET_STEPS = (256, 384, 512, 768, 1024, 1536, 2048, 3072, 4096, 6144, 8192)
+
+# Upper end of the YouTube script prompt's 800-1200 words
+SCRIPT_WORDS = 1200
+
+# Tokens per line of verse, title lines included
+TOKENS_PER_LINE = 14
+
+# Typical length of poem types without a fixed line count
+POEM_LINES = {
+    "Free Verse": 30,
+    "Ballad": 40,
+    "Ode": 50,
+    "Elegy": 40,
+    "Epic": 150,
+    "Blank Verse": 40,
+    "Acrostic": 20,
+}
+DEFAULT_POEM_LINES = 40
+
+# Preambles to explanations that models append after the requested piece
+COMMENTARY_STOPS = ("\n\nNote:", "\n\nExplanation:", "\n\nAnalysis:")
+
+STOP_SEQUENCES = {
+    "youtube_script": COMMENTARY_STOPS,
+    "short_story": COMMENTARY_STOPS,
+    "poem": COMMENTARY_STOPS,
+}
+
+
+class OutputBudget:
+    """Generation limits for one request."""
+
+    def __init__(self, max_tokens: int, stop: Tuple[str, ...] = (), thinking_tokens: Optional[int] = None):
+        """
+        Initialize the budget.
+
+        Args:
+            max_tokens: Limit on generated tokens, thinking included
+            stop: Sequences that end the response
+            thinking_tokens: Cap on the <thinking> block, None for models
+                that do not think aloud
+        """
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.thinking_tokens = thinking_tokens
+
+    def client_options(self) -> Dict:
+        """Return the chat model settings enforcing this budget."""
+        options = {"max_tokens": self.max_tokens}
+        if self.stop:
+            options["stop"] = self.stop
+        return options
+
+    @property
+    def thinking_words(self) -> Optional[int]:
+        """The thinking cap in words, for instructions to the model."""
+        if self.thinking_tokens is None:
+            return None
+        return int(self.thinking_tokens / TOKENS_PER_WORD)
+
+
+def round_budget(tokens: float, model_name: str, prompt_tokens: int = 0) -> int:
+    """
+    Round a token count up to the next budget step.
+
+    Args:
+        tokens: The tokens the response may need
+        model_name: The model generating the response
+        prompt_tokens: Estimated prompt size, which shares the context window
+
+    Returns:
+        The max_tokens limit
+    """
+    limit = next((step for step in BUDGET_STEPS if tokens <= step), BUDGET_STEPS[-1])
+    # Prompt and response must fit the context window together
+    return max(BUDGET_STEPS[0], min(limit, context_window(model_name) - prompt_tokens))
+
+
+def _words_to_tokens(words: float) -> float:
+    """Estimate the output tokens for a requested number of words."""
+    return words * TOKENS_PER_WORD * LENGTH_HEADROOM
+
+
+def answer_tokens(prompt_name: str, variables: Dict, model_name: str) -> float:
+    """Estimate the longest reasonable answer for a prompt and its inputs."""
+    if prompt_name == "short_story":
+        return _words_to_tokens(int(variables["word_count"]))
+    if prompt_name == "youtube_script":
+        return _words_to_tokens(SCRIPT_WORDS)
+    if prompt_name == "poem":
+        poem_type = variables["poem_type"]
+        form = POEM_FORMS.get(poem_type)
+        lines = form.lines if form is not None else POEM_LINES.get(poem_type, DEFAULT_POEM_LINES)
+        return (lines + 2) * TOKENS_PER_LINE * LENGTH_HEADROOM
+    if prompt_name == "longform_section":
+        return _words_to_tokens(int(variables["section_words"]))
+    if prompt_name == "longform_outline":
+        # Notes plus a title and a few sentences per section
+        return 200 + int(variables["sections"]) * 80
+    if prompt_name == "revision":
+        # Edits rarely exceed the draft itself
+        return estimate_tokens(str(variables["draft"]), model_name) + 256
+    if prompt_name == "poem_repair":
+        return estimate_tokens(str(variables["poem"]), model_name) + 128
+    return DEFAULT_MAX_TOKENS
+
+
+def output_budget(prompt_name: str, variables: Dict, model_name: str, prompt_tokens: int = 0) -> OutputBudget:
+    """
+    Derive the limits for a templated generation from its inputs.
+
+    Args:
+        prompt_name: Name of the registered prompt, see utils.prompting
+        variables: Variables formatted into the prompt
+        model_name: The model generating the response
+        prompt_tokens: Estimated prompt size
+
+    Returns:
+        The request's budget
+    """
+    answer = answer_tokens(prompt_name, variables, model_name)
+    if model_name in THINKING_MODELS:
+        # Stop sequences could match inside the thinking block
+        return OutputBudget(round_budget(answer + THINKING_TOKENS, model_name, prompt_tokens),
+                            thinking_tokens=THINKING_TOKENS)
+    return OutputBudget(round_budget(answer, model_name, prompt_tokens), STOP_SEQUENCES.get(prompt_name, ()))
+
+
+def chat_budget(model_name: str, prompt_tokens: int = 0) -> OutputBudget:
+    """
+    Return the limits for a conversation reply.
+
+    Args:
+        model_name: The model generating the reply
+        prompt_tokens: Estimated size of the conversation so far
+
+    Returns:
+        The reply's budget
+    """
+    if model_name in THINKING_MODELS:
+        return OutputBudget(round_budget(DEFAULT_MAX_TOKENS + THINKING_TOKENS, model_name, prompt_tokens),
+                            thinking_tokens=THINKING_TOKENS)
+    return OutputBudget(round_budget(DEFAULT_MAX_TOKENS, model_name, prompt_tokens))
+
+
+def continuation_budget(budget: OutputBudget, used_tokens: int, model_name: str,
+                        prompt_tokens: int = 0) -> OutputBudget:
+    """
+    Return the limits for continuing a response that was cut off.
+
+    Args:
+        budget: The original request's budget
+        used_tokens: Tokens the partial response already used
+        model_name: The model continuing the response
+        prompt_tokens: Estimated prompt size, not counting the partial response
+
+    Returns:
+        The rest of the original budget, without a thinking cap
+    """
+    remaining = max(0, budget.max_tokens - used_tokens)
+    return OutputBudget(round_budget(remaining, model_name, prompt_tokens + used_tokens), budget.stop)
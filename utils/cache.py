@@ -0,0 +1,233 @@
+"""
+Two-tier response cache for generation requests.
+
+Responses are kept in an in-memory LRU with size and TTL bounds, backed by
+an on-disk SQLite tier that survives restarts.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Default location of the on-disk cache tier
+DEFAULT_CACHE_PATH = os.environ.get(
+    "INTELLECTAI_CACHE_PATH", os.path.join(".cache", "responses.sqlite3")
+)
+
+
+class CachePolicy:
+    """Decides whether a request is allowed to use the cache."""
+
+    def __init__(self, enabled: bool = True, max_temperature: float = 0.3):
+        """
+        Initialize the policy.
+
+        Args:
+            enabled: Master switch for caching
+            max_temperature: Highest temperature whose outputs are cached;
+                hotter sampling is expected to vary between calls
+        """
+        self.enabled = enabled
+        self.max_temperature = max_temperature
+
+    def allows(self, temperature: float) -> bool:
+        """Return True if a request at this temperature may be cached."""
+        return self.enabled and temperature <= self.max_temperature
+
+
+class ResponseCache:
+    """
+    In-memory LRU cache backed by SQLite.
+
+    Lookups check memory first, then disk; disk hits are promoted back into
+    memory. All operations are thread-safe.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 3600.0,
+        disk_ttl: float = 7 * 24 * 3600.0,
+        db_path: Optional[str] = DEFAULT_CACHE_PATH,
+        policy: Optional[CachePolicy] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of responses kept in memory
+            ttl: Seconds a response stays valid in memory
+            disk_ttl: Seconds a response stays valid on disk
+            db_path: SQLite file for the disk tier, or None for memory only
+            policy: Caching policy, defaults to low temperatures only
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self.db_path = db_path
+        self.policy = policy or CachePolicy(
+            max_temperature=float(os.environ.get("INTELLECTAI_CACHE_MAX_TEMPERATURE", 0.3))
+        )
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "bypassed": 0,
+        }
+
+    @staticmethod
+    def make_key(template_id: str, variables: Dict, model_name: str, temperature: float) -> str:
+        """
+        Build a stable cache key for a generation request.
+
+        Args:
+            template_id: Identity of the prompt template
+            variables: Variables formatted into the template
+            model_name: The model that generates the response
+            temperature: Sampling temperature
+
+        Returns:
+            A hex digest identifying the request
+        """
+        payload = json.dumps(
+            {
+                "template": template_id,
+                "variables": variables,
+                "model": model_name,
+                "temperature": round(float(temperature), 3),
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """Open the disk tier on first use. Caller holds the lock."""
+        if self.db_path is None:
+            return None
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.disk_ttl,)
+            )
+            self._db.commit()
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            db = self._connection()
+            if db is not None:
+                row = db.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.disk_ttl:
+                    self._remember(key, row[0], now)
+                    self._counters["disk_hits"] += 1
+                    return row[0]
+
+            self._counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        """
+        Store a response in both tiers.
+
+        Args:
+            key: Key from make_key
+            value: The generated response
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            db = self._connection()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, value, now),
+                )
+                db.commit()
+            self._counters["stores"] += 1
+
+    def record_bypass(self):
+        """Count a request that skipped the cache by policy or opt-out."""
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    def _remember(self, key: str, value: str, now: float):
+        """Insert into the memory tier, evicting the oldest entries. Caller holds the lock."""
+        self._memory[key] = (value, now)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Remove every cached response from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            db = self._connection()
+            if db is not None:
+                db.execute("DELETE FROM responses")
+                db.commit()
+
+    def stats(self) -> Dict:
+        """
+        Return hit/miss counters.
+
+        Returns:
+            Counters plus the memory size and overall hit rate
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_size"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
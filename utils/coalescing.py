@@ -0,0 +1,395 @@
+"""
+Single-flight coalescing of identical in-flight generation requests.
+
+When several sessions submit the same request at the same time, only the
+first one calls the model. The others wait for its result or, for a
+streamed request, replay the chunks received so far and then follow the
+same upstream stream. Only requests still in flight are shared; finished
+ones are served by the response cache, if at all.
+"""
+import asyncio
+import os
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional, TypeVar
+from utils.telemetry import get_telemetry
+
+# Whether identical concurrent requests share one upstream call
+COALESCE_ENABLED = os.environ.get("INTELLECTAI_COALESCE", "1").lower() not in ("0", "false", "no")
+
+T = TypeVar("T")
+
+
+def thread_bound(callback: Optional[Callable]) -> Optional[Callable]:
+    """
+    Wrap a callback so it only runs on the thread that created the wrapper.
+
+    A shared stream may be driven by whichever subscriber is reading, and a
+    UI callback must not fire on another session's thread.
+    """
+    if callback is None:
+        return None
+    owner = threading.get_ident()
+
+    def bound(*args):
+        if threading.get_ident() == owner:
+            callback(*args)
+    return bound
+
+
+def _adopt(adopt: Optional[Callable[[Any], None]], outcome: Any):
+    """Hand a finished call's captured outcome to a waiter, if both sides asked for it."""
+    if adopt is not None and outcome is not None:
+        adopt(outcome)
+
+
+def _capture(outcome: Optional[Callable[[], Any]]) -> Any:
+    """Run a leader's outcome function, if it has one."""
+    return outcome() if outcome is not None else None
+
+
+async def _captured(call: Awaitable[T], outcome: Optional[Callable[[], Any]]):
+    """Await a call, returning its result or error together with its outcome."""
+    try:
+        result, error = await call, None
+    except asyncio.CancelledError:
+        raise
+    except BaseException as exc:
+        result, error = None, exc
+    return result, error, _capture(outcome)
+
+
+class _Flight:
+    """A call in progress and what it has produced so far."""
+
+    def __init__(self, upstream=None, capture: Optional[Callable[[], Any]] = None):
+        self.condition = threading.Condition()
+        self.upstream = upstream
+        # The leader's outcome function, run by whichever subscriber ends the stream
+        self.capture = capture
+        self.chunks: List[str] = []
+        self.result = None
+        # What the leader's outcome function captured when the call ended
+        self.outcome = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        # Whether a subscriber is currently pulling the next upstream chunk
+        self.driving = False
+        self.subscribers = 0
+
+
+class _AsyncFlight:
+    """A streamed call in progress on an event loop."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.outcome = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+
+
+class SingleFlight:
+    """
+    Thread-safe registry of in-flight calls keyed by request.
+
+    Blocking calls and streams are shared between threads, async ones
+    between tasks on the same event loop. Errors reach every waiter.
+
+    State the leader's call leaves behind besides its text, such as a
+    truncation flag, is captured by its outcome function when the call
+    ends, whether it succeeded or failed, and handed to every waiter's
+    adopt function before the result or error reaches it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Flight] = {}
+        self._streams: Dict[Hashable, _Flight] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self._async_streams: Dict[Hashable, _AsyncFlight] = {}
+        self._collapsed = 0
+
+    def _record_collapsed(self, model: str):
+        """Count a request served by another request's upstream call."""
+        with self._lock:
+            self._collapsed += 1
+        get_telemetry().increment("coalesced", model)
+
+    def call(self, key: Hashable, fn: Callable[[], T], model: str = "",
+             outcome: Optional[Callable[[], Any]] = None, adopt: Optional[Callable[[Any], None]] = None) -> T:
+        """
+        Run a blocking call, or wait for an identical one already running.
+
+        Args:
+            key: Identity of the request
+            fn: Function making the upstream call
+            model: Model label for telemetry
+            outcome: Optional function capturing the leader's state once the call ends
+            adopt: Optional function applying that state to this caller
+
+        Returns:
+            The call's result
+        """
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight()
+        if not leader:
+            self._record_collapsed(model)
+            with flight.condition:
+                flight.condition.wait_for(lambda: flight.done)
+            _adopt(adopt, flight.outcome)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            flight.outcome = _capture(outcome)
+            with self._lock:
+                del self._calls[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+        return flight.result
+
+    def stream(self, key: Hashable, make_stream: Callable[[], Iterator[str]], model: str = "",
+               outcome: Optional[Callable[[], Any]] = None,
+               adopt: Optional[Callable[[Any], None]] = None) -> Iterator[str]:
+        """
+        Follow a streamed call, starting it unless an identical one is running.
+
+        Late subscribers first replay the chunks already received. Whichever
+        subscriber needs the next chunk pulls it from upstream, so the stream
+        keeps going if the first caller stops reading; it is closed once no
+        subscriber is left.
+
+        Args:
+            key: Identity of the request
+            make_stream: Function starting the upstream stream
+            model: Model label for telemetry
+            outcome: Optional function capturing the leader's state once the stream ends or fails
+            adopt: Optional function applying that state to this subscriber
+
+        Yields:
+            Chunks of the shared stream
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._streams[key] = _Flight(make_stream(), outcome)
+            flight.subscribers += 1
+        if not leader:
+            self._record_collapsed(model)
+
+        index = 0
+        try:
+            while True:
+                with flight.condition:
+                    flight.condition.wait_for(
+                        lambda: index < len(flight.chunks) or flight.done or not flight.driving
+                    )
+                    if index < len(flight.chunks):
+                        chunk = flight.chunks[index]
+                        index += 1
+                    elif flight.done:
+                        _adopt(adopt, flight.outcome)
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    else:
+                        flight.driving = True
+                        chunk = None
+                if chunk is not None:
+                    yield chunk
+                    continue
+
+                # This subscriber pulls the next chunk for everyone
+                finished, error = False, None
+                try:
+                    chunk = next(flight.upstream)
+                except StopIteration:
+                    finished = True
+                except BaseException as exc:
+                    finished, error = True, exc
+                if finished:
+                    # Captured on failure too, e.g. the truncated flag of a response that broke off
+                    try:
+                        flight.outcome = _capture(flight.capture)
+                    except BaseException as exc:
+                        error = error or exc
+                    with self._lock:
+                        if self._streams.get(key) is flight:
+                            del self._streams[key]
+                with flight.condition:
+                    if finished:
+                        flight.done, flight.error = True, error
+                    else:
+                        flight.chunks.append(chunk)
+                    flight.driving = False
+                    flight.condition.notify_all()
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0 and not flight.done
+                if abandoned and self._streams.get(key) is flight:
+                    del self._streams[key]
+            if abandoned:
+                flight.upstream.close()
+
+    async def acall(self, key: Hashable, make_call: Callable[[], Awaitable[T]], model: str = "",
+                    outcome: Optional[Callable[[], Any]] = None, adopt: Optional[Callable[[Any], None]] = None) -> T:
+        """
+        Await a call, or an identical one already running on this event loop.
+
+        The call runs as its own task, so a waiter being cancelled does not
+        cancel it for the others.
+
+        Args:
+            key: Identity of the request
+            make_call: Function returning the upstream call's awaitable
+            model: Model label for telemetry
+            outcome: Optional function capturing the leader's state once the call ends
+            adopt: Optional function applying that state to this caller
+
+        Returns:
+            The call's result
+        """
+        key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(_captured(make_call(), outcome))
+        if leader:
+            task.add_done_callback(lambda done: self._forget_task(key, done))
+        else:
+            self._record_collapsed(model)
+        result, error, state = await asyncio.shield(task)
+        _adopt(adopt, state)
+        if error is not None:
+            raise error
+        return result
+
+    def _forget_task(self, key: Hashable, task: asyncio.Future):
+        """Drop a finished call's task."""
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        if not task.cancelled():
+            # Marks the error as retrieved if every waiter has gone away
+            task.exception()
+
+    async def astream(self, key: Hashable, make_stream: Callable[[], AsyncIterator[str]], model: str = "",
+                      outcome: Optional[Callable[[], Any]] = None,
+                      adopt: Optional[Callable[[Any], None]] = None) -> AsyncIterator[str]:
+        """
+        Follow a streamed call on this event loop, starting it unless one is running.
+
+        The upstream stream is read by its own task and cancelled once no
+        subscriber is left.
+
+        Args:
+            key: Identity of the request
+            make_stream: Function starting the upstream stream
+            model: Model label for telemetry
+            outcome: Optional function capturing the leader's state once the stream ends or fails
+            adopt: Optional function applying that state to this subscriber
+
+        Yields:
+            Chunks of the shared stream
+        """
+        key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            flight = self._async_streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._async_streams[key] = _AsyncFlight()
+            flight.subscribers += 1
+        if leader:
+            flight.task = asyncio.ensure_future(self._pump(key, flight, make_stream(), outcome))
+        else:
+            self._record_collapsed(model)
+
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    index += 1
+                    yield flight.chunks[index - 1]
+                elif flight.done:
+                    _adopt(adopt, flight.outcome)
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    changed = flight.changed
+                    await changed.wait()
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0 and not flight.done
+                if abandoned and self._async_streams.get(key) is flight:
+                    del self._async_streams[key]
+            if abandoned:
+                flight.task.cancel()
+
+    async def _pump(self, key: Hashable, flight: _AsyncFlight, upstream: AsyncIterator[str],
+                    capture: Optional[Callable[[], Any]] = None):
+        """Read an upstream stream into its flight, waking subscribers on every chunk."""
+        try:
+            async for chunk in upstream:
+                flight.chunks.append(chunk)
+                self._notify(flight)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as error:
+            flight.error = error
+        finally:
+            await upstream.aclose()
+            flight.outcome = _capture(capture)
+            with self._lock:
+                if self._async_streams.get(key) is flight:
+                    del self._async_streams[key]
+            flight.done = True
+            self._notify(flight)
+
+    @staticmethod
+    def _notify(flight: _AsyncFlight):
+        """Wake the subscribers waiting for the next chunk."""
+        changed, flight.changed = flight.changed, asyncio.Event()
+        changed.set()
+
+    def stats(self) -> Dict:
+        """
+        Summarize coalescing.
+
+        Returns:
+            Calls and streams currently in flight, and requests collapsed so far
+        """
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._streams) + len(self._tasks) + len(self._async_streams),
+                "collapsed": self._collapsed,
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Return the process-wide single-flight registry."""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
@@ -0,0 +1,254 @@
+"""
+Persistent conversation storage.
+
+Messages are stored in SQLite keyed by session id and content type, so
+conversations survive restarts and reconnects and can be resumed by id.
+Pages keep only the most recent messages in memory and load older ones
+on demand.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Default location of the conversation database
+DEFAULT_CONVERSATION_PATH = os.environ.get(
+    "INTELLECTAI_CONVERSATION_PATH", os.path.join(".cache", "conversations.sqlite3")
+)
+
+# Messages of each conversation kept in memory: the latest history page plus a turn
+DEFAULT_RECENT_MESSAGES = 8
+
+# Message fields stored in their own columns; anything else goes to metadata
+_COLUMNS = ("role", "content", "thinking")
+
+
+class ConversationStore:
+    """Thread-safe SQLite store of sessions and their messages."""
+
+    def __init__(self, db_path: str = DEFAULT_CONVERSATION_PATH):
+        """
+        Initialize the store.
+
+        Args:
+            db_path: SQLite file holding the conversations
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database on first use. Caller holds the lock."""
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "session_id TEXT NOT NULL, content_type TEXT NOT NULL, seq INTEGER NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL, thinking TEXT NOT NULL DEFAULT '', "
+                "metadata TEXT NOT NULL DEFAULT '{}', created_at REAL NOT NULL, "
+                "PRIMARY KEY (session_id, content_type, seq))"
+            )
+            self._db.commit()
+        return self._db
+
+    def create_session(self) -> str:
+        """
+        Start a new session.
+
+        Returns:
+            The new session id
+        """
+        session_id = secrets.token_urlsafe(9)
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute("INSERT INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?)",
+                       (session_id, now, now))
+            db.commit()
+        return session_id
+
+    def session_exists(self, session_id: str) -> bool:
+        """Return True if a session with this id has been created."""
+        with self._lock:
+            row = self._connection().execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def append(self, session_id: str, content_type: str, message: Dict) -> int:
+        """
+        Store a message at the end of a conversation.
+
+        Args:
+            session_id: The session
+            content_type: script, story or poem
+            message: Message dictionary with 'role', 'content' and optional
+                'thinking' and other fields
+
+        Returns:
+            The message's position in the conversation
+        """
+        metadata = {key: value for key, value in message.items() if key not in _COLUMNS}
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            seq = db.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ? AND content_type = ?",
+                (session_id, content_type),
+            ).fetchone()[0]
+            db.execute(
+                "INSERT INTO messages (session_id, content_type, seq, role, content, thinking, metadata, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (session_id, content_type, seq, message["role"], message["content"],
+                 message.get("thinking") or "", json.dumps(metadata), now),
+            )
+            db.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+            db.commit()
+        return seq
+
+    def replace(self, session_id: str, content_type: str, seq: int, message: Dict):
+        """
+        Overwrite a stored message, such as a response that was continued.
+
+        Args:
+            session_id: The session
+            content_type: script, story or poem
+            seq: The message's position in the conversation
+            message: The new message dictionary
+        """
+        metadata = {key: value for key, value in message.items() if key not in _COLUMNS}
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "UPDATE messages SET role = ?, content = ?, thinking = ?, metadata = ? "
+                "WHERE session_id = ? AND content_type = ? AND seq = ?",
+                (message["role"], message["content"], message.get("thinking") or "", json.dumps(metadata),
+                 session_id, content_type, seq),
+            )
+            db.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+            db.commit()
+
+    def count(self, session_id: str, content_type: str) -> int:
+        """Return the number of messages in a conversation."""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ? AND content_type = ?",
+                (session_id, content_type),
+            ).fetchone()[0]
+
+    def load(self, session_id: str, content_type: str, start: int = 0,
+             end: Optional[int] = None) -> List[Dict]:
+        """
+        Load a range of messages.
+
+        Args:
+            session_id: The session
+            content_type: script, story or poem
+            start: Position of the first message
+            end: Position after the last message, or None for the rest
+
+        Returns:
+            Message dictionaries, oldest first
+        """
+        query = ("SELECT role, content, thinking, metadata FROM messages "
+                 "WHERE session_id = ? AND content_type = ? AND seq >= ?")
+        params = [session_id, content_type, start]
+        if end is not None:
+            query += " AND seq < ?"
+            params.append(end)
+        with self._lock:
+            rows = self._connection().execute(query + " ORDER BY seq", params).fetchall()
+
+        messages = []
+        for role, content, thinking, metadata in rows:
+            message = {"role": role, "content": content, "thinking": thinking}
+            message.update(json.loads(metadata))
+            messages.append(message)
+        return messages
+
+
+class Conversation:
+    """
+    One content type's conversation in a session.
+
+    Only the most recent messages are held in memory; everything is
+    written through to the store.
+    """
+
+    def __init__(self, store: ConversationStore, session_id: str, content_type: str,
+                 keep: int = DEFAULT_RECENT_MESSAGES):
+        """
+        Open a conversation, loading its most recent messages.
+
+        Args:
+            store: Backing conversation store
+            session_id: The session
+            content_type: script, story or poem
+            keep: Number of recent messages kept in memory
+        """
+        self.store = store
+        self.session_id = session_id
+        self.content_type = content_type
+        self.keep = keep
+        self.total = store.count(session_id, content_type)
+        self.messages: List[Dict] = store.load(session_id, content_type, max(0, self.total - keep))
+
+    def __len__(self) -> int:
+        return self.total
+
+    @property
+    def start(self) -> int:
+        """Position of the first message held in memory."""
+        return self.total - len(self.messages)
+
+    def append(self, message: Dict):
+        """Add a message to the conversation and store it."""
+        self.store.append(self.session_id, self.content_type, message)
+        self.messages.append(message)
+        self.total += 1
+        if len(self.messages) > self.keep:
+            del self.messages[:len(self.messages) - self.keep]
+
+    def replace_last(self, message: Dict):
+        """Replace the latest message, in memory and in the store."""
+        self.store.replace(self.session_id, self.content_type, self.total - 1, message)
+        self.messages[-1] = message
+
+    def load(self, start: int, end: Optional[int] = None) -> List[Dict]:
+        """
+        Return messages by position, from memory when possible.
+
+        Args:
+            start: Position of the first message
+            end: Position after the last message, or None for the rest
+
+        Returns:
+            Message dictionaries, oldest first
+        """
+        end = self.total if end is None else min(end, self.total)
+        if start >= self.start:
+            return self.messages[start - self.start:end - self.start]
+        return self.store.load(self.session_id, self.content_type, start, end)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """Return the process-wide conversation store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore()
+        return _store
@@ -2,71 +2,1190 @@
 Groq API client integration for the AI Storytelling App.
 """
 import os
-from typing import Dict, List, Optional
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+import httpx
 from langchain_groq import ChatGroq
 from langchain_core.language_models import BaseChatModel
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import AIMessage, HumanMessage
-
-# Available models
-AVAILABLE_MODELS = [
-    "llama3-70b-8192",
-    "llama-3.3-70b-versatile",
-    "gemma2-9b-it",
-    "deepseek-r1-distill-llama-70b",
-    "qwen-qwq-32b"
-]
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from utils.backends import DEFAULT_BACKEND, create_backend_model
+from utils.budgets import OutputBudget, chat_budget, continuation_budget, output_budget
+from utils.cache import ResponseCache, get_response_cache
+from utils.coalescing import COALESCE_ENABLED, get_single_flight, thread_bound
+from utils.health import CircuitBreaker, get_breakers
+from utils.hedging import HedgeOutcome, HedgePolicy, cancelled_here, hedged_stream, on_cancel
+from utils.models import AVAILABLE_MODELS, THINKING_MODELS
+from utils.prompting import PROMPTS, PromptSpec
+from utils.scheduler import RateLimitScheduler, estimate_request_tokens, get_scheduler
+from utils.telemetry import CallTimer, get_telemetry
+from utils.tokens import estimate_message_tokens, estimate_tokens
+
+THINKING_INSTRUCTION = (
+    "Think step by step before responding. Begin with '<thinking>' and end your "
+    "thinking with '</thinking>' before giving your final answer."
+)
+
+# Follow-up request once a thinking block has used up its budget
+ANSWER_NOW_INSTRUCTION = (
+    "Your thinking budget is used up. Do not think any further; give your final answer now, "
+    "without a <thinking> block."
+)
+
+# Times a stream that breaks off part way is continued from its partial text
+MAX_RESUMES = int(os.environ.get("INTELLECTAI_MAX_RESUMES", 2))
+
+# Characters at the start of a continuation checked for text repeated from
+# the end of the partial response, and the shortest repeat that is dropped
+RESUME_OVERLAP = 200
+MIN_OVERLAP = 20
+
+# Connection pool settings shared by every pooled client
+HTTP_POOL_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=120.0,
+)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+T = TypeVar("T")
+
+
+class IncompleteResponseError(Exception):
+    """A streamed response broke off and could not be continued."""
+
+    def __init__(self, partial: str, error: Exception):
+        super().__init__(f"The response broke off after {len(partial)} characters: {error}")
+        self.partial = partial
+
+
+def _abort_on_cancel(response: httpx.Response):
+    """Let a cancelled hedge stream abort this response instead of waiting for the read timeout."""
+
+    def abort():
+        if response.is_closed:
+            return
+        # Closing the response does not wake a blocked read; shutting the socket down does
+        network_stream = response.extensions.get("network_stream")
+        sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+
+    on_cancel(abort)
+
+
+class ClientRegistry:
+    """
+    Thread-safe, process-wide pool of long-lived chat model clients.
+
+    Clients are keyed by model and sampling settings and share a single
+    keep-alive HTTP connection pool, so a generation request reuses warm
+    connections instead of paying client construction and TLS setup.
+    Entries that have not been used for ``idle_ttl`` seconds are evicted.
+    """
+
+    def __init__(self, max_size: int = 32, idle_ttl: float = 900.0):
+        """
+        Initialize the registry.
+
+        Args:
+            max_size: Maximum number of clients kept alive at once
+            idle_ttl: Seconds after which an unused client is evicted
+        """
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[Tuple, Tuple[BaseChatModel, float]]" = OrderedDict()
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name: str, temperature: float, backend: str = DEFAULT_BACKEND, **options) -> Tuple:
+        """Build the registry key for a model, its backend and sampling settings."""
+        return (backend, model_name, round(float(temperature), 3)) + tuple(sorted(options.items()))
+
+    def _shared_http_client(self) -> httpx.Client:
+        """Return the keep-alive HTTP client shared by all pooled clients."""
+        if self._http_client is None:
+            self._http_client = httpx.Client(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT,
+                                             event_hooks={"response": [_abort_on_cancel]})
+        return self._http_client
+
+    def _shared_http_async_client(self) -> httpx.AsyncClient:
+        """
+        Return the keep-alive async HTTP client shared by all pooled clients.
+
+        Async connections are bound to the loop that opens them, so async
+        calls must run on the shared loop from utils.aio.
+        """
+        if self._http_async_client is None:
+            self._http_async_client = httpx.AsyncClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT)
+        return self._http_async_client
+
+    def _create(self, model_name: str, temperature: float, backend: str = DEFAULT_BACKEND,
+                **options) -> BaseChatModel:
+        """Construct a new client bound to the shared connection pools."""
+        # Retries are handled by the rate-limit scheduler
+        options.setdefault("max_retries", 0)
+        if "stop" in options:
+            # Kept as a tuple in the registry key
+            options["stop"] = list(options["stop"])
+
+        def live_model() -> BaseChatModel:
+            return ChatGroq(
+                model_name=model_name,
+                temperature=temperature,
+                http_client=self._shared_http_client(),
+                http_async_client=self._shared_http_async_client(),
+                **options,
+            )
+
+        if backend == "groq":
+            return live_model()
+        return create_backend_model(backend, model_name, model_name in THINKING_MODELS, live_model,
+                                    max_tokens=options.get("max_tokens"), stop=options.get("stop"))
+
+    def get(self, model_name: str, temperature: float, backend: str = DEFAULT_BACKEND,
+            **options) -> BaseChatModel:
+        """
+        Return a pooled client, creating it on first use.
+
+        Args:
+            model_name: The name of the Groq model
+            temperature: Sampling temperature
+            backend: Backend serving the model, see utils.backends
+            **options: Extra ChatGroq settings that are part of the key
+
+        Returns:
+            A long-lived chat model instance
+        """
+        key = self.make_key(model_name, temperature, backend, **options)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle_locked(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._clients[key] = (entry[0], now)
+                self._clients.move_to_end(key)
+                return entry[0]
+
+            self.misses += 1
+            client = self._create(model_name, temperature, backend, **options)
+            self._clients[key] = (client, now)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+            return client
+
+    def _evict_idle_locked(self, now: float) -> int:
+        """Drop clients idle for longer than the TTL. Caller holds the lock."""
+        expired = [key for key, (_, last_used) in self._clients.items()
+                   if now - last_used > self.idle_ttl]
+        for key in expired:
+            del self._clients[key]
+        return len(expired)
+
+    def evict_idle(self) -> int:
+        """
+        Evict clients that have been idle longer than the TTL.
+
+        Returns:
+            The number of evicted clients
+        """
+        with self._lock:
+            return self._evict_idle_locked(time.monotonic())
+
+    def clear(self):
+        """Drop every pooled client and close the shared sync connection pool."""
+        with self._lock:
+            self._clients.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+            # The async pool can only be closed on its own loop; drop it
+            self._http_async_client = None
+
+    def stats(self) -> Dict:
+        """Return pool size and hit/miss counters."""
+        with self._lock:
+            return {"size": len(self._clients), "hits": self.hits, "misses": self.misses}
+
+
+_registry = ClientRegistry()
+
+
+def get_client_registry() -> ClientRegistry:
+    """Return the process-wide client registry."""
+    return _registry
+
+
+class ThinkingStreamParser:
+    """
+    Incremental splitter for ``<thinking>`` blocks in streamed responses.
+
+    Chunks are fed as they arrive and come back as ``("thinking", text)`` or
+    ``("answer", text)`` events, so the thinking process and the answer can
+    be rendered live. Text that could still be the start of a tag is held
+    back until the next chunk resolves it.
+    """
+
+    OPEN_TAG = "<thinking>"
+    CLOSE_TAG = "</thinking>"
+
+    # Parser states
+    START = "start"
+    THINKING = "thinking"
+    ANSWER = "answer"
+
+    def __init__(self):
+        """Initialize an empty parser."""
+        self.state = self.START
+        self._pending = ""
+        self._raw: List[str] = []
+        self._thinking: List[str] = []
+        self._answer: List[str] = []
+        self.closed = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """
+        Consume a chunk of streamed text.
+
+        Args:
+            chunk: The next piece of the response
+
+        Returns:
+            A list of (kind, text) events ready to be displayed
+        """
+        self._raw.append(chunk)
+        self._pending += chunk
+        events = []
+
+        if self.state == self.START:
+            stripped = self._pending.lstrip()
+            if stripped.startswith(self.OPEN_TAG):
+                self.state = self.THINKING
+                self._pending = stripped[len(self.OPEN_TAG):]
+            elif not stripped or self.OPEN_TAG.startswith(stripped):
+                # Could still become an opening tag
+                return events
+            else:
+                self.state = self.ANSWER
+
+        if self.state == self.THINKING:
+            index = self._pending.find(self.CLOSE_TAG)
+            if index >= 0:
+                self._emit(events, self.THINKING, self._pending[:index])
+                self._pending = self._pending[index + len(self.CLOSE_TAG):]
+                self.state = self.ANSWER
+                self.closed = True
+            else:
+                keep = self._partial_tag_length(self._pending, self.CLOSE_TAG)
+                self._emit(events, self.THINKING, self._pending[:len(self._pending) - keep])
+                self._pending = self._pending[len(self._pending) - keep:]
+
+        if self.state == self.ANSWER:
+            self._emit(events, self.ANSWER, self._pending)
+            self._pending = ""
+
+        return events
+
+    def finish(self) -> Tuple[str, str]:
+        """
+        Flush buffered text and return the final parts.
+
+        Returns:
+            A tuple of (thinking, answer) parts. If the thinking block was
+            never closed, the whole response is treated as the answer.
+        """
+        if self._pending:
+            if self.state == self.THINKING:
+                self._thinking.append(self._pending)
+            else:
+                self._answer.append(self._pending)
+            self._pending = ""
+
+        if self._thinking and not self.closed:
+            return "", "".join(self._raw)
+        return self.thinking, self.answer
+
+    @property
+    def thinking(self) -> str:
+        """Thinking text parsed so far."""
+        return "".join(self._thinking).strip()
+
+    @property
+    def answer(self) -> str:
+        """Answer text parsed so far."""
+        return "".join(self._answer).strip()
+
+    def _emit(self, events: List[Tuple[str, str]], kind: str, text: str):
+        """Record and queue a piece of parsed text."""
+        if not text:
+            return
+        (self._thinking if kind == self.THINKING else self._answer).append(text)
+        events.append((kind, text))
+
+    @staticmethod
+    def _partial_tag_length(text: str, tag: str) -> int:
+        """Length of the longest suffix of text that is a prefix of tag."""
+        for size in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:size]):
+                return size
+        return 0
+
+
+def _observed_stream(timer: CallTimer, chunks: Iterator[str]) -> Iterator[str]:
+    """Pass chunks through while recording TTFT, outcome and output size."""
+    parts = []
+    try:
+        for chunk in chunks:
+            timer.first_token()
+            parts.append(chunk)
+            yield chunk
+    except GeneratorExit:
+        timer.finish("".join(parts), outcome="cancelled")
+        raise
+    except Exception:
+        timer.finish("".join(parts), outcome="cancelled" if cancelled_here() else "error")
+        raise
+    timer.finish("".join(parts))
+
+
+async def _aobserved_stream(timer: CallTimer, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Async counterpart of _observed_stream."""
+    parts = []
+    try:
+        async for chunk in chunks:
+            timer.first_token()
+            parts.append(chunk)
+            yield chunk
+    except GeneratorExit:
+        timer.finish("".join(parts), outcome="cancelled")
+        raise
+    except Exception:
+        timer.finish("".join(parts), outcome="error")
+        raise
+    timer.finish("".join(parts))
+
+
+def _check_finish(message, model_name: str) -> bool:
+    """Count a response that was cut off by its max_tokens budget, returning whether it was."""
+    if message.response_metadata.get("finish_reason") == "length":
+        get_telemetry().increment("max_tokens_hit", model_name)
+        return True
+    return False
+
+
+def _text_chunks(chunks: Iterator, model_name: str,
+                 on_truncated: Optional[Callable[[], None]] = None) -> Iterator[str]:
+    """Yield the text of streamed message chunks, calling on_truncated if max_tokens cuts them off."""
+    for chunk in chunks:
+        if _check_finish(chunk, model_name) and on_truncated is not None:
+            on_truncated()
+        if chunk.content:
+            yield chunk.content
+
+
+async def _atext_chunks(chunks: AsyncIterator, model_name: str,
+                        on_truncated: Optional[Callable[[], None]] = None) -> AsyncIterator[str]:
+    """Async counterpart of _text_chunks."""
+    async for chunk in chunks:
+        if _check_finish(chunk, model_name) and on_truncated is not None:
+            on_truncated()
+        if chunk.content:
+            yield chunk.content
+
+
+def without_thinking(chunks: Iterator[str]) -> Iterator[str]:
+    """Drop a leading <thinking> block from a streamed response."""
+    parser = ThinkingStreamParser()
+    emitted = False
+    for chunk in chunks:
+        for kind, text in parser.feed(chunk):
+            if kind == ThinkingStreamParser.ANSWER:
+                emitted = True
+                yield text
+    if not emitted:
+        # Held back while it could have been a tag, or an unclosed block
+        yield parser.finish()[1]
+
+
+async def _awithout_thinking(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Async counterpart of without_thinking."""
+    parser = ThinkingStreamParser()
+    emitted = False
+    async for chunk in chunks:
+        for kind, text in parser.feed(chunk):
+            if kind == ThinkingStreamParser.ANSWER:
+                emitted = True
+                yield text
+    if not emitted:
+        yield parser.finish()[1]
+
+
+def _trim_overlap(partial: str, text: str) -> str:
+    """Drop the start of a continuation where it repeats the end of the partial response."""
+    for size in range(min(len(text), len(partial), RESUME_OVERLAP), MIN_OVERLAP - 1, -1):
+        if partial.endswith(text[:size]):
+            return text[size:]
+    return text
+
+
+def _stitched(partial: str, chunks: Iterator[str]) -> Iterator[str]:
+    """
+    Yield a continuation of a partial response so it joins the partial seamlessly.
+
+    The first RESUME_OVERLAP characters are held back until any text the
+    model repeated from the end of the partial response has been dropped.
+    """
+    head = ""
+    for chunk in chunks:
+        if head is None:
+            yield chunk
+            continue
+        head += chunk
+        if len(head) >= RESUME_OVERLAP:
+            yield _trim_overlap(partial, head)
+            head = None
+    if head:
+        yield _trim_overlap(partial, head)
+
+
+async def _astitched(partial: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Async counterpart of _stitched."""
+    head = ""
+    async for chunk in chunks:
+        if head is None:
+            yield chunk
+            continue
+        head += chunk
+        if len(head) >= RESUME_OVERLAP:
+            yield _trim_overlap(partial, head)
+            head = None
+    if head:
+        yield _trim_overlap(partial, head)
+
+
+def _inside_thinking(partial: str) -> bool:
+    """Whether a partial response stopped inside its <thinking> block."""
+    return partial.rfind(ThinkingStreamParser.OPEN_TAG) > partial.rfind(ThinkingStreamParser.CLOSE_TAG)
+
+
+class _ThinkingCap:
+    """Tracks a streamed <thinking> block against its token budget."""
+
+    def __init__(self, limit: int, model_name: str):
+        self.limit = limit
+        self.model_name = model_name
+        self.parser = ThinkingStreamParser()
+        self.tokens = 0
+
+    def exceeded(self, chunk: str) -> bool:
+        """Feed a chunk; True once the still-open block is over budget."""
+        for kind, text in self.parser.feed(chunk):
+            if kind == ThinkingStreamParser.THINKING:
+                self.tokens += estimate_tokens(text, self.model_name)
+        return self.parser.state == ThinkingStreamParser.THINKING and self.tokens > self.limit
+
+    def follow_up(self, prompt_messages: List) -> List:
+        """Messages asking for the final answer given the thinking so far."""
+        get_telemetry().increment("thinking_capped", self.model_name)
+        thinking = f"{ThinkingStreamParser.OPEN_TAG}\n{self.parser.thinking}\n{ThinkingStreamParser.CLOSE_TAG}"
+        return prompt_messages + [AIMessage(content=thinking), HumanMessage(content=ANSWER_NOW_INSTRUCTION)]
+
+
+def _finish_with_message(timer: CallTimer, message: AIMessage) -> bool:
+    """
+    Record a completed chat call, preferring provider-reported token usage.
+
+    Returns:
+        Whether max_tokens cut the response off
+    """
+    truncated = _check_finish(message, timer.model)
+    usage = getattr(message, "usage_metadata", None) or {}
+    timer.finish(
+        message.content,
+        output_tokens=usage.get("output_tokens"),
+        input_tokens=usage.get("input_tokens"),
+    )
+    return truncated
+
 
 class GroqGenerator:
     """Wrapper for Groq API integration."""
     
-    def __init__(self, model_name: str = "llama3-70b-8192", temperature: float = 0.7):
+    def __init__(self, model_name: str = "llama3-70b-8192", temperature: float = 0.7,
+                 scheduler: Optional[RateLimitScheduler] = None,
+                 on_queue: Optional[Callable[[int, float], None]] = None,
+                 backend: Optional[str] = None, content_type: Optional[str] = None,
+                 hedge_policy: Optional[HedgePolicy] = None):
         """
         Initialize the Groq client.
         
         Args:
             model_name: The name of the Groq model to use
             temperature: Controls randomness in generation (0.0-1.0)
+            scheduler: Rate-limit scheduler for upstream calls, defaults to the shared one
+            on_queue: Optional callback receiving (queue position, estimated wait)
+                while a request waits for the model's rate limits
+            backend: Backend serving the model (groq, fake, replay or record),
+                defaults to the INTELLECTAI_BACKEND environment variable
+            content_type: Label for telemetry, defaults to the prompt name
+                for generation and "chat" for conversations
+            hedge_policy: Fallback model and first-token deadline for hedging
+                slow requests, defaults to the INTELLECTAI_HEDGE_* settings
         """
         self.model_name = model_name
         self.temperature = temperature
-        self.llm = ChatGroq(
-            model_name=model_name,
-            temperature=temperature,
-        )
+        self.backend = backend or DEFAULT_BACKEND
+        self.llm = get_client_registry().get(model_name, temperature, self.backend)
+        self.scheduler = scheduler or get_scheduler()
+        self.on_queue = on_queue
+        self.content_type = content_type
+        self.hedge_policy = hedge_policy or HedgePolicy.from_env()
+        # Outcome of the most recent hedged call, None if it was not hedged
+        self.last_hedge: Optional[HedgeOutcome] = None
+        # Whether the most recent response was cut off before its end, by
+        # max_tokens or by a stream that broke off and could not be resumed
+        self.truncated = False
+
+    def clone(self, model_name: Optional[str] = None) -> "GroqGenerator":
+        """
+        Return a generator with the same settings but no queue callback.
+
+        Clones are safe to use from worker threads, where the caller's
+        (UI thread bound) on_queue callback must not be invoked.
+
+        Args:
+            model_name: Optional model to use instead of this generator's
+        """
+        return GroqGenerator(model_name or self.model_name, self.temperature, self.scheduler,
+                             backend=self.backend, content_type=self.content_type,
+                             hedge_policy=self.hedge_policy)
+
+    def _observe(self, operation: str, content_type: str, input_tokens: int) -> CallTimer:
+        """Start timing an upstream call for telemetry."""
+        return get_telemetry().start(self.model_name, operation, self.content_type or content_type, input_tokens)
+
+    def _prepare(self, prompt_template: str, variables: Dict) -> PromptSpec:
+        """Resolve the precompiled prompt for a template and validate its variables."""
+        spec = PROMPTS.resolve(prompt_template)
+        spec.validate(variables)
+        return spec
+
+    def _cache_key(self, spec: PromptSpec, use_cache: bool, variables: Dict) -> Optional[str]:
+        """
+        Return the cache key for a request, or None if it must bypass the cache.
+        
+        Args:
+            spec: The compiled prompt spec
+            use_cache: Per-request opt-in flag
+            variables: Variables to be formatted into the prompt template
+        """
+        cache = get_response_cache()
+        if not use_cache or not cache.policy.allows(self.temperature):
+            cache.record_bypass()
+            return None
+        return self._request_key(spec, variables)
+
+    def _request_key(self, spec: PromptSpec, variables: Dict) -> str:
+        """Identify a request by prompt, variables, model and temperature."""
+        # Offline backends must never serve or pollute live responses
+        model_id = self.model_name if self.backend == "groq" else f"{self.backend}:{self.model_name}"
+        return ResponseCache.make_key(spec.name, variables, model_id, self.temperature)
+
+    def _flight_key(self, spec: PromptSpec, use_cache: bool, variables: Dict) -> Optional[str]:
+        """
+        Return the key under which identical in-flight requests share one
+        upstream call, or None if this request must get its own.
+
+        Requests opting out of the cache, such as candidates meant to
+        differ, are never shared.
+        """
+        if not use_cache or not COALESCE_ENABLED:
+            return None
+        return self._request_key(spec, variables)
+
+    def _hedging(self) -> bool:
+        """Whether calls from this generator are hedged to a fallback model."""
+        return self.hedge_policy is not None and self.hedge_policy.fallback_model != self.model_name
+
+    def _hedged(self, make_stream: Callable[["GroqGenerator", Optional[Callable]], Iterator[str]],
+                on_queue: Optional[Callable[[int, float], None]] = None) -> Iterator[str]:
+        """
+        Run a streamed call on this model, hedged to the fallback model if configured.
+
+        Args:
+            make_stream: Function taking a generator and a queue callback and
+                starting the streamed call on that generator's model
+            on_queue: Queue callback to use instead of this generator's
+
+        Returns:
+            The winning stream
+        """
+        self.last_hedge = None
+        if not self._hedging():
+            return make_stream(self, on_queue or self.on_queue)
+
+        policy = self.hedge_policy
+        breakers = get_breakers()
+        if not breakers.available(policy.fallback_model):
+            # Racing a fallback that is out of service would only fail
+            return make_stream(self, on_queue or self.on_queue)
+        fallback = self.clone(policy.fallback_model)
+        fallback.hedge_policy = None
+        self.last_hedge = HedgeOutcome(self.model_name, policy.fallback_model)
+        if not breakers.available(self.model_name):
+            # Send the request straight to the fallback while this model is out
+            self.last_hedge.winner = policy.fallback_model
+            return self._adopting(fallback, make_stream(fallback, on_queue or self.on_queue))
+        # Both calls run on worker threads, so neither may report queue
+        # positions to the caller's (UI thread bound) callback
+        return self._adopting(fallback, hedged_stream(
+            self.model_name, lambda: make_stream(self, None),
+            policy.fallback_model, lambda: make_stream(fallback, None),
+            policy.first_token_deadline(self.model_name), self.last_hedge,
+        ))
+
+    def _adopting(self, other: "GroqGenerator", chunks: Iterator[str]) -> Iterator[str]:
+        """Pass through a stream written by another generator, then take over its truncated flag."""
+        try:
+            yield from chunks
+        finally:
+            self.truncated = self.truncated or other.truncated
+
+    @property
+    def answered_by(self) -> str:
+        """The model that wrote the most recent response, the fallback if it won a hedge."""
+        if self.last_hedge is not None and self.last_hedge.winner:
+            return self.last_hedge.winner
+        return self.model_name
+
+    def _breaker(self) -> CircuitBreaker:
+        """Return the circuit breaker guarding this generator's model."""
+        return get_breakers().get(self.model_name)
+
+    def _admit(self):
+        """Fail fast, before queuing, while this generator's model is out of service."""
+        self._breaker().check()
+
+    def _run(self, estimated_tokens: int, call: Callable[[], T],
+             on_queue: Optional[Callable[[int, float], None]] = None) -> T:
+        """Run an upstream call within the model's rate limits and circuit breaker."""
+        breaker = self._breaker()
+        return self.scheduler.run(self.model_name, estimated_tokens, lambda: breaker.call(call), on_queue)
+
+    async def _arun(self, estimated_tokens: int, make_call: Callable[[], Awaitable[T]]) -> T:
+        """Async counterpart of _run."""
+        breaker = self._breaker()
+        return await self.scheduler.arun(self.model_name, estimated_tokens, lambda: breaker.acall(make_call))
+
+    def _stream_upstream(self, estimated_tokens: int, make_stream: Callable[[], Iterator[str]],
+                         on_queue: Optional[Callable[[int, float], None]] = None) -> Iterator[str]:
+        """Stream an upstream call within the model's rate limits and circuit breaker."""
+        breaker = self._breaker()
+        return self.scheduler.stream(self.model_name, estimated_tokens, lambda: breaker.stream(make_stream), on_queue)
+
+    def _astream_upstream(self, estimated_tokens: int,
+                          make_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Async counterpart of _stream_upstream."""
+        breaker = self._breaker()
+        return self.scheduler.astream(self.model_name, estimated_tokens, lambda: breaker.astream(make_stream))
+
+    def _cacheable(self) -> bool:
+        """Whether the last call's response is complete and belongs to this generator's model."""
+        return not self.truncated and (self.last_hedge is None or self.last_hedge.winner == self.model_name)
+
+    def _call_state(self) -> Tuple[bool, Optional[HedgeOutcome]]:
+        """Capture what the last call left besides its text, for coalesced callers."""
+        return self.truncated, self.last_hedge
+
+    def _adopt_state(self, state: Tuple[bool, Optional[HedgeOutcome]]):
+        """Take over the truncated flag and hedge report of a call this one was coalesced with."""
+        self.truncated, self.last_hedge = state
+
+    def _mark_truncated(self):
+        """Note that max_tokens cut the current response off."""
+        self.truncated = True
+
+    def _continuation_stream(self, prompt_messages: List, partial: str, budget: OutputBudget, prompt_tokens: int,
+                             operation: str, content_type: str,
+                             on_queue: Optional[Callable[[int, float], None]] = None) -> Iterator[str]:
+        """
+        Stream the rest of a response that stopped part way.
+
+        The partial response is sent as the start of the assistant's reply,
+        so the model picks up where it stopped instead of starting over.
+
+        Args:
+            prompt_messages: Messages of the original request
+            partial: The response so far
+            budget: Limits for the continuation
+            prompt_tokens: Estimated size of the original request
+            operation: Telemetry operation label
+            content_type: Telemetry content type label
+            on_queue: Optional queue position callback
+
+        Yields:
+            The missing tail of the response
+        """
+        if self.answered_by != self.model_name:
+            # Continue on the hedge winner that wrote the partial response
+            writer = self.clone(self.answered_by)
+            writer.hedge_policy = None
+            return self._adopting(writer, writer._continuation_stream(prompt_messages, partial, budget, prompt_tokens,
+                                                                      operation, content_type, on_queue))
+        self._admit()
+        messages = prompt_messages + [AIMessage(content=partial)]
+        input_tokens = prompt_tokens + estimate_tokens(partial, self.model_name)
+        client = self._client(budget)
+        timer = self._observe(operation, content_type, input_tokens)
+        chunks = _observed_stream(timer, self._stream_upstream(
+            estimate_request_tokens(input_tokens, budget.max_tokens),
+            lambda: _text_chunks(client.stream(messages), self.model_name, self._mark_truncated), on_queue,
+        ))
+        if self._thinks() and not _inside_thinking(partial):
+            # The answer is under way; more thinking would only delay it
+            chunks = without_thinking(chunks)
+        return _stitched(partial, chunks)
+
+    def _acontinuation_stream(self, prompt_messages: List, partial: str, budget: OutputBudget, prompt_tokens: int,
+                              operation: str, content_type: str) -> AsyncIterator[str]:
+        """Async counterpart of _continuation_stream."""
+        self._admit()
+        messages = prompt_messages + [AIMessage(content=partial)]
+        input_tokens = prompt_tokens + estimate_tokens(partial, self.model_name)
+        client = self._client(budget)
+        timer = self._observe(operation, content_type, input_tokens)
+        chunks = _aobserved_stream(timer, self._astream_upstream(
+            estimate_request_tokens(input_tokens, budget.max_tokens),
+            lambda: _atext_chunks(client.astream(messages), self.model_name, self._mark_truncated),
+        ))
+        if self._thinks() and not _inside_thinking(partial):
+            chunks = _awithout_thinking(chunks)
+        return _astitched(partial, chunks)
+
+    def _remaining_budget(self, budget: OutputBudget, partial: str, prompt_tokens: int) -> OutputBudget:
+        """Return what a partial response left of its request's budget."""
+        return continuation_budget(budget, estimate_tokens(partial, self.model_name), self.model_name, prompt_tokens)
+
+    def _resuming(self, chunks: Iterator[str], resume: Callable[[str], Iterator[str]]) -> Iterator[str]:
+        """
+        Pass a stream through, continuing it from its partial text if it breaks off.
+
+        Errors before the first chunk propagate unchanged. Once MAX_RESUMES
+        continuations have failed as well, the response is marked truncated
+        and an IncompleteResponseError carrying the text so far is raised.
+
+        Args:
+            chunks: The response stream
+            resume: Function starting a continuation of the text so far
+
+        Yields:
+            Chunks of the complete response
+        """
+        parts = []
+        resumes = 0
+        try:
+            while True:
+                try:
+                    if chunks is None:
+                        chunks = resume("".join(parts))
+                    for chunk in chunks:
+                        parts.append(chunk)
+                        yield chunk
+                    return
+                except Exception as error:
+                    if not parts:
+                        raise
+                    if resumes >= MAX_RESUMES:
+                        self.truncated = True
+                        raise IncompleteResponseError("".join(parts), error) from error
+                    resumes += 1
+                    chunks = None
+                    get_telemetry().increment("resumed", self.model_name)
+        finally:
+            if chunks is not None:
+                chunks.close()
+
+    async def _aresuming(self, chunks: AsyncIterator[str],
+                         resume: Callable[[str], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Async counterpart of _resuming."""
+        parts = []
+        resumes = 0
+        try:
+            while True:
+                try:
+                    if chunks is None:
+                        chunks = resume("".join(parts))
+                    async for chunk in chunks:
+                        parts.append(chunk)
+                        yield chunk
+                    return
+                except Exception as error:
+                    if not parts:
+                        raise
+                    if resumes >= MAX_RESUMES:
+                        self.truncated = True
+                        raise IncompleteResponseError("".join(parts), error) from error
+                    resumes += 1
+                    chunks = None
+                    get_telemetry().increment("resumed", self.model_name)
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+
+    def _client(self, budget: OutputBudget) -> BaseChatModel:
+        """Return the pooled client enforcing a request's output budget."""
+        return get_client_registry().get(self.model_name, self.temperature, self.backend,
+                                         **budget.client_options())
+
+    def _thinks(self) -> bool:
+        """Whether this generator's model thinks aloud, so its thinking is capped."""
+        return self.model_name in THINKING_MODELS
+
+    def _capped_thinking(self, chunks: Iterator[str], budget: OutputBudget, prompt_messages: Callable[[], List],
+                         prompt_tokens: int, operation: str, content_type: str) -> Iterator[str]:
+        """
+        Enforce a budget's thinking cap on a streamed response.
+
+        If the <thinking> block outgrows the cap, the stream is closed and
+        the model is asked for its final answer given the thinking so far.
+        """
+        cap = _ThinkingCap(budget.thinking_tokens, self.model_name)
+        try:
+            for chunk in chunks:
+                yield chunk
+                if cap.exceeded(chunk):
+                    break
+            else:
+                return
+        finally:
+            chunks.close()
+
+        yield f"\n{ThinkingStreamParser.CLOSE_TAG}\n\n"
+        messages = cap.follow_up(prompt_messages())
+        client = self._client(budget)
+        timer = self._observe(operation, content_type, prompt_tokens + cap.tokens)
+        yield from without_thinking(_observed_stream(timer, self._stream_upstream(
+            estimate_request_tokens(prompt_tokens + cap.tokens, budget.max_tokens),
+            lambda: _text_chunks(client.stream(messages), self.model_name, self._mark_truncated),
+        )))
+
+    async def _acapped_thinking(self, chunks: AsyncIterator[str], budget: OutputBudget,
+                                prompt_messages: Callable[[], List], prompt_tokens: int,
+                                operation: str, content_type: str) -> AsyncIterator[str]:
+        """Async counterpart of _capped_thinking."""
+        cap = _ThinkingCap(budget.thinking_tokens, self.model_name)
+        try:
+            async for chunk in chunks:
+                yield chunk
+                if cap.exceeded(chunk):
+                    break
+            else:
+                return
+        finally:
+            await chunks.aclose()
+
+        yield f"\n{ThinkingStreamParser.CLOSE_TAG}\n\n"
+        messages = cap.follow_up(prompt_messages())
+        client = self._client(budget)
+        timer = self._observe(operation, content_type, prompt_tokens + cap.tokens)
+        async for chunk in _awithout_thinking(_aobserved_stream(timer, self._astream_upstream(
+            estimate_request_tokens(prompt_tokens + cap.tokens, budget.max_tokens),
+            lambda: _atext_chunks(client.astream(messages), self.model_name, self._mark_truncated),
+        ))):
+            yield chunk
+
+    def _content_stream(self, spec: PromptSpec, variables: Dict, prompt_tokens: int,
+                        on_queue: Optional[Callable[[int, float], None]]) -> Iterator[str]:
+        """Stream a templated generation from this generator's model."""
+        self._admit()
+        budget = output_budget(spec.name, variables, self.model_name, prompt_tokens)
+        chain = PROMPTS.chain(spec, self._client(budget))
+        timer = self._observe("stream", spec.name, prompt_tokens)
+        chunks = _observed_stream(timer, self._stream_upstream(
+            estimate_request_tokens(prompt_tokens, budget.max_tokens),
+            lambda: _text_chunks(chain.stream(variables), self.model_name, self._mark_truncated), on_queue,
+        ))
+        if budget.thinking_tokens is None:
+            return chunks
+        return self._capped_thinking(chunks, budget, lambda: spec.prompt.format_messages(**variables),
+                                     prompt_tokens, "stream", spec.name)
+
+    def _acontent_stream(self, spec: PromptSpec, variables: Dict, prompt_tokens: int) -> AsyncIterator[str]:
+        """Asynchronously stream a templated generation from this generator's model."""
+        self._admit()
+        budget = output_budget(spec.name, variables, self.model_name, prompt_tokens)
+        chain = PROMPTS.chain(spec, self._client(budget))
+        timer = self._observe("stream", spec.name, prompt_tokens)
+        chunks = _aobserved_stream(timer, self._astream_upstream(
+            estimate_request_tokens(prompt_tokens, budget.max_tokens),
+            lambda: _atext_chunks(chain.astream(variables), self.model_name, self._mark_truncated),
+        ))
+        if budget.thinking_tokens is None:
+            return chunks
+        return self._acapped_thinking(chunks, budget, lambda: spec.prompt.format_messages(**variables),
+                                      prompt_tokens, "stream", spec.name)
         
-    def generate_content(self, prompt_template: str, **kwargs) -> str:
+    def _resumable_content(self, spec: PromptSpec, variables: Dict, prompt_tokens: int,
+                           on_queue: Optional[Callable[[int, float], None]] = None) -> Iterator[str]:
+        """Stream a templated generation, hedged if configured, resuming it if it breaks off."""
+        budget = output_budget(spec.name, variables, self.model_name, prompt_tokens)
+        return self._resuming(
+            self._hedged(
+                lambda generator, queue_callback: generator._content_stream(spec, variables, prompt_tokens,
+                                                                            queue_callback),
+                on_queue,
+            ),
+            lambda partial: self._continuation_stream(
+                spec.prompt.format_messages(**variables), partial,
+                self._remaining_budget(budget, partial, prompt_tokens), prompt_tokens, "stream", spec.name, on_queue,
+            ),
+        )
+
+    def _aresumable_content(self, spec: PromptSpec, variables: Dict, prompt_tokens: int) -> AsyncIterator[str]:
+        """Asynchronously stream a templated generation, resuming it if it breaks off."""
+        budget = output_budget(spec.name, variables, self.model_name, prompt_tokens)
+        return self._aresuming(
+            self._acontent_stream(spec, variables, prompt_tokens),
+            lambda partial: self._acontinuation_stream(
+                spec.prompt.format_messages(**variables), partial,
+                self._remaining_budget(budget, partial, prompt_tokens), prompt_tokens, "stream", spec.name,
+            ),
+        )
+
+    def generate_content(self, prompt_template: str, use_cache: bool = True, **kwargs) -> str:
         """
         Generate content using the Groq model.
         
         Args:
             prompt_template: The prompt template to use
+            use_cache: Whether the response cache may serve or store this request
             **kwargs: Variables to be formatted into the prompt template
             
         Returns:
             The generated text content
         """
-        prompt = ChatPromptTemplate.from_template(prompt_template)
-        chain = prompt | self.llm | StrOutputParser()
-        return chain.invoke(kwargs)
-    
-    def chat_with_history(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        spec = self._prepare(prompt_template, kwargs)
+        key = self._cache_key(spec, use_cache, kwargs)
+        prompt_tokens = spec.estimate_tokens(kwargs)
+        self.last_hedge = None
+        self.truncated = False
+        if key is not None:
+            cached = get_response_cache().get(key)
+            if cached is not None:
+                self._observe("generate", spec.name, prompt_tokens).finish(cached, outcome="cache_hit")
+                return cached
+
+        flight = self._flight_key(spec, use_cache, kwargs)
+        if flight is None:
+            return self._generate(spec, kwargs, prompt_tokens, key)
+        return get_single_flight().call(
+            flight, lambda: self._generate(spec, kwargs, prompt_tokens, key), self.model_name,
+            self._call_state, self._adopt_state,
+        )
+
+    def _generate(self, spec: PromptSpec, variables: Dict, prompt_tokens: int, key: Optional[str]) -> str:
+        """Make the upstream call for generate_content and cache its response."""
+        if self._hedging() or self._thinks():
+            # Hedging needs the first token and the thinking cap the live
+            # thinking block, so the request is streamed and joined
+            response = "".join(self._resumable_content(spec, variables, prompt_tokens))
+        else:
+            self._admit()
+            budget = output_budget(spec.name, variables, self.model_name, prompt_tokens)
+            chain = PROMPTS.chain(spec, self._client(budget))
+            timer = self._observe("generate", spec.name, prompt_tokens)
+            try:
+                message = self._run(
+                    estimate_request_tokens(prompt_tokens, budget.max_tokens), lambda: chain.invoke(variables),
+                    self.on_queue,
+                )
+            except Exception:
+                timer.finish(outcome="error")
+                raise
+            self.truncated = _finish_with_message(timer, message)
+            response = message.content
+        if key is not None and self._cacheable():
+            get_response_cache().set(key, response)
+        return response
+
+    def stream_content(self, prompt_template: str, use_cache: bool = True, **kwargs) -> Iterator[str]:
         """
-        Continue a conversation with message history.
+        Generate content using the Groq model, yielding tokens as they arrive.
+        
+        Args:
+            prompt_template: The prompt template to use
+            use_cache: Whether the response cache may serve or store this request
+            **kwargs: Variables to be formatted into the prompt template
+            
+        Yields:
+            Chunks of the generated text
+        """
+        spec = self._prepare(prompt_template, kwargs)
+        key = self._cache_key(spec, use_cache, kwargs)
+        prompt_tokens = spec.estimate_tokens(kwargs)
+        self.last_hedge = None
+        self.truncated = False
+        if key is not None:
+            cached = get_response_cache().get(key)
+            if cached is not None:
+                self._observe("stream", spec.name, prompt_tokens).finish(cached, outcome="cache_hit")
+                yield cached
+                return
+
+        flight = self._flight_key(spec, use_cache, kwargs)
+        if flight is None:
+            yield from self._stream(spec, kwargs, prompt_tokens, key)
+        else:
+            # Another session may end up pulling the shared stream, and only
+            # this one's thread may report queue positions to its callback
+            yield from get_single_flight().stream(
+                flight, lambda: self._stream(spec, kwargs, prompt_tokens, key, thread_bound(self.on_queue)),
+                self.model_name, self._call_state, self._adopt_state,
+            )
+
+    def _stream(self, spec: PromptSpec, variables: Dict, prompt_tokens: int, key: Optional[str],
+                on_queue: Optional[Callable[[int, float], None]] = None) -> Iterator[str]:
+        """Make the upstream call for stream_content and cache the complete response."""
+        parts = []
+        for chunk in self._resumable_content(spec, variables, prompt_tokens, on_queue):
+            parts.append(chunk)
+            yield chunk
+
+        # Only complete streams from this model are cached
+        if key is not None and self._cacheable():
+            get_response_cache().set(key, "".join(parts))
+
+    async def agenerate_content(self, prompt_template: str, use_cache: bool = True, **kwargs) -> str:
+        """
+        Asynchronously generate content using the Groq model.
+        
+        Args:
+            prompt_template: The prompt template to use
+            use_cache: Whether the response cache may serve or store this request
+            **kwargs: Variables to be formatted into the prompt template
+            
+        Returns:
+            The generated text content
+        """
+        spec = self._prepare(prompt_template, kwargs)
+        key = self._cache_key(spec, use_cache, kwargs)
+        prompt_tokens = spec.estimate_tokens(kwargs)
+        self.last_hedge = None
+        self.truncated = False
+        if key is not None:
+            cached = get_response_cache().get(key)
+            if cached is not None:
+                self._observe("generate", spec.name, prompt_tokens).finish(cached, outcome="cache_hit")
+                return cached
+
+        flight = self._flight_key(spec, use_cache, kwargs)
+        if flight is None:
+            return await self._agenerate(spec, kwargs, prompt_tokens, key)
+        return await get_single_flight().acall(
+            flight, lambda: self._agenerate(spec, kwargs, prompt_tokens, key), self.model_name,
+            self._call_state, self._adopt_state,
+        )
+
+    async def _agenerate(self, spec: PromptSpec, variables: Dict, prompt_tokens: int, key: Optional[str]) -> str:
+        """Make the upstream call for agenerate_content and cache its response."""
+        if self._thinks():
+            # The thinking cap needs the live thinking block
+            response = "".join([chunk async for chunk in self._aresumable_content(spec, variables, prompt_tokens)])
+        else:
+            self._admit()
+            budget = output_budget(spec.name, variables, self.model_name, prompt_tokens)
+            chain = PROMPTS.chain(spec, self._client(budget))
+            timer = self._observe("generate", spec.name, prompt_tokens)
+            try:
+                message = await self._arun(
+                    estimate_request_tokens(prompt_tokens, budget.max_tokens), lambda: chain.ainvoke(variables),
+                )
+            except Exception:
+                timer.finish(outcome="error")
+                raise
+            self.truncated = _finish_with_message(timer, message)
+            response = message.content
+        if key is not None and self._cacheable():
+            get_response_cache().set(key, response)
+        return response
+
+    async def astream_content(self, prompt_template: str, use_cache: bool = True, **kwargs) -> AsyncIterator[str]:
+        """
+        Asynchronously generate content, yielding tokens as they arrive.
+        
+        Args:
+            prompt_template: The prompt template to use
+            use_cache: Whether the response cache may serve or store this request
+            **kwargs: Variables to be formatted into the prompt template
+            
+        Yields:
+            Chunks of the generated text
+        """
+        spec = self._prepare(prompt_template, kwargs)
+        key = self._cache_key(spec, use_cache, kwargs)
+        prompt_tokens = spec.estimate_tokens(kwargs)
+        self.last_hedge = None
+        self.truncated = False
+        if key is not None:
+            cached = get_response_cache().get(key)
+            if cached is not None:
+                self._observe("stream", spec.name, prompt_tokens).finish(cached, outcome="cache_hit")
+                yield cached
+                return
+
+        flight = self._flight_key(spec, use_cache, kwargs)
+        if flight is None:
+            chunks = self._astream(spec, kwargs, prompt_tokens, key)
+        else:
+            chunks = get_single_flight().astream(
+                flight, lambda: self._astream(spec, kwargs, prompt_tokens, key), self.model_name,
+                self._call_state, self._adopt_state,
+            )
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            # Leave a shared stream as soon as this caller stops reading
+            await chunks.aclose()
+
+    async def _astream(self, spec: PromptSpec, variables: Dict, prompt_tokens: int,
+                       key: Optional[str]) -> AsyncIterator[str]:
+        """Make the upstream call for astream_content and cache the complete response."""
+        parts = []
+        chunks = self._aresumable_content(spec, variables, prompt_tokens)
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+        if key is not None and self._cacheable():
+            get_response_cache().set(key, "".join(parts))
+
+    def _build_chat_messages(self, messages: List[Dict], system_prompt: Optional[str] = None) -> List:
+        """
+        Convert message dictionaries into LangChain messages.
         
         Args:
             messages: List of message dictionaries with 'role' and 'content'
             system_prompt: Optional system prompt to guide the model
             
         Returns:
-            The model's response
+            The list of LangChain messages to send
         """
         langchain_messages = []
         
         # Add system prompt if provided
         if system_prompt:
-            langchain_messages.append({"role": "system", "content": system_prompt})
+            langchain_messages.append(SystemMessage(content=system_prompt))
         
         # Convert messages to LangChain format
         for msg in messages:
@@ -76,16 +1195,213 @@ class GroqGenerator:
                 langchain_messages.append(AIMessage(content=msg["content"]))
         
         # Special handling for DeepSeek model to extract thinking
-        if self.model_name == "deepseek-r1-distill-llama-70b":
+        if self.model_name in THINKING_MODELS:
             # Add instruction to show thinking
-            if langchain_messages[-1].type == "human":
+            if langchain_messages and langchain_messages[-1].type == "human":
+                words = chat_budget(self.model_name).thinking_words
                 langchain_messages[-1] = HumanMessage(
-                    content=f"{langchain_messages[-1].content}\n\nThink step by step before responding. Begin with '<thinking>' and end your thinking with '</thinking>' before giving your final answer."
+                    content=f"{langchain_messages[-1].content}\n\n{THINKING_INSTRUCTION} "
+                            f"Keep your thinking under {words} words."
                 )
         
-        response = self.llm.invoke(langchain_messages)
+        return langchain_messages
+    
+    def _chat_tokens(self, messages: List[Dict], system_prompt: Optional[str]) -> int:
+        """Estimate the prompt tokens of a chat request."""
+        return estimate_tokens(system_prompt or "", self.model_name) + sum(
+            estimate_message_tokens(msg, self.model_name) for msg in messages
+        )
+    
+    def _resumable_chat(self, messages: List[Dict], system_prompt: Optional[str], prompt_tokens: int) -> Iterator[str]:
+        """Stream a chat response, hedged if configured, resuming it if it breaks off."""
+        budget = chat_budget(self.model_name, prompt_tokens)
+        return self._resuming(
+            self._hedged(
+                lambda generator, on_queue: generator._chat_stream(messages, system_prompt, prompt_tokens, on_queue)
+            ),
+            lambda partial: self._continuation_stream(
+                self._build_chat_messages(messages, system_prompt), partial,
+                self._remaining_budget(budget, partial, prompt_tokens), prompt_tokens, "chat_stream", "chat",
+                self.on_queue,
+            ),
+        )
+
+    def _aresumable_chat(self, messages: List[Dict], system_prompt: Optional[str],
+                         prompt_tokens: int) -> AsyncIterator[str]:
+        """Asynchronously stream a chat response, resuming it if it breaks off."""
+        budget = chat_budget(self.model_name, prompt_tokens)
+        return self._aresuming(
+            self._achat_stream(messages, system_prompt, prompt_tokens),
+            lambda partial: self._acontinuation_stream(
+                self._build_chat_messages(messages, system_prompt), partial,
+                self._remaining_budget(budget, partial, prompt_tokens), prompt_tokens, "chat_stream", "chat",
+            ),
+        )
+
+    def chat_with_history(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        """
+        Continue a conversation with message history.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            system_prompt: Optional system prompt to guide the model
+            
+        Returns:
+            The model's response
+        """
+        prompt_tokens = self._chat_tokens(messages, system_prompt)
+        self.truncated = False
+        if self._hedging() or self._thinks():
+            return "".join(self._resumable_chat(messages, system_prompt, prompt_tokens))
+
+        self.last_hedge = None
+        self._admit()
+        budget = chat_budget(self.model_name, prompt_tokens)
+        client = self._client(budget)
+        timer = self._observe("chat", "chat", prompt_tokens)
+        try:
+            response = self._run(
+                estimate_request_tokens(prompt_tokens, budget.max_tokens),
+                lambda: client.invoke(self._build_chat_messages(messages, system_prompt)), self.on_queue,
+            )
+        except Exception:
+            timer.finish(outcome="error")
+            raise
+        self.truncated = _finish_with_message(timer, response)
+        return response.content
+
+    def stream_chat_with_history(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Iterator[str]:
+        """
+        Continue a conversation with message history, yielding tokens as they arrive.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            system_prompt: Optional system prompt to guide the model
+            
+        Yields:
+            Chunks of the model's response
+        """
+        prompt_tokens = self._chat_tokens(messages, system_prompt)
+        self.truncated = False
+        yield from self._resumable_chat(messages, system_prompt, prompt_tokens)
+
+    def _chat_stream(self, messages: List[Dict], system_prompt: Optional[str], prompt_tokens: int,
+                     on_queue: Optional[Callable[[int, float], None]]) -> Iterator[str]:
+        """Stream a chat response from this generator's model through the scheduler."""
+        self._admit()
+        budget = chat_budget(self.model_name, prompt_tokens)
+        client = self._client(budget)
+        timer = self._observe("chat_stream", "chat", prompt_tokens)
+        chunks = _observed_stream(timer, self._stream_upstream(
+            estimate_request_tokens(prompt_tokens, budget.max_tokens),
+            lambda: _text_chunks(client.stream(self._build_chat_messages(messages, system_prompt)), self.model_name,
+                                 self._mark_truncated),
+            on_queue,
+        ))
+        if budget.thinking_tokens is None:
+            return chunks
+        return self._capped_thinking(chunks, budget, lambda: self._build_chat_messages(messages, system_prompt),
+                                     prompt_tokens, "chat_stream", "chat")
+    
+    async def achat_with_history(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        """
+        Asynchronously continue a conversation with message history.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            system_prompt: Optional system prompt to guide the model
+            
+        Returns:
+            The model's response
+        """
+        prompt_tokens = self._chat_tokens(messages, system_prompt)
+        self.last_hedge = None
+        self.truncated = False
+        if self._thinks():
+            # The thinking cap needs the live thinking block
+            return "".join([chunk async for chunk in self._aresumable_chat(messages, system_prompt, prompt_tokens)])
+
+        self._admit()
+        budget = chat_budget(self.model_name, prompt_tokens)
+        client = self._client(budget)
+        timer = self._observe("chat", "chat", prompt_tokens)
+        try:
+            response = await self._arun(
+                estimate_request_tokens(prompt_tokens, budget.max_tokens),
+                lambda: client.ainvoke(self._build_chat_messages(messages, system_prompt)),
+            )
+        except Exception:
+            timer.finish(outcome="error")
+            raise
+        self.truncated = _finish_with_message(timer, response)
         return response.content
+
+    async def astream_chat_with_history(self, messages: List[Dict], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Asynchronously continue a conversation, yielding tokens as they arrive.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            system_prompt: Optional system prompt to guide the model
+            
+        Yields:
+            Chunks of the model's response
+        """
+        prompt_tokens = self._chat_tokens(messages, system_prompt)
+        self.last_hedge = None
+        self.truncated = False
+        chunks = self._aresumable_chat(messages, system_prompt, prompt_tokens)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    def _achat_stream(self, messages: List[Dict], system_prompt: Optional[str],
+                      prompt_tokens: int) -> AsyncIterator[str]:
+        """Asynchronously stream a chat response from this generator's model through the scheduler."""
+        self._admit()
+        budget = chat_budget(self.model_name, prompt_tokens)
+        client = self._client(budget)
+        timer = self._observe("chat_stream", "chat", prompt_tokens)
+        chunks = _aobserved_stream(timer, self._astream_upstream(
+            estimate_request_tokens(prompt_tokens, budget.max_tokens),
+            lambda: _atext_chunks(client.astream(self._build_chat_messages(messages, system_prompt)), self.model_name,
+                                  self._mark_truncated),
+        ))
+        if budget.thinking_tokens is None:
+            return chunks
+        return self._acapped_thinking(chunks, budget, lambda: self._build_chat_messages(messages, system_prompt),
+                                      prompt_tokens, "chat_stream", "chat")
     
+    def stream_continuation(self, messages: List[Dict], partial: str,
+                            system_prompt: Optional[str] = None) -> Iterator[str]:
+        """
+        Continue a response that was cut off, yielding the missing text as it arrives.
+
+        Args:
+            messages: The conversation the response answered, without the response
+            partial: The response so far
+            system_prompt: Optional system prompt to guide the model
+
+        Yields:
+            Chunks of the rest of the response
+        """
+        self.last_hedge = None
+        self.truncated = False
+        get_telemetry().increment("continued", self.model_name)
+        prompt_tokens = self._chat_tokens(messages, system_prompt)
+        prompt_messages = self._build_chat_messages(messages, system_prompt)
+
+        def continue_from(text: str) -> Iterator[str]:
+            # The partial response used up its own budget, so the rest gets a fresh one
+            used = prompt_tokens + estimate_tokens(text, self.model_name)
+            budget = continuation_budget(chat_budget(self.model_name, used), 0, self.model_name, used)
+            return self._continuation_stream(prompt_messages, text, budget, prompt_tokens, "chat_stream", "chat",
+                                             self.on_queue)
+
+        yield from self._resuming(continue_from(partial), lambda tail: continue_from(partial + tail))
+
     def update_model(self, model_name: str, temperature: float = None):
         """
         Update the model being used.
@@ -98,10 +1414,7 @@ class GroqGenerator:
         if temperature is not None:
             self.temperature = temperature
         
-        self.llm = ChatGroq(
-            model_name=model_name,
-            temperature=self.temperature,
-        )
+        self.llm = get_client_registry().get(model_name, self.temperature, self.backend)
         
     @staticmethod
     def parse_deepseek_thinking(response: str) -> tuple:
@@ -114,13 +1427,6 @@ class GroqGenerator:
         Returns:
             A tuple of (thinking, answer) parts
         """
-        thinking = ""
-        answer = response
-        
-        if "<thinking>" in response and "</thinking>" in response:
-            parts = response.split("</thinking>", 1)
-            if len(parts) == 2:
-                thinking = parts[0].split("<thinking>", 1)[1].strip()
-                answer = parts[1].strip()
-        
-        return thinking, answer
\ No newline at end of file
+        parser = ThinkingStreamParser()
+        parser.feed(response)
+        return parser.finish()
\ No newline at end of file
@@ -0,0 +1,359 @@
+"""
+Per-model circuit breakers and health tracking.
+
+A model whose calls keep failing, or keep taking too long to produce a
+first token, is taken out of service for a cool-down period: requests to
+it fail at once instead of each waiting for its own timeout. After the
+cool-down a single trial request is let through. If it succeeds the model
+is back in service, otherwise it stays out for twice as long.
+
+Kept free of LangChain imports so the pages can show model health without
+loading the client stack.
+"""
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+from utils.hedging import cancelled_here
+from utils.telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Consecutive failed or slow calls that open a model's breaker
+FAILURE_THRESHOLD = int(os.environ.get("INTELLECTAI_BREAKER_FAILURES", 5))
+
+# Seconds an open breaker rejects requests before letting a trial through
+COOLDOWN_SECONDS = float(os.environ.get("INTELLECTAI_BREAKER_COOLDOWN", 30.0))
+
+# Upper bound on the cool-down, which doubles after every failed trial
+MAX_COOLDOWN_SECONDS = 300.0
+
+# Time to first token above which a call counts as failed
+SLOW_CALL_SECONDS = float(os.environ.get("INTELLECTAI_BREAKER_SLOW_SECONDS", 20.0))
+
+# Recent first-token latencies kept per model
+LATENCY_WINDOW = 20
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelUnavailableError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+    def __init__(self, model_name: str, retry_in: float, reason: str):
+        super().__init__(f"{model_name} is temporarily unavailable ({reason}). "
+                         f"It will be tried again in {retry_in:.0f}s; choose another model meanwhile.")
+        self.model_name = model_name
+        self.retry_in = retry_in
+
+
+def counts_as_failure(error: BaseException) -> bool:
+    """Whether an upstream error says something about the model's health."""
+    # Rate limits are handled by the scheduler and say nothing about the model,
+    # and a hedge loser fails because its connection was aborted on purpose
+    return (getattr(error, "status_code", None) != 429 and not isinstance(error, ModelUnavailableError)
+            and not cancelled_here())
+
+
+def _describe(error: BaseException) -> str:
+    """Short description of an upstream error."""
+    status = getattr(error, "status_code", None)
+    return f"HTTP {status}" if status is not None else type(error).__name__
+
+
+class CircuitBreaker:
+    """
+    Health of one model: closed (in service), open (rejecting requests) or
+    half open (letting a single trial request through).
+
+    Every upstream attempt goes through call, acall, stream or astream,
+    which record its outcome. Streams count as successful once their first
+    chunk arrives, and as failed if they break off later.
+    """
+
+    def __init__(self, model_name: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 cooldown: float = COOLDOWN_SECONDS, max_cooldown: float = MAX_COOLDOWN_SECONDS,
+                 slow_call_seconds: float = SLOW_CALL_SECONDS):
+        """
+        Initialize a closed breaker.
+
+        Args:
+            model_name: The model this breaker guards
+            failure_threshold: Consecutive failed or slow calls that open it
+            cooldown: Seconds it stays open before the first trial
+            max_cooldown: Upper bound on the cool-down after failed trials
+            slow_call_seconds: Time to first token above which a call fails
+        """
+        self.model_name = model_name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.slow_call_seconds = slow_call_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._current_cooldown = cooldown
+        self._trial_running = False
+        self._consecutive_failures = 0
+        self._last_failure = ""
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _state_locked(self, now: float) -> str:
+        """Current state, moving an open breaker to half open once its cool-down is over."""
+        if self._state == OPEN and now - self._opened_at >= self._current_cooldown:
+            self._state = HALF_OPEN
+        return self._state
+
+    def _rejection_locked(self, now: float) -> Optional[ModelUnavailableError]:
+        """The error to reject a request with right now, or None if it may go ahead."""
+        state = self._state_locked(now)
+        if state == CLOSED or (state == HALF_OPEN and not self._trial_running):
+            return None
+        retry_in = max(0.0, self._opened_at + self._current_cooldown - now)
+        return ModelUnavailableError(self.model_name, retry_in,
+                                     f"{self._consecutive_failures} failed calls, last: {self._last_failure}")
+
+    def _reject(self, error: ModelUnavailableError):
+        """Count and raise a rejection."""
+        get_telemetry().increment("breaker_rejected", self.model_name)
+        raise error
+
+    def check(self):
+        """
+        Fail fast if a request would be rejected, before it queues for the model.
+
+        Raises:
+            ModelUnavailableError: If the breaker is open or its trial is running
+        """
+        with self._lock:
+            error = self._rejection_locked(time.monotonic())
+        if error is not None:
+            self._reject(error)
+
+    def _begin(self) -> bool:
+        """Admit one upstream attempt, returning whether it is the half-open trial."""
+        with self._lock:
+            error = self._rejection_locked(time.monotonic())
+            trial = error is None and self._state == HALF_OPEN
+            if trial:
+                self._trial_running = True
+        if error is not None:
+            self._reject(error)
+        return trial
+
+    def _finish(self, trial: bool, error: Optional[BaseException] = None, latency: Optional[float] = None):
+        """
+        Record the outcome of an upstream attempt.
+
+        Args:
+            trial: Whether the attempt was the half-open trial
+            error: The error it raised, if any
+            latency: Its time to first token, for streams
+        """
+        if error is not None and not counts_as_failure(error):
+            self._release(trial)
+            return
+        failure = _describe(error) if error is not None else None
+        if failure is None and latency is not None and latency > self.slow_call_seconds:
+            failure = f"first token after {latency:.1f}s"
+
+        opened = False
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            if trial:
+                self._trial_running = False
+            if failure is None:
+                if self._state != CLOSED:
+                    logger.info("Circuit for %s closed", self.model_name)
+                self._state = CLOSED
+                self._consecutive_failures = 0
+                self._current_cooldown = self.cooldown
+                return
+
+            self._consecutive_failures += 1
+            self._last_failure = failure
+            if trial:
+                # The model is still failing; wait longer before the next trial
+                self._current_cooldown = min(self._current_cooldown * 2, self.max_cooldown)
+            if trial or (self._state == CLOSED and self._consecutive_failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                opened = True
+
+        if opened:
+            logger.warning("Circuit for %s opened for %.0fs after %d failed calls (last: %s)",
+                           self.model_name, self._current_cooldown, self._consecutive_failures, failure)
+            get_telemetry().increment("breaker_opened", self.model_name)
+
+    def _release(self, trial: bool):
+        """Give up an attempt that says nothing about the model, such as a cancelled one."""
+        if trial:
+            with self._lock:
+                self._trial_running = False
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """
+        Make one upstream call through the breaker.
+
+        Args:
+            fn: Function performing the request
+
+        Returns:
+            The call's result
+        """
+        trial = self._begin()
+        try:
+            result = fn()
+        except Exception as error:
+            self._finish(trial, error)
+            raise
+        except BaseException:
+            self._release(trial)
+            raise
+        self._finish(trial)
+        return result
+
+    def stream(self, make_stream: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """
+        Make one streamed upstream call through the breaker.
+
+        Args:
+            make_stream: Function starting the streamed request
+
+        Yields:
+            Chunks of the response
+        """
+        trial = self._begin()
+        started = time.perf_counter()
+        settled = False
+        try:
+            for chunk in make_stream():
+                if not settled:
+                    settled = True
+                    self._finish(trial, latency=time.perf_counter() - started)
+                yield chunk
+        except Exception as error:
+            # A stream breaking off after its first chunk counts as well
+            self._finish(trial and not settled, error)
+            raise
+        except BaseException:
+            if not settled:
+                self._release(trial)
+            raise
+        if not settled:
+            self._finish(trial)
+
+    async def acall(self, make_call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Await one upstream call through the breaker.
+
+        Args:
+            make_call: Coroutine factory performing the request
+
+        Returns:
+            The call's result
+        """
+        trial = self._begin()
+        try:
+            result = await make_call()
+        except Exception as error:
+            self._finish(trial, error)
+            raise
+        except BaseException:
+            self._release(trial)
+            raise
+        self._finish(trial)
+        return result
+
+    async def astream(self, make_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Make one asynchronously streamed upstream call through the breaker.
+
+        Args:
+            make_stream: Function starting the streamed request
+
+        Yields:
+            Chunks of the response
+        """
+        trial = self._begin()
+        started = time.perf_counter()
+        settled = False
+        try:
+            async for chunk in make_stream():
+                if not settled:
+                    settled = True
+                    self._finish(trial, latency=time.perf_counter() - started)
+                yield chunk
+        except Exception as error:
+            self._finish(trial and not settled, error)
+            raise
+        except BaseException:
+            if not settled:
+                self._release(trial)
+            raise
+        if not settled:
+            self._finish(trial)
+
+    def health(self) -> Dict:
+        """
+        Summarize the model's health.
+
+        Returns:
+            State, availability, seconds until the next trial, consecutive
+            failures, the last failure and the median recent time to first token
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._state_locked(now)
+            latencies = list(self._latencies)
+            return {
+                "model": self.model_name,
+                "state": state,
+                "available": state != OPEN,
+                "retry_in": max(0.0, self._opened_at + self._current_cooldown - now) if state == OPEN else 0.0,
+                "consecutive_failures": self._consecutive_failures,
+                "last_failure": self._last_failure,
+                "p50_ttft": statistics.median(latencies) if latencies else None,
+            }
+
+
+class BreakerRegistry:
+    """Thread-safe set of circuit breakers, one per model."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, model_name: str) -> CircuitBreaker:
+        """Return a model's breaker, creating it on first use."""
+        with self._lock:
+            breaker = self._breakers.get(model_name)
+            if breaker is None:
+                breaker = self._breakers[model_name] = CircuitBreaker(model_name)
+            return breaker
+
+    def available(self, model_name: str) -> bool:
+        """Whether requests to a model are currently let through."""
+        return self.get(model_name).health()["available"]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Return the health of every model called so far."""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {model: breaker.health() for model, breaker in sorted(breakers.items())}
+
+
+_breakers = BreakerRegistry()
+
+
+def get_breakers() -> BreakerRegistry:
+    """Return the process-wide circuit breakers."""
+    return _breakers
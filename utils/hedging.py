@@ -0,0 +1,298 @@
+"""
+Hedged requests: race a fallback model when the primary is slow to start.
+
+If the primary model has not produced its first token within the deadline,
+the same request is sent to a fallback model. Whichever produces a first
+token first wins; the other stream is cancelled, and the HTTP layer closes
+its connection so a stalled loser does not wait for the read timeout.
+
+Only the synchronous generation paths used by the pages are hedged; the
+async paths serve the API server, where each request already has its own
+task and the scheduler's queue, so they always call the selected model.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List, Optional
+from utils.telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+# Minimum telemetry samples before the p95 TTFT replaces the fixed deadline
+MIN_P95_SAMPLES = 20
+
+# Marks the end of a pump's stream
+_DONE = object()
+
+# The pump draining a stream on the current thread, if any
+_local = threading.local()
+
+
+def on_cancel(abort: Callable[[], None]):
+    """
+    Register a function that aborts an upstream call made on this thread.
+
+    The HTTP layer calls this for every response it opens. If the stream
+    being pumped on this thread is cancelled, abort is called from the
+    cancelling thread, which unblocks a read that is waiting for data.
+
+    Args:
+        abort: Function aborting the call
+    """
+    pump = getattr(_local, "pump", None)
+    if pump is not None:
+        pump.add_abort(abort)
+
+
+def cancelled_here() -> bool:
+    """Whether the stream pumped on this thread was cancelled, so its errors are not failures."""
+    pump = getattr(_local, "pump", None)
+    return pump is not None and pump.cancelled.is_set()
+
+
+class HedgePolicy:
+    """When and where to hedge a slow request."""
+
+    def __init__(self, fallback_model: str, deadline: float = 5.0, use_p95: bool = False):
+        """
+        Initialize the policy.
+
+        Args:
+            fallback_model: Model from AVAILABLE_MODELS to race against the primary
+            deadline: Seconds to wait for the primary's first token
+            use_p95: Use the primary's observed p95 time to first token as the
+                deadline once enough calls have been recorded
+        """
+        self.fallback_model = fallback_model
+        self.deadline = deadline
+        self.use_p95 = use_p95
+
+    def first_token_deadline(self, model_name: str) -> float:
+        """
+        Return the first-token deadline for a model.
+
+        Args:
+            model_name: The primary model
+
+        Returns:
+            The deadline in seconds
+        """
+        if self.use_p95:
+            telemetry = get_telemetry()
+            samples = [r for r in telemetry.recent(model_name) if r.outcome == "ok" and r.ttft is not None]
+            if len(samples) >= MIN_P95_SAMPLES:
+                return telemetry.model_stats(model_name)["p95_ttft"]
+        return self.deadline
+
+    @classmethod
+    def from_env(cls) -> Optional["HedgePolicy"]:
+        """
+        Build a policy from INTELLECTAI_HEDGE_* environment variables.
+
+        Returns:
+            The configured policy, or None if INTELLECTAI_HEDGE_FALLBACK is unset
+        """
+        fallback = os.environ.get("INTELLECTAI_HEDGE_FALLBACK")
+        if not fallback:
+            return None
+        return cls(
+            fallback_model=fallback,
+            deadline=float(os.environ.get("INTELLECTAI_HEDGE_DEADLINE", 5.0)),
+            use_p95=os.environ.get("INTELLECTAI_HEDGE_USE_P95", "").lower() in ("1", "true", "yes"),
+        )
+
+
+class HedgeOutcome:
+    """Which model answered a hedged request and how much time hedging saved."""
+
+    def __init__(self, primary_model: str, fallback_model: str):
+        self.primary_model = primary_model
+        self.fallback_model = fallback_model
+        self.hedged = False
+        self.winner: Optional[str] = None
+        self.time_saved: Optional[float] = None
+
+
+class StreamPump:
+    """
+    Drains one stream into a queue on a worker thread.
+
+    Lets a caller start several streams at once and consume them later, in
+    any order, without losing chunks produced in the meantime.
+    """
+
+    def __init__(self, name: str, make_stream: Callable[[], Iterator[str]],
+                 events: Optional["queue.Queue"] = None):
+        """
+        Start draining a stream.
+
+        Args:
+            name: Label for the stream, such as its model
+            make_stream: Function starting the stream, called on the worker thread
+            events: Optional queue receiving ("first" | "done" | "error", pump) events
+        """
+        self.name = name
+        self.chunks: "queue.Queue" = queue.Queue()
+        self.cancelled = threading.Event()
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._make_stream = make_stream
+        self._events = events
+        self._on_late_first_token: Optional[Callable[[float], None]] = None
+        self._lock = threading.Lock()
+        self._aborts: List[Callable[[], None]] = []
+        self._finished = False
+        threading.Thread(target=self._run, name=f"hedge-{name}", daemon=True).start()
+
+    def _run(self):
+        _local.pump = self
+        stream = None
+        try:
+            stream = self._make_stream()
+            for chunk in stream:
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                    self._notify(("first", self))
+                    if self.cancelled.is_set() and self._on_late_first_token is not None:
+                        self._on_late_first_token(self.first_token_at - self.started)
+                if self.cancelled.is_set():
+                    return
+                self.chunks.put(chunk)
+            self._settle()
+            self.chunks.put(_DONE)
+            self._notify(("done", self))
+        except Exception as e:
+            self._settle()
+            self.chunks.put(e)
+            self._notify(("error", self))
+        finally:
+            self._settle()
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            _local.pump = None
+
+    def _settle(self):
+        """Mark the stream finished before anyone hears of it, so a later cancel aborts nothing."""
+        with self._lock:
+            # Finished responses go back to the connection pool and must not be aborted
+            self._finished = True
+            self._aborts.clear()
+
+    def _notify(self, event):
+        if self._events is not None:
+            self._events.put(event)
+
+    def add_abort(self, abort: Callable[[], None]):
+        """Register a function aborting an upstream call of this stream, see on_cancel."""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._aborts.append(abort)
+                return
+        abort()
+
+    def cancel(self, on_late_first_token: Optional[Callable[[float], None]] = None):
+        """Stop forwarding chunks and abort the stream's upstream calls."""
+        self._on_late_first_token = on_late_first_token
+        with self._lock:
+            self.cancelled.set()
+            aborts = [] if self._finished else list(self._aborts)
+            self._aborts.clear()
+        for abort in aborts:
+            try:
+                abort()
+            except Exception as e:
+                logger.debug("Could not abort %s stream: %s", self.name, e)
+
+    def drain(self) -> Iterator[str]:
+        """Yield this pump's chunks until the stream ends."""
+        while True:
+            item = self.chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def hedged_stream(primary_model: str, make_primary: Callable[[], Iterator[str]],
+                  fallback_model: str, make_fallback: Callable[[], Iterator[str]],
+                  deadline: float, outcome: Optional[HedgeOutcome] = None) -> Iterator[str]:
+    """
+    Stream from the primary model, hedging to the fallback after a deadline.
+
+    The fallback is also started immediately if the primary fails before
+    its first token.
+
+    Args:
+        primary_model: Name of the primary model
+        make_primary: Function starting the primary stream
+        fallback_model: Name of the fallback model
+        make_fallback: Function starting the fallback stream
+        deadline: Seconds to wait for the primary's first token
+        outcome: Optional object filled in with the winner and time saved
+
+    Yields:
+        Chunks from the winning stream
+    """
+    outcome = outcome or HedgeOutcome(primary_model, fallback_model)
+    telemetry = get_telemetry()
+    events: "queue.Queue" = queue.Queue()
+    primary = StreamPump(primary_model, make_primary, events)
+    fallback: Optional[StreamPump] = None
+    started = time.perf_counter()
+    winner: Optional[StreamPump] = None
+    failed = []
+
+    while True:
+        timeout = None
+        if fallback is None:
+            timeout = max(0.0, deadline - (time.perf_counter() - started))
+        try:
+            kind, pump = events.get(timeout=timeout)
+        except queue.Empty:
+            kind, pump = "deadline", primary
+
+        if kind in ("first", "done"):
+            winner = pump
+            break
+        if kind == "error":
+            failed.append(pump)
+
+        # Deadline passed, or the primary failed before its first token
+        if fallback is None:
+            outcome.hedged = True
+            telemetry.increment("hedge_fired", primary_model)
+            logger.info("Hedging %s to %s after %.2fs (%s)", primary_model, fallback_model,
+                        time.perf_counter() - started, kind)
+            fallback = StreamPump(fallback_model, make_fallback, events)
+        elif len(failed) == 2:
+            break
+
+    if winner is None:
+        # Both models failed; surface the most recent error
+        yield from failed[-1].drain()
+        return
+
+    outcome.winner = winner.name
+    if outcome.hedged:
+        telemetry.increment("hedge_won", winner.name)
+    loser = fallback if winner is primary else primary
+    if loser is not None and loser not in failed:
+        if winner is fallback:
+            winner_ttft = winner.first_token_at - started if winner.first_token_at else 0.0
+
+            def record_saving(primary_ttft: float):
+                outcome.time_saved = primary_ttft - winner_ttft
+                telemetry.increment("hedge_time_saved_ms", primary_model, int(outcome.time_saved * 1000))
+
+            loser.cancel(record_saving)
+        else:
+            loser.cancel()
+
+    try:
+        yield from winner.drain()
+    finally:
+        # Stop the winner too if the consumer goes away early
+        winner.cancel()
@@ -0,0 +1,225 @@
+"""
+Token-budgeted conversation history for the chat paths.
+"""
+import re
+from typing import Dict, List, Optional
+from utils.conversations import Conversation
+from utils.tokens import context_window, estimate_message_tokens, estimate_tokens
+
+# Upper bound on history sent per turn, even for large-context models
+DEFAULT_HISTORY_BUDGET = 6000
+
+# Tokens kept free in the context window for the model's reply
+DEFAULT_OUTPUT_RESERVE = 2048
+
+# Upper bound on the rolling summary of dropped turns
+DEFAULT_SUMMARY_BUDGET = 400
+
+# Characters of each dropped message quoted in the summary
+SUMMARY_EXCERPT_CHARS = 160
+
+TRUNCATION_MARKER = "\n\n[... middle of draft omitted to fit the context window ...]\n\n"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+class HistoryWindow:
+    """The messages selected for one chat turn and what trimming saved."""
+
+    def __init__(self, messages: List[Dict], system_prompt: Optional[str],
+                 tokens_before: int, tokens_after: int, summary: str):
+        """
+        Initialize the window.
+
+        Args:
+            messages: Messages to send, oldest first
+            system_prompt: System prompt including the rolling summary
+            tokens_before: Estimated tokens of the untrimmed request
+            tokens_after: Estimated tokens of the trimmed request
+            summary: Rolling summary of turns no longer sent verbatim
+        """
+        self.messages = messages
+        self.system_prompt = system_prompt
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.summary = summary
+
+    @property
+    def tokens_saved(self) -> int:
+        """Tokens removed from the request by trimming."""
+        return max(0, self.tokens_before - self.tokens_after)
+
+
+class HistoryManager:
+    """
+    Fits a conversation into a token budget.
+
+    The system prompt, the latest user message and the latest assistant
+    draft are always sent verbatim. Older turns are kept newest-first while
+    they fit; anything older is folded into a compact rolling summary that
+    persists across turns, so each message is summarized only once.
+    """
+
+    def __init__(self, max_input_tokens: int = DEFAULT_HISTORY_BUDGET,
+                 reserve_output_tokens: int = DEFAULT_OUTPUT_RESERVE,
+                 summary_tokens: int = DEFAULT_SUMMARY_BUDGET):
+        """
+        Initialize the manager.
+
+        Args:
+            max_input_tokens: Budget for the whole request
+            reserve_output_tokens: Context space kept free for the reply
+            summary_tokens: Budget for the rolling summary
+        """
+        self.max_input_tokens = max_input_tokens
+        self.reserve_output_tokens = reserve_output_tokens
+        self.summary_tokens = summary_tokens
+        self.summary_lines: List[str] = []
+        self.summarized_count = 0
+
+    def budget_for(self, model_name: str) -> int:
+        """Return the input token budget for a model."""
+        return min(self.max_input_tokens, context_window(model_name) - self.reserve_output_tokens)
+
+    def fit(self, messages: List[Dict], system_prompt: Optional[str], model_name: str,
+            offset: int = 0) -> HistoryWindow:
+        """
+        Select the messages to send for the next turn.
+
+        Args:
+            messages: Conversation from position offset, oldest first, ending
+                with the new user message
+            system_prompt: The conversation system prompt
+            model_name: Model whose tokenizer and context window apply
+            offset: Position of messages[0] in the conversation; turns
+                before summarized_count need not be passed
+
+        Returns:
+            The trimmed window and token accounting
+        """
+        budget = self.budget_for(model_name)
+        costs = [estimate_message_tokens(msg, model_name) for msg in messages]
+        system_cost = estimate_tokens(system_prompt or "", model_name)
+        tokens_before = system_cost + sum(costs)
+
+        if not messages:
+            return HistoryWindow([], system_prompt, tokens_before, tokens_before, self.summary)
+
+        last_index = len(messages) - 1
+        draft_index = next(
+            (i for i in range(last_index - 1, -1, -1) if messages[i]["role"] == "assistant"), None
+        )
+        pinned = {last_index} if draft_index is None else {last_index, draft_index}
+
+        # A shorter history than already summarized means a new conversation
+        if self.summarized_count > offset + min(pinned):
+            self.reset()
+        summarized = max(0, self.summarized_count - offset)
+
+        # Reserve room for the pinned messages and the summary, then add
+        # older turns newest-first while they fit
+        available = budget - system_cost - self._summary_cost(model_name) - sum(costs[i] for i in pinned)
+        start = min(pinned)
+        for i in range(min(pinned) - 1, summarized - 1, -1):
+            if costs[i] > available:
+                break
+            available -= costs[i]
+            start = i
+
+        summary_budget = min(self.summary_tokens, budget // 4)
+        self._fold_into_summary(messages[summarized:start], summary_budget)
+        summarized = max(summarized, start)
+        full_system = self._system_with_summary(system_prompt)
+        tokens_after = estimate_tokens(full_system or "", model_name) + sum(costs[start:])
+
+        # Newly summarized turns may have grown the system prompt past the
+        # reservation: drop further unpinned turns before touching the draft
+        while tokens_after > budget and start < min(pinned):
+            self._fold_into_summary(messages[start:start + 1], summary_budget)
+            start += 1
+            summarized = start
+            full_system = self._system_with_summary(system_prompt)
+            tokens_after = estimate_tokens(full_system or "", model_name) + sum(costs[start:])
+
+        self.summarized_count = offset + summarized
+        selected = [dict(msg) for msg in messages[start:]]
+
+        # The pinned messages alone may still exceed the budget: cut the
+        # middle of the largest one until the request fits
+        for _ in range(len(selected)):
+            if tokens_after <= budget:
+                break
+            largest = max(range(len(selected)), key=lambda i: len(selected[i]["content"]))
+            excess = tokens_after - budget
+            content = selected[largest]["content"]
+            keep = max(0, estimate_tokens(content, model_name) - excess
+                       - estimate_tokens(TRUNCATION_MARKER, model_name))
+            selected[largest]["content"] = self._truncate_middle(content, keep, model_name)
+            tokens_after = estimate_tokens(full_system or "", model_name) + sum(
+                estimate_message_tokens(msg, model_name) for msg in selected
+            )
+
+        return HistoryWindow(selected, full_system, tokens_before, tokens_after, self.summary)
+
+    def fit_conversation(self, conversation: Conversation, system_prompt: Optional[str],
+                         model_name: str) -> HistoryWindow:
+        """
+        Fit a stored conversation, loading only the turns not yet summarized.
+
+        Args:
+            conversation: The conversation, ending with the new user message
+            system_prompt: The conversation system prompt
+            model_name: Model whose tokenizer and context window apply
+
+        Returns:
+            The trimmed window and token accounting
+        """
+        start = min(self.summarized_count, len(conversation))
+        return self.fit(conversation.load(start), system_prompt, model_name, offset=start)
+
+    def reset(self):
+        """Forget the rolling summary, e.g. when a new conversation starts."""
+        self.summary_lines = []
+        self.summarized_count = 0
+
+    @property
+    def summary(self) -> str:
+        """The rolling summary of turns no longer sent verbatim."""
+        return "\n".join(self.summary_lines)
+
+    def _summary_cost(self, model_name: str) -> int:
+        """Tokens the rolling summary adds to the system prompt."""
+        return estimate_tokens(self.summary, model_name)
+
+    def _system_with_summary(self, system_prompt: Optional[str]) -> Optional[str]:
+        """Append the rolling summary to the system prompt."""
+        if not self.summary_lines:
+            return system_prompt
+        return f"{system_prompt or ''}\n\nSummary of the earlier conversation:\n{self.summary}"
+
+    def _fold_into_summary(self, dropped: List[Dict], max_tokens: int):
+        """Add one compact line per dropped message to the rolling summary."""
+        for msg in dropped:
+            content = " ".join(msg["content"].split())
+            first_sentence = _SENTENCE_END.split(content, 1)[0][:SUMMARY_EXCERPT_CHARS]
+            if msg["role"] == "user":
+                self.summary_lines.append(f"- User asked: {first_sentence}")
+            else:
+                words = len(content.split())
+                self.summary_lines.append(f"- Assistant replied ({words} words): {first_sentence}")
+
+        # Keep the summary within budget by forgetting its oldest lines
+        while self.summary_lines and estimate_tokens(self.summary) > max_tokens:
+            self.summary_lines.pop(0)
+
+    @staticmethod
+    def _truncate_middle(text: str, keep_tokens: int, model_name: str) -> str:
+        """Keep roughly keep_tokens of text, split between its head and tail."""
+        words = text.split(" ")
+        if keep_tokens <= 0:
+            return TRUNCATION_MARKER.strip()
+        ratio = keep_tokens / max(1, estimate_tokens(text, model_name))
+        keep_words = max(1, int(len(words) * ratio))
+        head = keep_words // 2
+        tail = keep_words - head
+        return " ".join(words[:head]) + TRUNCATION_MARKER + " ".join(words[len(words) - tail:])
@@ -0,0 +1,237 @@
+"""
+Long-form generation: outline first, then sections in parallel.
+
+A long story or script decoded in one request takes as long as its full
+length. Here the model first writes a compact outline, then every section
+is generated concurrently with the outline, the consistency notes and its
+neighbours' plans as shared context. Sections are streamed back in order
+as soon as each is ready, and a final consistency pass applies targeted
+edits to the stitched draft.
+"""
+import json
+import logging
+import math
+from typing import Iterator, List, Optional
+from utils.groq_client import GroqGenerator, IncompleteResponseError, without_thinking
+from utils.hedging import StreamPump
+from utils.models import THINKING_MODELS, strip_thinking
+from utils.prompting import LONGFORM_OUTLINE_TEMPLATE, LONGFORM_SECTION_TEMPLATE, PROMPTS
+from utils.revisions import revise_draft
+from utils.telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+# Words per section the outline aims for
+DEFAULT_SECTION_WORDS = 400
+
+# Sections per piece, whatever its length
+MIN_SECTIONS = 2
+MAX_SECTIONS = 8
+
+CONSISTENCY_REQUEST = (
+    "These sections were written in parallel. Fix only inconsistencies between them: character "
+    "names, facts, tense, point of view, passages repeated across sections, and abrupt transitions "
+    "at section boundaries."
+)
+
+class OutlineSection:
+    """One planned section of a long-form piece."""
+
+    def __init__(self, title: str, plan: str):
+        self.title = title
+        self.plan = plan
+
+
+class Outline:
+    """Sections and shared consistency notes planned before writing."""
+
+    def __init__(self, sections: List[OutlineSection], notes: str = ""):
+        self.sections = sections
+        self.notes = notes
+
+    def render(self) -> str:
+        """Format the outline for the section prompts."""
+        return "\n".join(f"{i}. {section.title}: {section.plan}" for i, section in enumerate(self.sections, 1))
+
+
+def parse_outline(response: str) -> Optional[Outline]:
+    """
+    Parse the model's JSON outline.
+
+    Args:
+        response: Raw model output, possibly with thinking or code fences
+
+    Returns:
+        The outline, or None if the response is not a usable outline
+    """
+    text = strip_thinking(response)
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        payload = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+
+    sections = [
+        OutlineSection(str(item.get("title", "")).strip(), str(item.get("plan", "")).strip())
+        for item in payload.get("sections", []) if isinstance(item, dict)
+    ] if isinstance(payload, dict) else []
+    sections = [section for section in sections if section.plan]
+    if len(sections) < MIN_SECTIONS:
+        return None
+    return Outline(sections[:MAX_SECTIONS], str(payload.get("notes", "")).strip())
+
+
+class LongFormWriter:
+    """Writes a long piece as an outline plus concurrently generated sections."""
+
+    def __init__(self, generator: GroqGenerator, target_words: int,
+                 section_words: int = DEFAULT_SECTION_WORDS, consistency_pass: bool = True):
+        """
+        Initialize the writer.
+
+        Args:
+            generator: Generator for the model and settings to use
+            target_words: Approximate length of the whole piece
+            section_words: Approximate length of each section
+            consistency_pass: Whether to fix cross-section inconsistencies at the end
+        """
+        self.generator = generator
+        self.target_words = target_words
+        self.section_count = max(MIN_SECTIONS, min(MAX_SECTIONS, math.ceil(target_words / section_words)))
+        self.section_words = max(1, round(target_words / self.section_count))
+        self.consistency_pass = consistency_pass
+        self.outline: Optional[Outline] = None
+        # Final text once stream() is exhausted, after the consistency pass
+        self.content = ""
+        # Whether max_tokens cut off the end of the piece, so it can be continued
+        self.truncated = False
+        # Numbers of the sections before the last that max_tokens cut off
+        self.cut_sections: List[int] = []
+        # Edits the consistency pass applied to the streamed text
+        self.consistency_edits = 0
+        # The model that wrote the end of the piece
+        self.answered_by = generator.model_name
+
+    def plan(self, brief: str, use_cache: bool = True) -> Optional[Outline]:
+        """
+        Generate the outline.
+
+        Args:
+            brief: The fully formatted single-pass prompt
+            use_cache: Whether the response cache may serve this request
+
+        Returns:
+            The outline, or None if the model did not return a usable one
+        """
+        response = self.generator.generate_content(
+            LONGFORM_OUTLINE_TEMPLATE, use_cache=use_cache, brief=brief,
+            sections=self.section_count, section_words=self.section_words,
+        )
+        return parse_outline(response)
+
+    def _section_stream(self, writer: GroqGenerator, brief: str, index: int, use_cache: bool) -> Iterator[str]:
+        """Stream one section from a worker-safe clone of the generator."""
+        sections = self.outline.sections
+        section = sections[index]
+        chunks = writer.stream_content(
+            LONGFORM_SECTION_TEMPLATE, use_cache=use_cache,
+            brief=brief,
+            outline=self.outline.render(),
+            notes=self.outline.notes or "the outline",
+            number=index + 1,
+            total=len(sections),
+            title=section.title,
+            section_words=self.section_words,
+            plan=section.plan,
+            previous=sections[index - 1].plan if index > 0 else "nothing, this is the opening",
+            following=sections[index + 1].plan if index + 1 < len(sections) else "nothing, this is the ending",
+        )
+        if self.generator.model_name in THINKING_MODELS:
+            return without_thinking(chunks)
+        return chunks
+
+    def stream(self, prompt_template: str, use_cache: bool = True, **kwargs) -> Iterator[str]:
+        """
+        Generate the piece, yielding text in order as sections become ready.
+
+        Falls back to a single-pass generation if no usable outline comes back.
+
+        Args:
+            prompt_template: The single-pass prompt template
+            use_cache: Whether the response cache may serve these requests
+            **kwargs: Variables to be formatted into the prompt template
+
+        Yields:
+            Chunks of the stitched text
+        """
+        spec = PROMPTS.resolve(prompt_template)
+        spec.validate(kwargs)
+        brief = spec.template.format(**kwargs).strip()
+        telemetry = get_telemetry()
+
+        self.outline = self.plan(brief, use_cache)
+        if self.outline is None:
+            logger.info("No usable outline; generating %s in a single pass", spec.name)
+            telemetry.increment("longform_fallback", self.generator.model_name)
+            chunks = self.generator.stream_content(prompt_template, use_cache=use_cache, **kwargs)
+            if self.generator.model_name in THINKING_MODELS:
+                chunks = without_thinking(chunks)
+            parts = []
+            try:
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+            except IncompleteResponseError:
+                # Keep what arrived so the caller can store and continue it
+                self.content = "".join(parts)
+                self.truncated = True
+                self.answered_by = self.generator.answered_by
+                raise
+            self.content = "".join(parts)
+            self.truncated = self.generator.truncated
+            self.answered_by = self.generator.answered_by
+            return
+
+        # The model may plan a different number of sections than asked for
+        self.section_words = max(1, round(self.target_words / len(self.outline.sections)))
+        telemetry.increment("longform_sections", self.generator.model_name, len(self.outline.sections))
+        writers = [self.generator.clone() for _ in self.outline.sections]
+        pumps = [
+            StreamPump(f"section-{i + 1}", lambda i=i: self._section_stream(writers[i], brief, i, use_cache))
+            for i in range(len(self.outline.sections))
+        ]
+        sections = []
+        try:
+            for i, pump in enumerate(pumps):
+                if i:
+                    yield "\n\n"
+                parts = []
+                for chunk in pump.drain():
+                    parts.append(chunk)
+                    yield chunk
+                sections.append("".join(parts).strip())
+        except IncompleteResponseError as e:
+            # The piece ends where this section broke off; later sections are dropped
+            sections.append(strip_thinking(e.partial).strip())
+            self.content = "\n\n".join(section for section in sections if section)
+            self.truncated = True
+            self.cut_sections = [n + 1 for n, writer in enumerate(writers[:i]) if writer.truncated]
+            self.answered_by = writers[i].answered_by
+            raise
+        finally:
+            # Stop sections still running if the consumer goes away
+            for pump in pumps:
+                pump.cancel()
+
+        # Only a cut-off last section can be continued from the end of the piece
+        self.truncated = writers[-1].truncated
+        self.cut_sections = [i + 1 for i, writer in enumerate(writers[:-1]) if writer.truncated]
+        self.answered_by = writers[-1].answered_by
+        self.content = "\n\n".join(sections)
+        if self.consistency_pass:
+            revision = revise_draft(self.generator, self.content, CONSISTENCY_REQUEST)
+            if revision is not None:
+                self.content = revision.content
+                self.consistency_edits = len(revision.edits)
@@ -0,0 +1,48 @@
+"""
+Catalog of available models and backends.
+
+Kept free of LangChain and HTTP client imports so the pages can build their
+widgets without loading the client stack, which is only imported once the
+first generation runs.
+"""
+import os
+import re
+
+# Available models
+AVAILABLE_MODELS = [
+    "llama3-70b-8192",
+    "llama-3.3-70b-versatile",
+    "gemma2-9b-it",
+    "deepseek-r1-distill-llama-70b",
+    "qwen-qwq-32b"
+]
+
+# Model choice that routes each request to a suitable model, see utils.routing
+AUTO_MODEL = "auto"
+
+# Settings for headless requests that do not choose their own
+DEFAULT_MODEL = "llama3-70b-8192"
+DEFAULT_TEMPERATURE = 0.7
+
+# Sampling temperatures the Groq API accepts
+MIN_TEMPERATURE = 0.0
+MAX_TEMPERATURE = 2.0
+
+# Models that are asked to expose their reasoning inside <thinking> tags
+THINKING_MODELS = {"deepseek-r1-distill-llama-70b"}
+
+_THINKING_BLOCK = re.compile(r"<thinking>.*?</thinking>", re.DOTALL)
+
+BACKENDS = ("groq", "fake", "replay", "record")
+
+DEFAULT_BACKEND = os.environ.get("INTELLECTAI_BACKEND", "groq")
+
+
+def strip_thinking(text: str) -> str:
+    """Remove complete <thinking> blocks from a model response."""
+    return _THINKING_BLOCK.sub("", text)
+
+
+def requires_api_key(backend: str) -> bool:
+    """Return True if a backend talks to the live Groq API."""
+    return backend in ("groq", "record")
@@ -0,0 +1,365 @@
+"""
+Local form validation and line-level repair for structured poems.
+
+Haiku, tanka, limericks, sonnets and villanelles have checkable structure:
+line and stanza counts, syllables per line, rhyme schemes and refrains.
+Poems are checked locally with heuristic syllable and rhyme estimates.
+Refrains are restored in place, and only the lines that break the form are
+sent back to the model for rewriting.
+"""
+import json
+import logging
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from utils.models import strip_thinking
+from utils.prompting import POEM_REPAIR_TEMPLATE
+from utils.telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+
+class PoemForm:
+    """The checkable structure of a fixed poem form."""
+
+    def __init__(self, lines: int, syllables: Optional[Tuple[int, ...]] = None,
+                 schemes: Tuple[str, ...] = (), stanzas: Optional[Tuple[int, ...]] = None,
+                 refrains: Optional[Dict[int, int]] = None):
+        """
+        Initialize the form.
+
+        Args:
+            lines: Number of lines
+            syllables: Syllables per line, if counted
+            schemes: Accepted rhyme schemes, one letter per line ("-" for unrhymed)
+            stanzas: Lines per stanza, if fixed
+            refrains: Line number mapped to the earlier line it repeats (1-based)
+        """
+        self.lines = lines
+        self.syllables = syllables
+        self.schemes = schemes
+        self.stanzas = stanzas
+        self.refrains = refrains or {}
+
+
+# Forms from the Poetry Generator's POEM_TYPES that have a fixed structure
+POEM_FORMS = {
+    "Haiku": PoemForm(3, syllables=(5, 7, 5)),
+    "Tanka": PoemForm(5, syllables=(5, 7, 5, 7, 7)),
+    "Limerick": PoemForm(5, schemes=("AABBA",)),
+    "Sonnet": PoemForm(14, schemes=("ABABCDCDEFEFGG", "ABBAABBACDECDE", "ABBAABBACDCDCD")),
+    "Villanelle": PoemForm(
+        19, schemes=("ABAABAABAABAABAABAA",), stanzas=(3, 3, 3, 3, 3, 4),
+        refrains={6: 1, 12: 1, 18: 1, 9: 3, 15: 3, 19: 3},
+    ),
+}
+
+# Syllable estimates are heuristic, so lines may be off by this much
+SYLLABLE_TOLERANCE = 1
+
+_WORD = re.compile(r"[a-z']+")
+
+# Markdown headings and lines that are entirely bold or bracketed, such as titles
+_NON_VERSE = re.compile(r"^\s*(#+\s.*|\*\*[^*]+\*\*|\[[^\]]*\])\s*$")
+
+# Common spellings of the same final sound, as in "shoe", "true" and "Peru"
+_SOUND_ALIKE = (
+    ("u", "ue", "oe", "oo", "ew", "ough"),
+    ("ee", "ea", "ie", "ey", "y", "e"),
+    ("ay", "ey", "eigh", "ai"),
+    ("ight", "ite", "yte"),
+    ("ire", "ier", "yre"),
+    ("ow", "oe", "o"),
+)
+
+
+def count_syllables(word: str) -> int:
+    """Estimate the syllables in a word from its vowel groups."""
+    word = re.sub(r"[^a-z]", "", word.lower())
+    if not word:
+        return 0
+    if len(word) <= 3:
+        return 1
+    # Silent endings: "-es", "-ed" and a final "e" after a consonant, but not "-le"
+    word = re.sub(r"(?:[^laeiouy]es|[^laeiouy]ed|[^laeiouy]e)$", lambda m: m.group(0)[0], word)
+    word = re.sub(r"^y", "", word)
+    return max(1, len(re.findall(r"[aeiouy]{1,2}", word)))
+
+
+def line_syllables(line: str) -> int:
+    """Estimate the syllables in a line."""
+    return sum(count_syllables(word) for word in _WORD.findall(line.lower()))
+
+
+def rhyme_key(line: str) -> str:
+    """Return the ending of a line's last word that rhymes with other lines."""
+    words = _WORD.findall(line.lower())
+    if not words:
+        return ""
+    word = words[-1].strip("'")
+    # A silent final "e" belongs with the vowel before it, as in "fire" and "tire"
+    stem, tail = (word[:-1], "e") if len(word) > 2 and word.endswith("e") else (word, "")
+    match = re.search(r"[aeiouy]+[^aeiouy]*$", stem)
+    return (match.group(0) if match else stem) + tail
+
+
+def rhymes(a: str, b: str) -> bool:
+    """Return True if two rhyme keys rhyme, allowing for close spellings."""
+    if not a or not b:
+        return False
+    if a == b or a[-2:] == b[-2:]:
+        return True
+    return any(a.endswith(spellings) and b.endswith(spellings) for spellings in _SOUND_ALIKE)
+
+
+def _normalize_line(line: str) -> str:
+    return " ".join(_WORD.findall(line.lower()))
+
+
+class FormIssue:
+    """One way a poem breaks its form."""
+
+    def __init__(self, message: str, line: Optional[int] = None):
+        """
+        Initialize the issue.
+
+        Args:
+            message: Description of the problem
+            line: 1-based verse line the issue is about, or None for the whole poem
+        """
+        self.message = message
+        self.line = line
+
+    def __str__(self) -> str:
+        return f"Line {self.line}: {self.message}" if self.line else self.message
+
+
+class FormReport:
+    """Result of checking a poem against its form."""
+
+    def __init__(self, poem_type: str, lines: List[str], issues: List[FormIssue]):
+        """
+        Initialize the report.
+
+        Args:
+            poem_type: The poem type checked against
+            lines: The poem's verse lines
+            issues: Problems found
+        """
+        self.poem_type = poem_type
+        self.lines = lines
+        self.issues = issues
+
+    @property
+    def valid(self) -> bool:
+        """True if the poem follows its form."""
+        return not self.issues
+
+    @property
+    def line_numbers(self) -> List[int]:
+        """Verse lines with at least one issue, in order."""
+        return sorted({issue.line for issue in self.issues if issue.line})
+
+    @property
+    def score(self) -> float:
+        """Form compliance between 0 and 1."""
+        form = POEM_FORMS.get(self.poem_type)
+        if form is None:
+            return 1.0
+        if len(self.lines) != form.lines:
+            return max(0.0, 1 - abs(len(self.lines) - form.lines) / form.lines) / 2
+        return 1 - len(self.line_numbers) / form.lines
+
+
+def split_poem(content: str) -> Tuple[List[str], List[int], List[int]]:
+    """
+    Find a poem's verse lines and stanzas.
+
+    Args:
+        content: The poem as generated, possibly with a title
+
+    Returns:
+        A tuple of the verse lines, the index of each in content.splitlines(),
+        and the number of lines in each stanza
+    """
+    verses, positions, stanzas = [], [], []
+    in_stanza = False
+    for index, line in enumerate(content.splitlines()):
+        if not line.strip():
+            in_stanza = False
+            continue
+        if _NON_VERSE.match(line):
+            continue
+        if not in_stanza:
+            stanzas.append(0)
+            in_stanza = True
+        verses.append(line)
+        positions.append(index)
+        stanzas[-1] += 1
+    return verses, positions, stanzas
+
+
+def _scheme_issues(keys: List[str], scheme: str) -> List[FormIssue]:
+    """Check rhyme keys against a scheme; lines outside their group's majority rhyme are flagged."""
+    issues = []
+    groups: Dict[str, List[int]] = {}
+    for index, letter in enumerate(scheme):
+        if letter != "-":
+            groups.setdefault(letter, []).append(index)
+    for letter, indexes in groups.items():
+        if len(indexes) < 2:
+            continue
+        counts = Counter(keys[i] for i in indexes if keys[i])
+        target, count = counts.most_common(1)[0] if counts else ("", 0)
+        if count < 2:
+            # Nothing in the group rhymes; keep the first line and rewrite the rest
+            target = keys[indexes[0]]
+        for i in indexes:
+            if not rhymes(keys[i], target):
+                issues.append(FormIssue(f"should rhyme with the other '{letter}' lines "
+                                        f"(lines {', '.join(str(j + 1) for j in indexes)})", i + 1))
+    return issues
+
+
+def validate_form(content: str, poem_type: str) -> FormReport:
+    """
+    Check a poem against the structure of its type.
+
+    Args:
+        content: The poem, possibly with a title or thinking
+        poem_type: A type from POEM_TYPES; types without a fixed form always pass
+
+    Returns:
+        The report of issues found
+    """
+    lines, _, stanzas = split_poem(strip_thinking(content))
+    form = POEM_FORMS.get(poem_type)
+    if form is None:
+        return FormReport(poem_type, lines, [])
+
+    if len(lines) != form.lines:
+        # Line-level checks are meaningless until the count is right
+        return FormReport(poem_type, lines, [FormIssue(f"A {poem_type} has {form.lines} lines, not {len(lines)}")])
+
+    issues = []
+    if form.stanzas and tuple(stanzas) != form.stanzas:
+        issues.append(FormIssue(f"A {poem_type} has stanzas of {', '.join(map(str, form.stanzas))} lines"))
+    if form.syllables:
+        for number, (line, expected) in enumerate(zip(lines, form.syllables), 1):
+            syllables = line_syllables(line)
+            if abs(syllables - expected) > SYLLABLE_TOLERANCE:
+                issues.append(FormIssue(f"has about {syllables} syllables instead of {expected}", number))
+    for number, source in sorted(form.refrains.items()):
+        if _normalize_line(lines[number - 1]) != _normalize_line(lines[source - 1]):
+            issues.append(FormIssue(f"should repeat line {source} as a refrain", number))
+    if form.schemes:
+        keys = [rhyme_key(line) for line in lines]
+        issues += min((_scheme_issues(keys, scheme) for scheme in form.schemes), key=len)
+    return FormReport(poem_type, lines, issues)
+
+
+class PoemRepair:
+    """A poem with its offending lines rewritten."""
+
+    def __init__(self, content: str, lines: List[int], report: FormReport):
+        """
+        Initialize the repair.
+
+        Args:
+            content: The repaired poem
+            lines: Verse lines that were changed
+            report: The repaired poem's form report
+        """
+        self.content = content
+        self.lines = lines
+        self.report = report
+
+
+def parse_line_edits(response: str) -> Dict[int, str]:
+    """
+    Parse the model's replacement lines.
+
+    Args:
+        response: Raw model output, possibly with thinking or code fences
+
+    Returns:
+        Replacement text by 1-based verse line; empty if the response is unusable
+    """
+    text = strip_thinking(response)
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        payload = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    edits = {}
+    for item in payload.get("lines", []) if isinstance(payload, dict) else []:
+        if isinstance(item, dict) and isinstance(item.get("line"), int) and str(item.get("text", "")).strip():
+            edits[item["line"]] = str(item["text"]).strip()
+    return edits
+
+
+def _replace_lines(content: str, positions: List[int], edits: Dict[int, str]) -> str:
+    """Replace verse lines in the poem, keeping titles, blank lines and indentation."""
+    raw = content.splitlines()
+    for number, text in edits.items():
+        if 1 <= number <= len(positions):
+            original = raw[positions[number - 1]]
+            raw[positions[number - 1]] = original[:len(original) - len(original.lstrip())] + text
+    return "\n".join(raw)
+
+
+def repair_poem(generator, content: str, poem_type: str, topic: str, style: str) -> Optional[PoemRepair]:
+    """
+    Fix the lines of a poem that break its form.
+
+    Refrains are restored locally; other offending lines are rewritten by
+    the model. The repair is kept only if it leaves fewer issues.
+
+    Args:
+        generator: GroqGenerator for the model making the repair
+        content: The poem's answer text
+        poem_type: A type from POEM_TYPES
+        topic: The poem's topic
+        style: The poet whose style it follows
+
+    Returns:
+        The repair, or None if the poem is valid or cannot be repaired line by line
+    """
+    report = validate_form(content, poem_type)
+    telemetry = get_telemetry()
+    if report.valid:
+        telemetry.increment("form_valid", generator.model_name)
+        return None
+    form = POEM_FORMS[poem_type]
+    if len(report.lines) != form.lines:
+        # The wrong number of lines needs a new poem, not a line edit
+        telemetry.increment("form_unrepairable", generator.model_name)
+        return None
+
+    lines, positions, _ = split_poem(content)
+    edits = {number: lines[form.refrains[number] - 1].strip()
+             for number in report.line_numbers if number in form.refrains}
+    remaining = [issue for issue in report.issues if issue.line and issue.line not in edits]
+    if remaining:
+        numbered = "\n".join(f"{i}. {line.strip()}" for i, line in enumerate(lines, 1))
+        response = generator.generate_content(
+            POEM_REPAIR_TEMPLATE, use_cache=False, poem_type=poem_type, topic=topic, style=style,
+            poem=numbered, issues="\n".join(str(issue) for issue in remaining),
+        )
+        flagged = {issue.line for issue in remaining}
+        edits.update({number: text for number, text in parse_line_edits(response).items() if number in flagged})
+    if not edits:
+        telemetry.increment("form_repair_failed", generator.model_name)
+        return None
+
+    repaired = _replace_lines(content, positions, edits)
+    repaired_report = validate_form(repaired, poem_type)
+    if len(repaired_report.issues) >= len(report.issues):
+        logger.info("Discarding %s repair that left %d issues", poem_type, len(repaired_report.issues))
+        telemetry.increment("form_repair_failed", generator.model_name)
+        return None
+
+    telemetry.increment("form_repaired_lines", generator.model_name, len(edits))
+    return PoemRepair(repaired, sorted(edits), repaired_report)
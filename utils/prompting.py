@@ -1,6 +1,15 @@
 """
 Prompt templates for different content generation tasks.
 """
+import hashlib
+import re
+import string
+import threading
+from typing import Dict, Iterable, Tuple
+from utils.tokens import estimate_tokens
+
+# Matches {variable} placeholders in templates
+_PLACEHOLDER_PATTERN = re.compile(r"\{\w+\}")
 
 # YouTube script generation prompt template
 YOUTUBE_SCRIPT_TEMPLATE = """
@@ -68,4 +77,271 @@ CONVERSATION_SYSTEM_PROMPT = """
 You are a helpful AI assistant specializing in creative content. You are having a conversation about a piece of content you just created.
 Be helpful, friendly, and supportive in refining or discussing the content. If asked to make changes or improvements, do so thoughtfully.
 Maintain the original style and quality while incorporating feedback.
-"""
\ No newline at end of file
+"""
+
+# Long-form prompts: a compact outline, then each section written in parallel
+LONGFORM_OUTLINE_TEMPLATE = """
+You are planning a piece of writing that several writers will write at the same time, one section each.
+
+The brief:
+{brief}
+
+Plan it as {sections} sections of about {section_words} words each. Respond with only a JSON object:
+{{"notes": "names, voice, setting and facts every section must keep consistent", "sections": [{{"title": "short section title", "plan": "two or three sentences on what this section covers"}}]}}
+"""
+
+LONGFORM_SECTION_TEMPLATE = """
+You are one of several writers working on the same piece at the same time, each writing one section.
+
+The brief:
+{brief}
+
+The outline:
+{outline}
+
+Keep consistent: {notes}
+
+Write section {number} of {total}, "{title}", in about {section_words} words.
+This section covers: {plan}
+The section before it covers: {previous}
+The section after it covers: {following}
+
+Write only the text of this section so that it follows on from the previous section and leads into the next one. Do not add commentary about the task.
+"""
+
+# Revision prompt asking for targeted edits against numbered blocks of a draft
+REVISION_TEMPLATE = """
+You are revising a piece of creative content. The current draft is split into numbered blocks:
+
+{draft}
+
+Change request: {request}
+
+If this asks for specific changes to the draft, respond with only a JSON object listing the edits. Do not repeat unchanged text:
+{{"edits": [{{"op": "substitute", "block": 2, "old": "exact text from block 2", "new": "replacement text"}}]}}
+
+Available operations:
+- "substitute": replace the exact text "old" inside the block with "new"
+- "replace": replace the whole block with "text"
+- "insert_after": add a new block containing "text" after the block (block 0 is the beginning)
+- "delete": remove the block
+
+Prefer "substitute" for changes within a block. Keep the draft's style and formatting in new text.
+If the request is not a change to the draft, or it would change most of the blocks, respond with only {{"full": true}}.
+"""
+
+# Repair prompt asking for replacements of only the lines that break a poem's form
+POEM_REPAIR_TEMPLATE = """
+You wrote this {poem_type} about {topic} in the style of {style}. Its lines are numbered:
+
+{poem}
+
+These lines do not follow the {poem_type} form:
+{issues}
+
+Rewrite only the listed lines so that they fix these problems while keeping the poem's meaning, imagery and style. Respond with only a JSON object:
+{{"lines": [{{"line": 2, "text": "the rewritten line"}}]}}
+"""
+
+class PromptSpec:
+    """A prompt template compiled once, with its variables and static size."""
+
+    def __init__(self, name: str, template: str):
+        """
+        Parse a prompt template.
+
+        Args:
+            name: Stable identity used by caches and budgets
+            template: The raw template text
+        """
+        self.name = name
+        self.template = template
+        self.variables = frozenset(
+            field for _, field, _, _ in string.Formatter().parse(template) if field
+        )
+        self.static_tokens = estimate_tokens(_PLACEHOLDER_PATTERN.sub("", template))
+        self._prompt = None
+
+    @property
+    def prompt(self):
+        """The LangChain prompt template, compiled on first use."""
+        if self._prompt is None:
+            # Imported here so the pages load without LangChain
+            from langchain_core.prompts import ChatPromptTemplate
+            self._prompt = ChatPromptTemplate.from_template(self.template)
+        return self._prompt
+
+    def estimate_tokens(self, variables: Dict) -> int:
+        """
+        Estimate the prompt size once formatted with the given variables.
+
+        Args:
+            variables: Variables to be formatted into the template
+
+        Returns:
+            An approximate token count
+        """
+        return self.static_tokens + sum(estimate_tokens(str(value)) for value in variables.values())
+
+    def validate(self, variables: Dict):
+        """
+        Check that every template variable has a value.
+
+        Args:
+            variables: Variables to be formatted into the template
+
+        Raises:
+            ValueError: If a required variable is missing
+        """
+        missing = self.variables.difference(variables)
+        if missing:
+            raise ValueError(f"Prompt '{self.name}' is missing variables: {', '.join(sorted(missing))}")
+
+
+class PromptRegistry:
+    """Registry of precompiled prompt templates and their chains per model."""
+
+    # Upper bound on cached ad hoc templates and compiled chains
+    MAX_CACHED = 256
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self._by_name: Dict[str, PromptSpec] = {}
+        self._by_template: Dict[str, PromptSpec] = {}
+        self._chains: Dict[Tuple[str, int], Tuple[object, object]] = {}
+
+    def register(self, name: str, template: str, variables: Iterable[str]) -> PromptSpec:
+        """
+        Compile and register a template.
+
+        Args:
+            name: Stable identity of the template
+            template: The raw template text
+            variables: The variables the template is expected to use
+
+        Returns:
+            The compiled prompt spec
+
+        Raises:
+            ValueError: If the template's variables differ from the declared ones
+        """
+        spec = PromptSpec(name, template)
+        if spec.variables != frozenset(variables):
+            raise ValueError(
+                f"Prompt '{name}' uses variables {sorted(spec.variables)}, expected {sorted(variables)}"
+            )
+        with self._lock:
+            self._by_name[name] = spec
+            self._by_template[template] = spec
+        return spec
+
+    def get(self, name: str) -> PromptSpec:
+        """Return a registered prompt spec by name."""
+        return self._by_name[name]
+
+    def resolve(self, template: str) -> PromptSpec:
+        """
+        Return the spec for a template text, compiling unregistered ones once.
+
+        Args:
+            template: The raw template text
+
+        Returns:
+            The compiled prompt spec
+        """
+        spec = self._by_template.get(template)
+        if spec is not None:
+            return spec
+        name = "adhoc:" + hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+        spec = PromptSpec(name, template)
+        with self._lock:
+            if len(self._by_template) >= len(self._by_name) + self.MAX_CACHED:
+                self._by_template = {registered.template: registered for registered in self._by_name.values()}
+            self._by_template[template] = spec
+        return spec
+
+    def chain(self, spec: PromptSpec, llm):
+        """
+        Return the prompt | model chain for a spec and model client.
+
+        Args:
+            spec: The compiled prompt spec
+            llm: A pooled chat model client
+
+        Returns:
+            A runnable chain producing the model's message, whose metadata
+            says why generation stopped
+        """
+        key = (spec.name, id(llm))
+        entry = self._chains.get(key)
+        if entry is not None and entry[0] is llm:
+            return entry[1]
+        chain = spec.prompt | llm
+        with self._lock:
+            if len(self._chains) >= self.MAX_CACHED:
+                self._chains.clear()
+            self._chains[key] = (llm, chain)
+        return chain
+
+
+PROMPTS = PromptRegistry()
+PROMPTS.register("youtube_script", YOUTUBE_SCRIPT_TEMPLATE, ("topic", "genre"))
+PROMPTS.register("short_story", SHORT_STORY_TEMPLATE, ("topic", "genre", "style", "word_count"))
+PROMPTS.register("poem", POEM_TEMPLATE, ("topic", "style", "poem_type"))
+PROMPTS.register("revision", REVISION_TEMPLATE, ("draft", "request"))
+PROMPTS.register("poem_repair", POEM_REPAIR_TEMPLATE, ("poem_type", "topic", "style", "poem", "issues"))
+PROMPTS.register("longform_outline", LONGFORM_OUTLINE_TEMPLATE, ("brief", "sections", "section_words"))
+PROMPTS.register("longform_section", LONGFORM_SECTION_TEMPLATE, ("brief", "outline", "notes", "number", "total",
+                                                                 "title", "section_words", "plan", "previous",
+                                                                 "following"))
+
+# Registered prompt used for each content type in batch jobs and API requests
+CONTENT_TYPE_PROMPTS = {
+    "script": "youtube_script",
+    "story": "short_story",
+    "poem": "poem",
+}
+
+# Request fields that may be formatted into a content prompt
+JOB_FIELDS = ("topic", "genre", "style", "poem_type", "word_count")
+
+# Request fields holding whole numbers; the others are text
+INTEGER_FIELDS = {"word_count"}
+
+# Longest piece a request may ask for, in words
+MAX_WORD_COUNT = 5000
+
+
+def job_variables(spec: PromptSpec, values: Dict) -> Dict:
+    """
+    Pick a request's prompt variables and convert them to the types the prompt expects.
+
+    Args:
+        spec: The content prompt
+        values: Request fields, such as a batch job or an API payload
+
+    Returns:
+        The variables to format into the prompt
+
+    Raises:
+        ValueError: If a variable is missing or has an unusable value
+    """
+    variables = {}
+    for field in JOB_FIELDS:
+        if field not in spec.variables or field not in values:
+            continue
+        value = values[field]
+        if field in INTEGER_FIELDS:
+            try:
+                # bool is an int subclass, but never a meaningful count
+                value = int(value) if not isinstance(value, bool) else None
+            except (TypeError, ValueError):
+                value = None
+            if value is None or not 1 <= value <= MAX_WORD_COUNT:
+                raise ValueError(f"{field} must be a whole number from 1 to {MAX_WORD_COUNT}")
+        elif not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{field} must be a non-empty string")
+        variables[field] = value
+    spec.validate(variables)
+    return variables
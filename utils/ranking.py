@@ -0,0 +1,97 @@
+"""
+Local ranking of candidate generations.
+
+Several candidates for the same request are scored without another model
+call: form compliance for fixed poem forms (line counts, syllables, rhyme
+and refrains), length against the requested word count, and repetition.
+The best candidate is shown first.
+"""
+import re
+from typing import Dict, List, Optional
+from utils.poetry import POEM_FORMS, validate_form
+
+# Relative weight of each criterion; missing criteria are left out of the average
+WEIGHTS = {"form": 0.5, "length": 0.3, "repetition": 0.2}
+
+_WORD = re.compile(r"[\w'-]+")
+
+
+def count_words(text: str) -> int:
+    """Return the number of words in a text."""
+    return len(_WORD.findall(text))
+
+
+def repetition_score(text: str) -> float:
+    """Share of word trigrams that are distinct; 1.0 means nothing repeats."""
+    words = [word.lower() for word in _WORD.findall(text)]
+    trigrams = list(zip(words, words[1:], words[2:]))
+    if not trigrams:
+        return 1.0
+    return len(set(trigrams)) / len(trigrams)
+
+
+class CandidateScore:
+    """A candidate's overall score and the criteria behind it."""
+
+    def __init__(self, criteria: Dict[str, float]):
+        """
+        Initialize the score.
+
+        Args:
+            criteria: Score per criterion, each between 0 and 1
+        """
+        self.criteria = criteria
+        weight = sum(WEIGHTS[name] for name in criteria)
+        self.total = sum(WEIGHTS[name] * value for name, value in criteria.items()) / weight if weight else 0.0
+
+    def describe(self) -> str:
+        """Short summary for display."""
+        details = ", ".join(f"{name} {value:.0%}" for name, value in self.criteria.items())
+        return f"score {self.total:.0%} ({details})"
+
+
+def score_candidate(content: str, poem_type: Optional[str] = None,
+                    word_count: Optional[int] = None) -> CandidateScore:
+    """
+    Score a candidate against the request it was generated for.
+
+    Args:
+        content: The candidate's answer, without thinking
+        poem_type: The requested poem type, if any
+        word_count: The requested length in words, if any
+
+    Returns:
+        The candidate's score
+    """
+    if not content.strip():
+        return CandidateScore({name: 0.0 for name in WEIGHTS})
+
+    criteria = {}
+    if poem_type in POEM_FORMS:
+        criteria["form"] = validate_form(content, poem_type).score
+    if word_count:
+        criteria["length"] = max(0.0, 1 - abs(count_words(content) - word_count) / word_count)
+    criteria["repetition"] = repetition_score(content)
+    return CandidateScore(criteria)
+
+
+def rank_candidates(results: List[Dict], poem_type: Optional[str] = None,
+                    word_count: Optional[int] = None) -> List[Dict]:
+    """
+    Score candidates and order them best first.
+
+    Cut-off candidates follow the complete ones, and failed candidates go
+    last. Each result gets a 'score' entry.
+
+    Args:
+        results: Result dictionaries with 'content', 'error' and optional 'truncated'
+        poem_type: The requested poem type, if any
+        word_count: The requested length in words, if any
+
+    Returns:
+        The results, best first
+    """
+    for result in results:
+        result["score"] = score_candidate(result["content"], poem_type, word_count) if not result["error"] else None
+    return sorted(results, key=lambda result: (-1.0, -1.0) if result["score"] is None else
+                  (0.0 if result.get("truncated") else 1.0, result["score"].total), reverse=True)
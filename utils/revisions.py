@@ -0,0 +1,212 @@
+"""
+Diff-based revisions of a generated draft.
+
+Instead of having the model re-emit the whole poem, story or script for a
+small change, the draft is split into numbered blocks (paragraphs, stanzas
+or script sections) and the model returns a short list of JSON edits
+against those blocks, which are applied locally. When the model declines
+or its edits do not apply cleanly, callers fall back to regenerating the
+full draft.
+"""
+import json
+import logging
+import re
+from typing import Dict, List, Optional
+from utils.models import strip_thinking
+from utils.prompting import REVISION_TEMPLATE
+from utils.telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+# Blocks are separated by one or more blank lines
+_BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+
+EDIT_OPERATIONS = ("substitute", "replace", "insert_after", "delete")
+
+# Verbs that ask for a change to the draft
+_EDIT_VERBS = re.compile(
+    r"\b(change|replace|swap|rename|make|turn|add|insert|include|remove|delete|drop|cut|omit|fix|correct|"
+    r"edit|revise|reword|rephrase|rewrite|tweak|adjust|shorten|lengthen|expand|trim|tighten|simplify|use)\b",
+    re.IGNORECASE,
+)
+
+# Openings of a question about the draft, as opposed to a polite request ("can you ...")
+_QUESTION_START = re.compile(
+    r"^\s*(what|why|how|who|whom|whose|when|where|which|is|are|was|were|does|do|did|has|have)\b",
+    re.IGNORECASE,
+)
+
+
+class RevisionError(ValueError):
+    """Raised when a model's edits cannot be parsed or applied."""
+
+
+class Revision:
+    """A draft revised by applying a model's edits."""
+
+    def __init__(self, content: str, edits: List[Dict], response: str):
+        """
+        Initialize the revision.
+
+        Args:
+            content: The revised draft
+            edits: The edits that were applied
+            response: The model's raw response
+        """
+        self.content = content
+        self.edits = edits
+        self.response = response
+
+
+def split_blocks(draft: str) -> List[str]:
+    """Split a draft into its blank-line separated blocks."""
+    return [block.strip("\n") for block in _BLOCK_SEPARATOR.split(draft.strip()) if block.strip()]
+
+
+def number_blocks(blocks: List[str]) -> str:
+    """Format blocks with the [n] anchors the revision prompt refers to."""
+    return "\n\n".join(f"[{i}]\n{block}" for i, block in enumerate(blocks, 1))
+
+
+def parse_edits(response: str) -> Optional[List[Dict]]:
+    """
+    Parse the model's revision response.
+
+    Args:
+        response: Raw model output, possibly with thinking or code fences
+
+    Returns:
+        The list of edits, or None if the model asked for a full rewrite
+
+    Raises:
+        RevisionError: If the response is not a valid edit list
+    """
+    text = strip_thinking(response)
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise RevisionError("Response contains no JSON object")
+    try:
+        payload = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise RevisionError(f"Invalid JSON: {e}") from e
+
+    if not isinstance(payload, dict):
+        raise RevisionError("Response is not a JSON object")
+    if payload.get("full"):
+        return None
+    edits = payload.get("edits")
+    if not isinstance(edits, list) or not edits:
+        raise RevisionError("Response has no edits")
+    for edit in edits:
+        if not isinstance(edit, dict) or edit.get("op") not in EDIT_OPERATIONS:
+            raise RevisionError(f"Unknown edit: {edit!r}")
+        if not isinstance(edit.get("block"), int):
+            raise RevisionError(f"Edit has no block number: {edit!r}")
+    return edits
+
+
+def apply_edits(blocks: List[str], edits: List[Dict]) -> str:
+    """
+    Apply edits to a draft's blocks.
+
+    Block numbers refer to the original draft, so edits do not shift each
+    other's anchors.
+
+    Args:
+        blocks: The draft's blocks
+        edits: Edits from parse_edits
+
+    Returns:
+        The revised draft
+
+    Raises:
+        RevisionError: If an anchor or the text to substitute is not found
+    """
+    revised: List[Optional[str]] = list(blocks)
+    inserted: Dict[int, List[str]] = {}
+    for edit in edits:
+        index = edit["block"]
+        op = edit["op"]
+        if op == "insert_after":
+            if not 0 <= index <= len(blocks):
+                raise RevisionError(f"Block {index} does not exist")
+            inserted.setdefault(index, []).append(str(edit.get("text", "")).strip("\n"))
+            continue
+
+        if not 1 <= index <= len(blocks):
+            raise RevisionError(f"Block {index} does not exist")
+        current = revised[index - 1]
+        if current is None:
+            raise RevisionError(f"Block {index} was already deleted")
+        if op == "delete":
+            revised[index - 1] = None
+        elif op == "replace":
+            revised[index - 1] = str(edit.get("text", "")).strip("\n")
+        else:
+            old, new = str(edit.get("old", "")), str(edit.get("new", ""))
+            if not old or old not in current:
+                raise RevisionError(f"Text to substitute not found in block {index}: {old!r}")
+            revised[index - 1] = current.replace(old, new, 1)
+
+    result = list(inserted.get(0, []))
+    for i, block in enumerate(revised, 1):
+        if block is not None:
+            result.append(block)
+        result.extend(inserted.get(i, []))
+    content = "\n\n".join(block for block in result if block.strip())
+    if not content.strip():
+        raise RevisionError("Edits removed the whole draft")
+    return content
+
+
+def is_edit_request(request: str) -> bool:
+    """
+    Cheaply tell a change request from a question or comment about the draft.
+
+    Only change requests are worth a revision call; everything else goes
+    straight to the normal reply.
+
+    Args:
+        request: The user's chat message
+
+    Returns:
+        True if the message asks for a change to the draft
+    """
+    if not _EDIT_VERBS.search(request):
+        return False
+    return not (request.rstrip().endswith("?") and _QUESTION_START.match(request))
+
+
+def revise_draft(generator, draft: str, request: str) -> Optional[Revision]:
+    """
+    Ask the model for targeted edits to a draft and apply them.
+
+    Args:
+        generator: GroqGenerator for the model making the revision
+        draft: The latest assistant draft
+        request: The user's change request
+
+    Returns:
+        The revision, or None if the caller should regenerate the full
+        draft instead (the model declined, or its edits did not apply)
+    """
+    blocks = split_blocks(draft)
+    telemetry = get_telemetry()
+    if not blocks:
+        return None
+
+    response = generator.generate_content(REVISION_TEMPLATE, use_cache=False,
+                                          draft=number_blocks(blocks), request=request)
+    try:
+        edits = parse_edits(response)
+        if edits is None:
+            telemetry.increment("revision_declined", generator.model_name)
+            return None
+        content = apply_edits(blocks, edits)
+    except RevisionError as e:
+        logger.info("Falling back to full regeneration: %s", e)
+        telemetry.increment("revision_failed", generator.model_name)
+        return None
+
+    telemetry.increment("revision_applied", generator.model_name)
+    return Revision(content, edits, response)
@@ -0,0 +1,192 @@
+"""
+Latency-aware routing for the "auto" model choice.
+
+Each request goes to the model expected to finish it soonest among those
+good enough for it: short pieces such as haiku and limericks may use the
+small, fast model, while long stories and scripts need a 70B model. The
+estimate combines the request's expected output length with each model's
+recent time to first token, throughput and queue wait. Models with many
+recent errors, or whose circuit breaker is open, are skipped.
+"""
+import logging
+import statistics
+from typing import Dict
+from utils.budgets import answer_tokens
+from utils.health import get_breakers
+from utils.prompting import CONTENT_TYPE_PROMPTS
+from utils.scheduler import get_scheduler
+from utils.telemetry import get_telemetry
+
+logger = logging.getLogger(__name__)
+
+
+class ModelProfile:
+    """What routing assumes about a model before it has been observed."""
+
+    def __init__(self, quality: int, ttft: float, tokens_per_second: float):
+        """
+        Initialize the profile.
+
+        Args:
+            quality: Quality tier; 2 for 70B models, 1 for small ones
+            ttft: Typical seconds to first token
+            tokens_per_second: Typical output throughput
+        """
+        self.quality = quality
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+
+
+# Models "auto" chooses from. Reasoning models think before answering,
+# which makes them the slowest choice for every content type.
+MODEL_PROFILES = {
+    "llama3-70b-8192": ModelProfile(2, 0.3, 330),
+    "llama-3.3-70b-versatile": ModelProfile(2, 0.3, 275),
+    "gemma2-9b-it": ModelProfile(1, 0.2, 600),
+}
+
+# Expected answers up to this many tokens may use a small model
+SHORT_FORM_TOKENS = 400
+
+# Expected length of a chat reply
+CHAT_TOKENS = 500
+
+# Recent calls per model that the live estimates are based on
+RECENT_CALLS = 20
+
+# Successful recent calls needed before observations replace the profile
+MIN_SAMPLES = 3
+
+# Share of recent calls failing at which a model is skipped
+DEGRADED_ERROR_RATE = 0.3
+
+
+class RouteDecision:
+    """The model chosen for a request and why."""
+
+    def __init__(self, model: str, content_type: str, expected_tokens: int,
+                 estimates: Dict[str, float], skipped: Dict[str, str], reason: str):
+        """
+        Initialize the decision.
+
+        Args:
+            model: The chosen model
+            content_type: script, story, poem or chat
+            expected_tokens: Expected output tokens
+            estimates: Estimated seconds per eligible model
+            skipped: Reason per model that was not considered
+            reason: Short explanation of the choice
+        """
+        self.model = model
+        self.content_type = content_type
+        self.expected_tokens = expected_tokens
+        self.estimates = estimates
+        self.skipped = skipped
+        self.reason = reason
+
+    def describe(self) -> str:
+        """Short summary for display."""
+        return f"{self.model}: {self.reason}"
+
+    def record(self):
+        """Log the decision and count it in telemetry."""
+        logger.info("Routed %s request (~%d tokens) to %s: %s; estimates %s; skipped %s",
+                    self.content_type, self.expected_tokens, self.model, self.reason,
+                    {model: round(seconds, 2) for model, seconds in self.estimates.items()}, self.skipped)
+        get_telemetry().increment("routed", self.model)
+
+
+def _observed(model_name: str) -> Dict:
+    """Summarize a model's recent calls: error rate, median TTFT and throughput."""
+    records = get_telemetry().recent(model_name)[-RECENT_CALLS:]
+    ok = [r for r in records if r.outcome == "ok"]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    throughputs = [r.tokens_per_second for r in ok if r.tokens_per_second is not None]
+    errors = sum(1 for r in records if r.outcome == "error")
+    return {
+        "calls": len(records),
+        "error_rate": errors / len(records) if records else 0.0,
+        "ttft": statistics.median(ttfts) if len(ttfts) >= MIN_SAMPLES else None,
+        "tokens_per_second": statistics.median(throughputs) if len(throughputs) >= MIN_SAMPLES else None,
+    }
+
+
+def expected_output_tokens(content_type: str, variables: Dict) -> int:
+    """
+    Estimate the output length of a request.
+
+    Args:
+        content_type: script, story, poem or chat
+        variables: The request's prompt variables
+
+    Returns:
+        The expected output tokens
+    """
+    prompt_name = CONTENT_TYPE_PROMPTS.get(content_type)
+    if prompt_name is None:
+        return CHAT_TOKENS
+    return int(answer_tokens(prompt_name, variables, ""))
+
+
+def estimate_seconds(model_name: str, output_tokens: int) -> float:
+    """
+    Estimate how long a model would take to produce a response right now.
+
+    Args:
+        model_name: A model from MODEL_PROFILES
+        output_tokens: Expected output tokens
+
+    Returns:
+        Queue wait plus time to first token plus decoding time
+    """
+    profile = MODEL_PROFILES[model_name]
+    observed = _observed(model_name)
+    ttft = observed["ttft"] if observed["ttft"] is not None else profile.ttft
+    throughput = observed["tokens_per_second"] or profile.tokens_per_second
+    wait = get_scheduler().estimated_wait(model_name, output_tokens)
+    return wait + ttft + output_tokens / throughput
+
+
+def route_model(content_type: str, variables: Dict) -> RouteDecision:
+    """
+    Choose the model for an "auto" request.
+
+    Args:
+        content_type: script, story, poem or chat
+        variables: The request's prompt variables
+
+    Returns:
+        The routing decision
+    """
+    tokens = expected_output_tokens(content_type, variables)
+    short = tokens <= SHORT_FORM_TOKENS
+    breakers = get_breakers()
+    skipped = {}
+    estimates = {}
+    for model_name, profile in MODEL_PROFILES.items():
+        if not short and profile.quality < 2:
+            skipped[model_name] = "too small for long pieces"
+            continue
+        if not breakers.available(model_name):
+            skipped[model_name] = "unavailable, circuit open"
+            continue
+        observed = _observed(model_name)
+        if observed["calls"] >= MIN_SAMPLES and observed["error_rate"] >= DEGRADED_ERROR_RATE:
+            skipped[model_name] = f"degraded ({observed['error_rate']:.0%} recent errors)"
+            continue
+        estimates[model_name] = estimate_seconds(model_name, tokens)
+
+    length = "short" if short else "long"
+    if not estimates:
+        # Every suitable model is degraded or out; take the best of them anyway
+        candidates = [name for name, profile in MODEL_PROFILES.items() if short or profile.quality >= 2]
+        available = [name for name in candidates if breakers.available(name)]
+        model = min(available or candidates, key=lambda name: _observed(name)["error_rate"])
+        return RouteDecision(model, content_type, tokens, estimates, skipped,
+                             f"{length} {content_type}, every suitable model degraded or unavailable; fewest errors")
+
+    # Fastest first; between equally fast models prefer the larger one
+    model = min(estimates, key=lambda name: (round(estimates[name], 1), -MODEL_PROFILES[name].quality))
+    return RouteDecision(model, content_type, tokens, estimates, skipped,
+                         f"{length} {content_type} (~{tokens} tokens), fastest suitable model, "
+                         f"~{estimates[model]:.1f}s")
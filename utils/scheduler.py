@@ -0,0 +1,452 @@
+"""
+Rate-limit-aware scheduling of model requests.
+
+Each model gets a pair of token buckets (requests per minute and tokens per
+minute). Requests queue in FIFO order until both buckets allow them, and
+calls rejected with 429 or 5xx responses are retried with jittered
+exponential backoff that honors the provider's retry-after header.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Status codes worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Output tokens assumed for a request when the caller has no better estimate
+DEFAULT_OUTPUT_TOKENS = 1024
+
+
+class ModelLimits:
+    """Per-model provider limits."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        """
+        Initialize the limits.
+
+        Args:
+            requests_per_minute: Maximum requests per minute
+            tokens_per_minute: Maximum input plus output tokens per minute
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+
+# Groq limits per model; adjust to match the account's tier
+DEFAULT_MODEL_LIMITS = {
+    "llama3-70b-8192": ModelLimits(30, 6000),
+    "llama-3.3-70b-versatile": ModelLimits(30, 12000),
+    "gemma2-9b-it": ModelLimits(30, 15000),
+    "deepseek-r1-distill-llama-70b": ModelLimits(30, 6000),
+    "qwen-qwq-32b": ModelLimits(30, 6000),
+}
+
+FALLBACK_LIMITS = ModelLimits(30, 6000)
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at a fixed rate."""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        """
+        Initialize a full bucket.
+
+        Args:
+            capacity: Maximum number of tokens held
+            refill_per_second: Tokens added per second
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        """Add the tokens accrued since the last update."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount tokens are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float, now: float):
+        """Take amount tokens from the bucket."""
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class _ModelQueue:
+    """Buckets, waiters and retry state for one model."""
+
+    def __init__(self, limits: ModelLimits):
+        self.limits = limits
+        self.condition = threading.Condition()
+        self.waiting = deque()
+        # Events of async waiters, with the loop each belongs to
+        self.async_waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.requests = TokenBucket(limits.requests_per_minute, limits.requests_per_minute / 60.0)
+        self.tokens = TokenBucket(limits.tokens_per_minute, limits.tokens_per_minute / 60.0)
+        self.paused_until = 0.0
+
+    def poll_locked(self, ticket: object, estimated_tokens: int) -> Tuple[int, float]:
+        """
+        Take the request's tokens if it is first in line and they are available.
+
+        Caller holds the condition.
+
+        Returns:
+            The ticket's position and the seconds to wait, 0 once the
+            request may proceed
+        """
+        position = self.waiting.index(ticket)
+        now = time.monotonic()
+        if position > 0:
+            return position, position * 60.0 / self.limits.requests_per_minute
+        wait = max(
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(estimated_tokens, now),
+            self.paused_until - now,
+        )
+        if wait <= 0:
+            self.requests.consume(1, now)
+            self.tokens.consume(estimated_tokens, now)
+            return 0, 0.0
+        return 0, wait
+
+    def leave_locked(self, ticket: object):
+        """Remove a ticket from the line and wake every waiter. Caller holds the condition."""
+        self.waiting.remove(ticket)
+        self.condition.notify_all()
+        for loop, event in self.async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+class RateLimitScheduler:
+    """
+    Queues model calls so they stay within per-model provider limits.
+
+    Synchronous callers block in acquire until their turn; async callers
+    wait in aacquire on their event loop, without holding a thread.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, ModelLimits]] = None, max_retries: int = 4,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        """
+        Initialize the scheduler.
+
+        Args:
+            limits: Per-model limits, defaults to DEFAULT_MODEL_LIMITS
+            max_retries: Retries for 429/5xx responses before giving up
+            base_delay: Initial backoff delay in seconds
+            max_delay: Upper bound on a single backoff delay
+        """
+        self.limits = dict(DEFAULT_MODEL_LIMITS if limits is None else limits)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._counters = {"scheduled": 0, "queued": 0, "retries": 0, "rate_limited": 0}
+
+    def _queue(self, model_name: str) -> _ModelQueue:
+        """Return the queue for a model, creating it on first use."""
+        with self._lock:
+            queue = self._queues.get(model_name)
+            if queue is None:
+                queue = _ModelQueue(self.limits.get(model_name, FALLBACK_LIMITS))
+                self._queues[model_name] = queue
+            return queue
+
+    def _count(self, counter: str):
+        """Increment a scheduler counter."""
+        with self._lock:
+            self._counters[counter] += 1
+
+    def acquire(self, model_name: str, estimated_tokens: int,
+                on_queue: Optional[Callable[[int, float], None]] = None):
+        """
+        Block until the model's limits allow one more request.
+
+        Args:
+            model_name: The model to call
+            estimated_tokens: Expected input plus output tokens
+            on_queue: Optional callback receiving (position, estimated wait
+                seconds) whenever the caller's place in line changes, and
+                (0, 0.0) once the request may proceed
+        """
+        queue = self._queue(model_name)
+        ticket = object()
+        with queue.condition:
+            queue.waiting.append(ticket)
+        self._count("scheduled")
+
+        reported = None
+        try:
+            while True:
+                with queue.condition:
+                    position, wait = queue.poll_locked(ticket, estimated_tokens)
+                    if wait <= 0:
+                        break
+
+                if reported is None:
+                    self._count("queued")
+                if on_queue is not None and reported != (position, round(wait)):
+                    on_queue(position + 1, wait)
+                reported = (position, round(wait))
+
+                with queue.condition:
+                    queue.condition.wait(timeout=min(wait, 1.0))
+        finally:
+            with queue.condition:
+                queue.leave_locked(ticket)
+
+        if on_queue is not None and reported is not None:
+            on_queue(0, 0.0)
+
+    async def aacquire(self, model_name: str, estimated_tokens: int):
+        """
+        Wait on the event loop until the model's limits allow one more request.
+
+        Async callers share the FIFO line with synchronous ones but wait
+        without holding a thread, and a cancelled caller gives up its place.
+
+        Args:
+            model_name: The model to call
+            estimated_tokens: Expected input plus output tokens
+        """
+        queue = self._queue(model_name)
+        ticket = object()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with queue.condition:
+            queue.waiting.append(ticket)
+            queue.async_waiters.add(waiter)
+        self._count("scheduled")
+
+        queued = False
+        try:
+            while True:
+                # Cleared before checking, so a wake-up in between is not lost
+                waiter[1].clear()
+                with queue.condition:
+                    _, wait = queue.poll_locked(ticket, estimated_tokens)
+                if wait <= 0:
+                    break
+                if not queued:
+                    queued = True
+                    self._count("queued")
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout=min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with queue.condition:
+                queue.async_waiters.discard(waiter)
+                queue.leave_locked(ticket)
+
+    def _retry_delay(self, model_name: str, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Decide whether a failed call should be retried and after how long.
+
+        Args:
+            model_name: The model that was called
+            error: The raised exception
+            attempt: Zero-based attempt number
+
+        Returns:
+            The delay in seconds, or None if the error should propagate
+        """
+        status = getattr(error, "status_code", None)
+        if status not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+            return None
+
+        retry_after = 0.0
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            retry_after = float(headers.get("retry-after", 0) or 0)
+        except (TypeError, ValueError):
+            retry_after = 0.0
+
+        if status == 429:
+            self._count("rate_limited")
+            # Hold every queued request for this model, not just this one
+            queue = self._queue(model_name)
+            with queue.condition:
+                queue.paused_until = max(queue.paused_until, time.monotonic() + retry_after)
+
+        self._count("retries")
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(retry_after, backoff)
+
+    def run(self, model_name: str, estimated_tokens: int, call: Callable[[], T],
+            on_queue: Optional[Callable[[int, float], None]] = None) -> T:
+        """
+        Run a model call within the model's limits, retrying 429/5xx errors.
+
+        Args:
+            model_name: The model to call
+            estimated_tokens: Expected input plus output tokens
+            call: Function performing the request
+            on_queue: Optional queue position callback, see acquire
+
+        Returns:
+            The call's result
+        """
+        attempt = 0
+        while True:
+            self.acquire(model_name, estimated_tokens, on_queue)
+            try:
+                return call()
+            except Exception as e:
+                delay = self._retry_delay(model_name, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def stream(self, model_name: str, estimated_tokens: int, make_stream: Callable[[], Iterator[str]],
+               on_queue: Optional[Callable[[int, float], None]] = None) -> Iterator[str]:
+        """
+        Stream a model response within the model's limits.
+
+        Errors raised before the first chunk are retried like run; once text
+        has been yielded, errors propagate to the caller.
+
+        Args:
+            model_name: The model to call
+            estimated_tokens: Expected input plus output tokens
+            make_stream: Function starting the streamed request
+            on_queue: Optional queue position callback, see acquire
+
+        Yields:
+            Chunks of the response
+        """
+        attempt = 0
+        while True:
+            self.acquire(model_name, estimated_tokens, on_queue)
+            started = False
+            try:
+                for chunk in make_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(model_name, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def arun(self, model_name: str, estimated_tokens: int, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Asynchronously run a model call within the model's limits.
+
+        Args:
+            model_name: The model to call
+            estimated_tokens: Expected input plus output tokens
+            call: Coroutine factory performing the request
+
+        Returns:
+            The call's result
+        """
+        attempt = 0
+        while True:
+            await self.aacquire(model_name, estimated_tokens)
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(model_name, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def astream(self, model_name: str, estimated_tokens: int,
+                      make_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Asynchronously stream a model response within the model's limits.
+
+        Args:
+            model_name: The model to call
+            estimated_tokens: Expected input plus output tokens
+            make_stream: Function starting the streamed request
+
+        Yields:
+            Chunks of the response
+        """
+        attempt = 0
+        while True:
+            await self.aacquire(model_name, estimated_tokens)
+            started = False
+            try:
+                async for chunk in make_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(model_name, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def estimated_wait(self, model_name: str, estimated_tokens: int) -> float:
+        """
+        Estimate how long a new request would queue for a model, without queuing it.
+
+        Args:
+            model_name: The model to call
+            estimated_tokens: Expected input plus output tokens
+
+        Returns:
+            The estimated wait in seconds
+        """
+        queue = self._queue(model_name)
+        with queue.condition:
+            now = time.monotonic()
+            ready = max(
+                queue.requests.wait_time(1, now),
+                queue.tokens.wait_time(estimated_tokens, now),
+                queue.paused_until - now,
+                0.0,
+            )
+            return ready + len(queue.waiting) * 60.0 / queue.limits.requests_per_minute
+
+    def stats(self) -> Dict:
+        """Return scheduling counters and current queue lengths."""
+        with self._lock:
+            stats = dict(self._counters)
+            queues = dict(self._queues)
+        stats["queue_lengths"] = {model: len(queue.waiting) for model, queue in queues.items()}
+        return stats
+
+
+def estimate_request_tokens(prompt_tokens: int, expected_output_tokens: int = DEFAULT_OUTPUT_TOKENS) -> int:
+    """
+    Estimate the tokens-per-minute cost of a request.
+
+    Args:
+        prompt_tokens: Estimated input tokens
+        expected_output_tokens: Estimated output tokens
+
+    Returns:
+        The total tokens to reserve
+    """
+    return prompt_tokens + expected_output_tokens
+
+
+_scheduler = RateLimitScheduler()
+
+
+def get_scheduler() -> RateLimitScheduler:
+    """Return the process-wide request scheduler."""
+    return _scheduler
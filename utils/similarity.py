@@ -0,0 +1,309 @@
+"""
+Near-duplicate index of past generation requests.
+
+Requests are normalized and broken into character shingles, and MinHash
+signatures with LSH banding find earlier requests with a similar topic and
+the same settings without comparing against every stored one. Matches are
+offered as suggestions, and near-identical ones can be served directly.
+Entries are bounded in memory and persisted in SQLite.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+# Default location of the index on disk
+DEFAULT_SIMILARITY_PATH = os.environ.get(
+    "INTELLECTAI_SIMILARITY_PATH", os.path.join(".cache", "similar.sqlite3")
+)
+
+# Jaccard similarity at which an earlier result is suggested
+SUGGEST_THRESHOLD = float(os.environ.get("INTELLECTAI_SIMILAR_SUGGEST", 0.5))
+
+# Jaccard similarity at which an earlier result is served instead of generating
+SERVE_THRESHOLD = float(os.environ.get("INTELLECTAI_SIMILAR_SERVE", 0.9))
+
+SHINGLE_SIZE = 3
+
+# Words too common to say anything about a topic
+STOPWORDS = frozenset("a an and at by for from in into of on or the to with".split())
+
+# Mersenne prime 2**61 - 1, the modulus of the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and punctuation, and drop stopwords."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    words = _NON_WORD.sub(" ", text.lower()).split()
+    return " ".join(word for word in words if word not in STOPWORDS)
+
+
+def shingles(normalized: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """
+    Return the character shingles of each word in a normalized text.
+
+    Words are shingled separately, so word order does not matter and small
+    inflections only change a shingle or two.
+    """
+    result = set()
+    for word in normalized.split():
+        padded = f" {word} "
+        result.update(padded[i:i + size] for i in range(max(1, len(padded) - size + 1)))
+    return result
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """Jaccard similarity of two shingle sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SimilarMatch:
+    """An earlier request similar to the current one, with its result."""
+
+    def __init__(self, request: str, content: str, thinking: str, model: str, similarity: float):
+        """
+        Initialize the match.
+
+        Args:
+            request: The earlier request message
+            content: The earlier response
+            thinking: The earlier response's thinking, if any
+            model: The model that produced it
+            similarity: Jaccard similarity of the two topics
+        """
+        self.request = request
+        self.content = content
+        self.thinking = thinking
+        self.model = model
+        self.similarity = similarity
+
+
+class _Entry:
+    """An indexed request. Only the fields needed for matching stay in memory."""
+
+    def __init__(self, entry_id: int, partition: str, text: str, shingles: Set[str],
+                 bands: List[Tuple[int, int]]):
+        self.id = entry_id
+        self.partition = partition
+        self.text = text
+        self.shingles = shingles
+        self.bands = bands
+
+
+class SimilarityIndex:
+    """
+    Thread-safe MinHash/LSH index of past requests, persisted in SQLite.
+
+    Requests are partitioned by content type and settings (genre, style,
+    poem type, word count), so only requests that would produce the same
+    kind of output are compared.
+    """
+
+    def __init__(self, max_entries: int = 2000, db_path: Optional[str] = DEFAULT_SIMILARITY_PATH,
+                 num_perm: int = 64, bands: int = 32):
+        """
+        Initialize the index.
+
+        Args:
+            max_entries: Maximum number of requests kept, in memory and on disk
+            db_path: SQLite file for the index, or None for memory only
+            num_perm: Number of MinHash permutations
+            bands: LSH bands; more bands find less similar candidates
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(1)
+        self._permutations = [(rng.randrange(1, _PRIME), rng.randrange(_PRIME)) for _ in range(num_perm)]
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], Set[int]] = defaultdict(set)
+        self._ids: Dict[Tuple[str, str], int] = {}
+        # Results of a memory-only index; otherwise they are read from disk on a match
+        self._results: Dict[int, Tuple[str, str, str, str]] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._loaded = False
+        self._next_id = 1
+
+    @staticmethod
+    def partition(content_type: str, attributes: Dict) -> str:
+        """Return the partition key for a content type and its settings."""
+        return json.dumps([content_type, attributes], sort_keys=True, default=str)
+
+    def _signature_bands(self, items: Set[str]) -> List[Tuple[int, int]]:
+        """Compute the MinHash signature and hash it into (band, bucket) pairs."""
+        hashes = [int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big")
+                  for item in items] or [0]
+        signature = [min((a * h + b) % _PRIME for h in hashes) for a, b in self._permutations]
+        return [(band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows])))
+                for band in range(self.bands)]
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """Open the database on first use. Caller holds the lock."""
+        if self.db_path is None:
+            return None
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS requests ("
+                "id INTEGER PRIMARY KEY, partition TEXT NOT NULL, text TEXT NOT NULL, "
+                "request TEXT NOT NULL, content TEXT NOT NULL, thinking TEXT NOT NULL, "
+                "model TEXT NOT NULL, created_at REAL NOT NULL, UNIQUE (partition, text))"
+            )
+            self._db.commit()
+        return self._db
+
+    def _load(self):
+        """Index the most recent stored requests on first use. Caller holds the lock."""
+        if self._loaded:
+            return
+        self._loaded = True
+        db = self._connection()
+        if db is None:
+            return
+        rows = db.execute("SELECT id, partition, text FROM requests ORDER BY id DESC LIMIT ?",
+                          (self.max_entries,)).fetchall()
+        for entry_id, partition, text in reversed(rows):
+            self._insert(entry_id, partition, text)
+        self._next_id = rows[0][0] + 1 if rows else 1
+
+    def _insert(self, entry_id: int, partition: str, text: str):
+        """Add an entry to memory, evicting the oldest. Caller holds the lock."""
+        items = shingles(text)
+        entry = _Entry(entry_id, partition, text, items, self._signature_bands(items))
+        self._entries[entry_id] = entry
+        self._ids[(partition, text)] = entry_id
+        for band, bucket in entry.bands:
+            self._buckets[(partition, band, bucket)].add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        """Drop an entry from memory. Caller holds the lock."""
+        entry = self._entries.pop(entry_id)
+        del self._ids[(entry.partition, entry.text)]
+        self._results.pop(entry_id, None)
+        for band, bucket in entry.bands:
+            key = (entry.partition, band, bucket)
+            self._buckets[key].discard(entry_id)
+            if not self._buckets[key]:
+                del self._buckets[key]
+
+    def add(self, content_type: str, attributes: Dict, topic: str, request: str, content: str,
+            thinking: str = "", model: str = ""):
+        """
+        Index a generated result.
+
+        A request with the same normalized topic and settings replaces the
+        earlier one.
+
+        Args:
+            content_type: script, story or poem
+            attributes: The request's other settings, such as genre and style
+            topic: The free-text topic the user entered
+            request: The request message shown in the conversation
+            content: The generated response
+            thinking: The response's thinking, if any
+            model: The model that produced it
+        """
+        partition = self.partition(content_type, attributes)
+        text = normalize(topic)
+        if not text or not content.strip():
+            return
+        with self._lock:
+            self._load()
+            if (partition, text) in self._ids:
+                self._remove(self._ids[(partition, text)])
+            entry_id = self._next_id
+            self._next_id += 1
+            db = self._connection()
+            if db is not None:
+                db.execute("DELETE FROM requests WHERE partition = ? AND text = ?", (partition, text))
+                db.execute(
+                    "INSERT INTO requests (id, partition, text, request, content, thinking, model, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry_id, partition, text, request, content, thinking or "", model, time.time()),
+                )
+                db.execute("DELETE FROM requests WHERE id <= ?", (entry_id - self.max_entries,))
+                db.commit()
+            self._insert(entry_id, partition, text)
+            if db is None:
+                self._results[entry_id] = (request, content, thinking or "", model)
+
+    def lookup(self, content_type: str, attributes: Dict, topic: str,
+               threshold: float = SUGGEST_THRESHOLD) -> Optional[SimilarMatch]:
+        """
+        Find the most similar earlier request with the same settings.
+
+        Args:
+            content_type: script, story or poem
+            attributes: The request's other settings, such as genre and style
+            topic: The free-text topic the user entered
+            threshold: Minimum Jaccard similarity of the topics
+
+        Returns:
+            The best match at or above the threshold, or None
+        """
+        partition = self.partition(content_type, attributes)
+        text = normalize(topic)
+        if not text:
+            return None
+        items = shingles(text)
+        with self._lock:
+            self._load()
+            candidates = set()
+            for band, bucket in self._signature_bands(items):
+                candidates |= self._buckets.get((partition, band, bucket), set())
+            scored = [(jaccard(items, self._entries[entry_id].shingles), entry_id) for entry_id in candidates]
+            if not scored:
+                return None
+            similarity, entry_id = max(scored)
+            if similarity < threshold:
+                return None
+            db = self._connection()
+            if db is None:
+                row = self._results.get(entry_id)
+            else:
+                row = db.execute("SELECT request, content, thinking, model FROM requests WHERE id = ?",
+                                 (entry_id,)).fetchone()
+        if row is None:
+            return None
+        return SimilarMatch(*row, similarity=similarity)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """Return the process-wide similarity index."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex()
+        return _index
@@ -0,0 +1,327 @@
+"""
+Per-call LLM telemetry: latency, time to first token, throughput and tokens.
+
+Calls are recorded into rolling per-model windows for percentiles and into
+cumulative counters, and can be exported in the Prometheus text format as
+a file or over HTTP.
+"""
+import http.server
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from utils.tokens import estimate_tokens
+
+# Number of recent calls per model kept for percentiles
+DEFAULT_WINDOW = 500
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class CallRecord:
+    """Measurements for one model call."""
+
+    def __init__(self, model: str, operation: str, content_type: str, outcome: str,
+                 wall_time: float, ttft: Optional[float], input_tokens: int, output_tokens: int):
+        """
+        Initialize the record.
+
+        Args:
+            model: Model that served the call
+            operation: generate, stream, chat or chat_stream
+            content_type: Prompt or content type of the request
+            outcome: ok, error, cancelled or cache_hit
+            wall_time: Seconds from request to last token
+            ttft: Seconds to the first token, if any arrived
+            input_tokens: Prompt tokens
+            output_tokens: Completion tokens
+        """
+        self.model = model
+        self.operation = operation
+        self.content_type = content_type
+        self.outcome = outcome
+        self.wall_time = wall_time
+        self.ttft = ttft
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.timestamp = time.time()
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Output throughput after the first token."""
+        if self.ttft is None or self.output_tokens <= 1:
+            return None
+        generation_time = self.wall_time - self.ttft
+        if generation_time <= 0:
+            return None
+        return (self.output_tokens - 1) / generation_time
+
+
+class CallTimer:
+    """Measures one call in flight and records it when finished."""
+
+    def __init__(self, recorder: "TelemetryRecorder", model: str, operation: str,
+                 content_type: str, input_tokens: int):
+        self.recorder = recorder
+        self.model = model
+        self.operation = operation
+        self.content_type = content_type
+        self.input_tokens = input_tokens
+        self.started = time.perf_counter()
+        self.ttft: Optional[float] = None
+        self.finished = False
+
+    def first_token(self):
+        """Mark the arrival of the first token (later calls are ignored)."""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def finish(self, output: str = "", outcome: str = "ok", output_tokens: Optional[int] = None,
+               input_tokens: Optional[int] = None) -> Optional[CallRecord]:
+        """
+        Record the call.
+
+        Args:
+            output: Text produced by the model
+            outcome: ok, error, cancelled or cache_hit
+            output_tokens: Provider-reported completion tokens, estimated if omitted
+            input_tokens: Provider-reported prompt tokens, overriding the estimate
+
+        Returns:
+            The stored record, or None if the call was already recorded
+        """
+        if self.finished:
+            return None
+        self.finished = True
+        wall_time = time.perf_counter() - self.started
+        if output and self.ttft is None:
+            # Non-streaming calls deliver everything at once
+            self.ttft = wall_time
+        record = CallRecord(
+            model=self.model,
+            operation=self.operation,
+            content_type=self.content_type,
+            outcome=outcome,
+            wall_time=wall_time,
+            ttft=self.ttft,
+            input_tokens=self.input_tokens if input_tokens is None else input_tokens,
+            output_tokens=estimate_tokens(output, self.model) if output_tokens is None else output_tokens,
+        )
+        self.recorder.record(record)
+        return record
+
+
+def _escape_label(value) -> str:
+    """Escape a label value as the Prometheus text format requires."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    """Format a Prometheus label set."""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def _percentile(values: List[float], quantile: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(quantile * len(ordered)) - 1)
+    return ordered[index]
+
+
+class TelemetryRecorder:
+    """Thread-safe store of call records with rolling percentiles."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        """
+        Initialize the recorder.
+
+        Args:
+            window: Recent calls per model kept for percentiles
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._recent: Dict[str, Deque[CallRecord]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._calls: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self._tokens: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._events: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def start(self, model: str, operation: str, content_type: str, input_tokens: int = 0) -> CallTimer:
+        """
+        Begin timing a call.
+
+        Args:
+            model: Model serving the call
+            operation: generate, stream, chat or chat_stream
+            content_type: Prompt or content type of the request
+            input_tokens: Estimated prompt tokens
+
+        Returns:
+            A timer to finish when the call completes
+        """
+        return CallTimer(self, model, operation, content_type, input_tokens)
+
+    def record(self, record: CallRecord):
+        """Store a finished call."""
+        with self._lock:
+            self._calls[(record.model, record.content_type, record.outcome)] += 1
+            if record.outcome == "cache_hit":
+                # Cache hits say nothing about model latency
+                return
+            self._recent[record.model].append(record)
+            self._tokens[(record.model, "input")] += record.input_tokens
+            self._tokens[(record.model, "output")] += record.output_tokens
+
+    def increment(self, event: str, model: str = "", amount: int = 1):
+        """
+        Count a named event, such as a hedge or a limit being hit.
+
+        Args:
+            event: Event name, used as the metric suffix
+            model: Optional model label
+            amount: Amount to add
+        """
+        with self._lock:
+            self._events[(event, model)] += amount
+
+    def recent(self, model: str) -> List[CallRecord]:
+        """Return the rolling window of calls for a model."""
+        with self._lock:
+            return list(self._recent.get(model, ()))
+
+    def models(self) -> List[str]:
+        """Return the models with recorded calls."""
+        with self._lock:
+            return sorted(self._recent)
+
+    def model_stats(self, model: str) -> Dict:
+        """
+        Summarize the rolling window for a model.
+
+        Args:
+            model: The model name
+
+        Returns:
+            Call and error counts plus latency, TTFT and throughput percentiles
+        """
+        records = self.recent(model)
+        latencies = [r.wall_time for r in records if r.outcome == "ok"]
+        ttfts = [r.ttft for r in records if r.outcome == "ok" and r.ttft is not None]
+        throughputs = [r.tokens_per_second for r in records
+                       if r.outcome == "ok" and r.tokens_per_second is not None]
+        errors = sum(1 for r in records if r.outcome == "error")
+        return {
+            "model": model,
+            "calls": len(records),
+            "errors": errors,
+            "error_rate": errors / len(records) if records else 0.0,
+            "p50_latency": _percentile(latencies, 0.5),
+            "p95_latency": _percentile(latencies, 0.95),
+            "p50_ttft": _percentile(ttfts, 0.5),
+            "p95_ttft": _percentile(ttfts, 0.95),
+            "p50_tokens_per_second": _percentile(throughputs, 0.5),
+        }
+
+    def render_prometheus(self) -> str:
+        """
+        Export metrics in the Prometheus text exposition format.
+
+        Returns:
+            The metrics text
+        """
+        with self._lock:
+            calls = dict(self._calls)
+            tokens = dict(self._tokens)
+            events = dict(self._events)
+            recent = {model: list(records) for model, records in self._recent.items()}
+
+        lines = [
+            "# HELP intellectai_llm_calls_total LLM calls by model, content type and outcome.",
+            "# TYPE intellectai_llm_calls_total counter",
+        ]
+        for (model, content_type, outcome), count in sorted(calls.items()):
+            lines.append(f"intellectai_llm_calls_total"
+                         f"{_labels(model=model, content_type=content_type, outcome=outcome)} {count}")
+
+        lines += [
+            "# HELP intellectai_llm_tokens_total Input and output tokens by model.",
+            "# TYPE intellectai_llm_tokens_total counter",
+        ]
+        for (model, direction), count in sorted(tokens.items()):
+            lines.append(f"intellectai_llm_tokens_total{_labels(model=model, direction=direction)} {count}")
+
+        summaries = (
+            ("latency_seconds", "Wall time per successful call.", lambda r: r.wall_time),
+            ("ttft_seconds", "Time to first token per successful call.", lambda r: r.ttft),
+            ("output_tokens_per_second", "Output throughput per successful call.",
+             lambda r: r.tokens_per_second),
+        )
+        for name, help_text, metric in summaries:
+            lines += [f"# HELP intellectai_llm_{name} {help_text} (rolling window)",
+                      f"# TYPE intellectai_llm_{name} summary"]
+            for model, records in sorted(recent.items()):
+                values = [metric(r) for r in records if r.outcome == "ok" and metric(r) is not None]
+                for quantile in QUANTILES:
+                    value = _percentile(values, quantile)
+                    if value is not None:
+                        lines.append(f"intellectai_llm_{name}{_labels(model=model, quantile=quantile)} {value:.6f}")
+                lines.append(f"intellectai_llm_{name}_sum{_labels(model=model)} {sum(values):.6f}")
+                lines.append(f"intellectai_llm_{name}_count{_labels(model=model)} {len(values)}")
+
+        if events:
+            lines += ["# HELP intellectai_events_total Named generation events.",
+                      "# TYPE intellectai_events_total counter"]
+            for (event, model), count in sorted(events.items()):
+                lines.append(f"intellectai_events_total{_labels(event=event, model=model)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write the Prometheus metrics text to a file."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the shared recorder's metrics on /metrics."""
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = get_telemetry().render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are frequent; keep them out of the app's output
+        pass
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> http.server.ThreadingHTTPServer:
+    """
+    Serve /metrics in a background thread.
+
+    Args:
+        port: Port to listen on
+        host: Interface to bind
+
+    Returns:
+        The running server
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="intellectai-metrics", daemon=True).start()
+    return server
+
+
+_telemetry = TelemetryRecorder()
+
+
+def get_telemetry() -> TelemetryRecorder:
+    """Return the process-wide telemetry recorder."""
+    return _telemetry
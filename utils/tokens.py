@@ -0,0 +1,80 @@
+"""
+Cheap local token estimation and per-model context limits.
+"""
+import re
+from typing import Dict, Optional
+
+# Words, numbers and individual punctuation marks roughly map to tokens
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Long words are split into several tokens by BPE tokenizers
+_CHARS_PER_WORD_TOKEN = 6
+
+# Relative tokenizer density per model family, measured against Llama 3
+MODEL_TOKEN_RATIOS = {
+    "llama": 1.0,
+    "deepseek": 1.0,
+    "gemma": 1.05,
+    "qwen": 1.1,
+}
+
+# Context window sizes in tokens
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "llama-3.3-70b-versatile": 131072,
+    "gemma2-9b-it": 8192,
+    "deepseek-r1-distill-llama-70b": 131072,
+    "qwen-qwq-32b": 131072,
+}
+
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Fixed per-message cost of role markers and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _model_ratio(model_name: Optional[str]) -> float:
+    """Return the tokenizer density ratio for a model."""
+    if model_name:
+        for family, ratio in MODEL_TOKEN_RATIOS.items():
+            if family in model_name:
+                return ratio
+    return 1.0
+
+
+def estimate_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """
+    Estimate the number of tokens in a piece of text.
+
+    Args:
+        text: The text to measure
+        model_name: Optional model whose tokenizer density to apply
+
+    Returns:
+        An approximate token count
+    """
+    if not text:
+        return 0
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        count += 1 + (len(piece) - 1) // _CHARS_PER_WORD_TOKEN
+    return int(count * _model_ratio(model_name) + 0.5)
+
+
+def estimate_message_tokens(message: Dict, model_name: Optional[str] = None) -> int:
+    """
+    Estimate the tokens a chat message occupies in a request.
+
+    Args:
+        message: Message dictionary with 'role' and 'content'
+        model_name: Optional model whose tokenizer density to apply
+
+    Returns:
+        An approximate token count including per-message overhead
+    """
+    return estimate_tokens(message["content"], model_name) + MESSAGE_OVERHEAD_TOKENS
+
+
+def context_window(model_name: str) -> int:
+    """Return the context window size of a model in tokens."""
+    return MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
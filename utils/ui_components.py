@@ -0,0 +1,582 @@
+"""
+Reusable UI components shared by the generator pages.
+"""
+import concurrent.futures
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import streamlit as st
+from utils.aio import run_async
+from utils.conversations import Conversation, get_conversation_store
+from utils.health import HALF_OPEN, get_breakers
+from utils.models import AUTO_MODEL, THINKING_MODELS
+from utils.ranking import rank_candidates
+from utils.revisions import is_edit_request, revise_draft
+from utils.routing import RouteDecision, route_model
+from utils.similarity import SimilarMatch, get_similarity_index
+from utils.telemetry import get_telemetry
+
+# Minimum seconds between placeholder refreshes while streaming
+STREAM_REFRESH_INTERVAL = 0.05
+
+STREAM_CURSOR = "▌"
+
+# Session state keys holding a page's conversation, cleared when switching sessions
+CONVERSATION_KEY_SUFFIXES = ("_messages", "_generated", "_history", "_comparison", "_candidates", "_history_page")
+
+# Latest messages always rendered in full; older ones are paged in groups of this size
+HISTORY_PAGE_SIZE = 6
+
+
+def render_message(message: dict):
+    """
+    Render a stored chat message, including any DeepSeek thinking.
+
+    Args:
+        message: Message dictionary with 'role', 'content' and optional
+            'thinking', 'tokens_saved', 'routed', 'model', 'truncated',
+            'cut_sections' and 'consistency_edits'
+    """
+    with st.chat_message(message["role"]):
+        if message["role"] == "assistant" and message.get("thinking"):
+            with st.expander("View thinking process"):
+                st.markdown(message["thinking"])
+        st.markdown(message["content"])
+        if message.get("edits"):
+            st.caption(f"Revised in place with {message['edits']} targeted edit(s)")
+        if message.get("consistency_edits"):
+            st.caption(f"Consistency pass: {message['consistency_edits']} edit(s) applied to the streamed sections")
+        if message.get("cut_sections"):
+            sections = ", ".join(str(number) for number in message["cut_sections"])
+            st.caption(f"Section(s) {sections} hit the length limit and may end abruptly")
+        if message.get("repaired"):
+            st.caption(f"Rewrote {message['repaired']} line(s) to fit the poem's form")
+        if message.get("form_issues"):
+            st.caption("Form check: " + "; ".join(message["form_issues"]))
+        if message.get("reused"):
+            st.caption(f"Reused an earlier result for a {message['reused']:.0%} similar request")
+        if message.get("tokens_saved"):
+            st.caption(f"Context trimmed to fit the token budget: ~{message['tokens_saved']} tokens saved")
+        if message.get("routed"):
+            st.caption(f"Auto model: {message['routed']}")
+        if message.get("truncated"):
+            st.caption("This response was cut off before the end; press Continue to finish it")
+
+
+def model_label(model: str) -> str:
+    """Display name for a model selectbox option, marking models that are out of service."""
+    if model == AUTO_MODEL:
+        return "auto (fastest suitable model)"
+    health = get_breakers().get(model).health()
+    if not health["available"]:
+        return f"{model} (unavailable, retry in {health['retry_in']:.0f}s)"
+    if health["state"] == HALF_OPEN:
+        return f"{model} (recovering)"
+    return model
+
+
+def resolve_model(model: str, content_type: str, variables: Dict) -> Tuple[str, Optional[RouteDecision]]:
+    """
+    Resolve the "auto" model choice for the current inputs and show where it routes.
+
+    Args:
+        model: The selected model, possibly AUTO_MODEL
+        content_type: script, story or poem
+        variables: The request's prompt variables
+
+    Returns:
+        The model to use, and the routing decision if it was chosen automatically
+    """
+    if model != AUTO_MODEL:
+        return model, None
+    decision = route_model(content_type, variables)
+    st.caption(f"Auto model: {decision.describe()}")
+    return decision.model, decision
+
+
+def render_history(conversation: Conversation, key_prefix: str, page_size: int = HISTORY_PAGE_SIZE):
+    """
+    Render a conversation with only its latest messages in full.
+
+    Older messages are grouped into fixed pages behind a selector and are
+    only loaded from the conversation store and rendered when the user
+    opens one, so a rerun re-sends a bounded number of messages however
+    long the conversation gets.
+
+    Args:
+        conversation: The page's stored conversation
+        key_prefix: Prefix that keeps widget keys unique per page
+        page_size: Messages per page of older history
+    """
+    # Keep user/assistant pairs together
+    total = len(conversation)
+    recent_start = max(0, total - page_size)
+    recent_start -= recent_start % 2
+    if recent_start:
+        pages = [(start, min(start + page_size, recent_start)) for start in range(0, recent_start, page_size)]
+        labels = ["Hidden"] + [f"Messages {start + 1}-{end}" for start, end in pages]
+        page = st.selectbox(f"Earlier messages ({recent_start})", range(len(labels)),
+                            format_func=labels.__getitem__, key=f"{key_prefix}_history_page")
+        if page:
+            with st.container(border=True):
+                for message in conversation.load(*pages[page - 1]):
+                    render_message(message)
+
+    for message in conversation.load(recent_start):
+        render_message(message)
+
+
+def render_continue(conversation: Conversation, key_prefix: str, model: str, temperature: float,
+                    history, system_prompt: Optional[str], on_complete: Optional[Callable[[object, Dict], Dict]] = None):
+    """
+    Offer to finish the latest response if it was cut off, and continue it in place.
+
+    The model picks up from the end of the partial response instead of
+    regenerating it, and the stored message is replaced by the full one.
+
+    Args:
+        conversation: The page's stored conversation
+        key_prefix: Prefix that keeps widget keys unique per page
+        model: The model to continue with when the message doesn't name its own
+        temperature: Sampling temperature
+        history: The page's HistoryManager, which fits the conversation
+            before the response into the model's token budget
+        system_prompt: The conversation system prompt
+        on_complete: Optional function taking the generator and the finished
+            message and returning the message to store, for checks that
+            wait for the complete response
+    """
+    last = conversation.messages[-1] if conversation.messages else None
+    if last is None or last["role"] != "assistant" or not last.get("truncated"):
+        return
+    if not st.button("Continue", key=f"{key_prefix}_continue", help="Finish the response from where it stopped"):
+        return
+
+    # Deferred so pages render without loading the client stack
+    from utils.groq_client import GroqGenerator
+
+    # Continue on the model that wrote the response, which may be a hedge fallback
+    model = last.get("model") or model
+    try:
+        generator = GroqGenerator(model_name=model, temperature=temperature, on_queue=queue_status())
+        start = min(history.summarized_count, len(conversation) - 1)
+        window = history.fit(conversation.load(start, len(conversation) - 1), system_prompt, model, offset=start)
+        partial = last["content"]
+        chunks = generator.stream_continuation(window.messages, partial, system_prompt=window.system_prompt)
+        _, response = render_stream(itertools.chain([partial], chunks))
+        message = dict(last, content=response, truncated=generator.truncated)
+        if on_complete is not None and not message["truncated"]:
+            message = on_complete(generator, message)
+    except Exception as e:
+        st.error(f"Error: {str(e)}")
+        return
+    conversation.replace_last(message)
+    st.rerun()
+
+
+def render_revision(generator, conversation: Conversation, request: str) -> Optional[Dict]:
+    """
+    Try to apply a change request as targeted edits to the latest draft.
+
+    Args:
+        generator: GroqGenerator with the current model settings
+        conversation: The page's conversation, ending with the request
+        request: The user's change request
+
+    Returns:
+        The rendered revision as an assistant message, or None if the
+        message is not a change request or the draft should be
+        regenerated in full instead
+    """
+    # Questions and comments skip the extra model call
+    if not is_edit_request(request):
+        return None
+    draft = next((msg for msg in reversed(conversation.messages) if msg["role"] == "assistant"), None)
+    if draft is None:
+        return None
+    with st.spinner("Applying edits..."):
+        revision = revise_draft(generator, draft["content"], request)
+    if revision is None:
+        return None
+    message = {"role": "assistant", "content": revision.content, "edits": len(revision.edits)}
+    render_message(message)
+    return message
+
+
+def queue_status() -> Callable[[int, float], None]:
+    """
+    Create a placeholder that shows the request's place in the rate-limit queue.
+
+    Returns:
+        A callback for GroqGenerator's on_queue parameter
+    """
+    placeholder = st.empty()
+
+    def update(position: int, wait: float):
+        if position == 0:
+            placeholder.empty()
+        else:
+            placeholder.info(f"⏳ Waiting for the model's rate limit: position {position} in queue "
+                             f"(about {wait:.0f}s)")
+
+    return update
+
+
+def render_stream(chunks: Iterable[str], parse_thinking: bool = False) -> Tuple[str, str]:
+    """
+    Render a streamed assistant response as the tokens arrive.
+
+    When parse_thinking is set, the <thinking> block is routed into a live
+    "View thinking process" expander and only the answer is shown in the
+    message body.
+
+    Args:
+        chunks: Iterable of text chunks from the model
+        parse_thinking: Whether to split out a <thinking> block
+
+    Returns:
+        A tuple of (thinking, answer) for the complete response, or for the
+        part that arrived if it broke off and could not be continued
+    """
+    # Deferred so pages render without loading the client stack
+    from utils.groq_client import IncompleteResponseError, ThinkingStreamParser
+
+    with st.chat_message("assistant"):
+        thinking_placeholder = None
+        if parse_thinking:
+            with st.expander("View thinking process", expanded=True):
+                thinking_placeholder = st.empty()
+        answer_placeholder = st.empty()
+        answer_placeholder.markdown(STREAM_CURSOR)
+
+        parser = ThinkingStreamParser() if parse_thinking else None
+        thinking_text = ""
+        answer_text = ""
+        last_refresh = 0.0
+
+        try:
+            for chunk in chunks:
+                if parser is None:
+                    answer_text += chunk
+                else:
+                    for kind, text in parser.feed(chunk):
+                        if kind == ThinkingStreamParser.THINKING:
+                            thinking_text += text
+                        else:
+                            answer_text += text
+
+                now = time.monotonic()
+                if now - last_refresh >= STREAM_REFRESH_INTERVAL:
+                    if thinking_placeholder is not None and thinking_text:
+                        thinking_placeholder.markdown(thinking_text)
+                    answer_placeholder.markdown(answer_text + STREAM_CURSOR)
+                    last_refresh = now
+        except IncompleteResponseError as e:
+            # Keep what arrived; the page offers to continue it
+            st.warning(f"{e}. Showing the response so far.")
+
+        if parser is None:
+            thinking, answer = "", answer_text
+        else:
+            thinking, answer = parser.finish()
+
+        if thinking_placeholder is not None:
+            thinking_placeholder.markdown(thinking)
+        answer_placeholder.markdown(answer)
+
+    return thinking, answer
+
+
+async def _timed(call: Callable[[], Awaitable[str]]) -> Tuple[str, float]:
+    """Await a model call and measure its wall time."""
+    started = time.perf_counter()
+    response = await call()
+    return response, time.perf_counter() - started
+
+
+def _finished(generator, future: concurrent.futures.Future, started: float) -> Dict:
+    """
+    Turn a finished generation into a result dictionary.
+
+    A response that broke off keeps its text so far and is marked truncated.
+    """
+    from utils.groq_client import IncompleteResponseError
+
+    model = generator.model_name
+    result = {"model": model, "content": "", "thinking": "", "elapsed": 0.0, "error": ""}
+    try:
+        response, result["elapsed"] = future.result()
+    except IncompleteResponseError as e:
+        response, result["elapsed"] = e.partial, time.perf_counter() - started
+    except Exception as e:
+        result["error"] = str(e)
+        result["elapsed"] = time.perf_counter() - started
+        return result
+    if model in THINKING_MODELS:
+        result["thinking"], result["content"] = generator.parse_deepseek_thinking(response)
+    else:
+        result["content"] = response
+    result["answered_by"] = generator.answered_by
+    result["truncated"] = generator.truncated
+    return result
+
+
+def run_comparison(models: List[str], temperature: float, call: Callable[[object], Awaitable[str]]) -> List[Dict]:
+    """
+    Fan one request out to several models concurrently.
+
+    Each model gets its own column, filled in as soon as that model
+    finishes, so the total wait is close to the slowest single model.
+
+    Args:
+        models: The models to compare
+        temperature: Sampling temperature
+        call: Coroutine factory producing the response from a model's GroqGenerator
+
+    Returns:
+        One result dictionary per model, in the order given, with
+        'model', 'content', 'thinking', 'elapsed' and 'error', plus
+        'answered_by' and 'truncated' for the models that answered
+    """
+    from utils.groq_client import GroqGenerator
+
+    columns = st.columns(len(models))
+    placeholders = {}
+    for column, model in zip(columns, models):
+        with column:
+            st.markdown(f"**{model}**")
+            placeholders[model] = st.empty()
+            placeholders[model].info("Generating...")
+
+    started = time.perf_counter()
+    generators = {}
+    for model in models:
+        generator = GroqGenerator(model_name=model, temperature=temperature)
+        generators[run_async(_timed(lambda generator=generator: call(generator)))] = generator
+    results = {}
+    for future in concurrent.futures.as_completed(generators):
+        result = _finished(generators[future], future, started)
+        model = result["model"]
+        if result["error"]:
+            placeholders[model].error(f"Error: {result['error']}")
+        else:
+            placeholders[model].markdown(result["content"])
+        results[model] = result
+
+    return [results[model] for model in models]
+
+
+def run_candidates(model: str, temperature: float, call: Callable[[object], Awaitable[str]], count: int,
+                   poem_type: Optional[str] = None, word_count: Optional[int] = None) -> List[Dict]:
+    """
+    Generate several candidates for one request concurrently and rank them.
+
+    Args:
+        model: The model generating the candidates
+        temperature: Sampling temperature
+        call: Coroutine factory producing one candidate from a GroqGenerator
+        count: Number of candidates
+        poem_type: The requested poem type, for form compliance
+        word_count: The requested length in words
+
+    Returns:
+        Result dictionaries as from run_comparison plus a 'score', best first
+    """
+    from utils.groq_client import GroqGenerator
+
+    progress = st.progress(0.0, text=f"Generating {count} candidates...")
+    started = time.perf_counter()
+    generators = {}
+    for _ in range(count):
+        generator = GroqGenerator(model_name=model, temperature=temperature)
+        generators[run_async(_timed(lambda generator=generator: call(generator)))] = generator
+    results = []
+    for done, future in enumerate(concurrent.futures.as_completed(generators), 1):
+        results.append(_finished(generators[future], future, started))
+        progress.progress(done / count, text=f"Generated {done} of {count} candidates")
+    progress.empty()
+
+    return rank_candidates(results, poem_type, word_count)
+
+
+def render_candidates(candidates: Dict, key_prefix: str,
+                      on_select: Optional[Callable[[Dict], None]] = None):
+    """
+    Render ranked candidates, the best in full and the others on demand.
+
+    Args:
+        candidates: Dictionary with the user 'request' and ranked 'results'
+        key_prefix: Prefix that keeps widget keys unique per page
+        on_select: Callback receiving the chosen result before the next rerun
+    """
+    st.subheader("Candidates")
+    for rank, result in enumerate(candidates["results"], 1):
+        label = f"Candidate {rank}"
+        if result["error"]:
+            with st.expander(f"{label} · failed"):
+                st.error(f"Error: {result['error']}")
+            continue
+        with st.expander(f"{label} · {result['score'].describe()} · {result['elapsed']:.1f}s", expanded=rank == 1):
+            if result["thinking"]:
+                st.caption("Thinking process")
+                st.markdown(result["thinking"])
+            st.markdown(result["content"])
+            if result["truncated"]:
+                st.caption("Cut off before the end; keep it to continue it")
+            st.button("Continue with this version", key=f"{key_prefix}_candidate_{rank}",
+                      use_container_width=True, on_click=on_select, args=(result,) if on_select else None)
+
+
+def render_comparison(comparison: Dict, key_prefix: str,
+                      on_select: Optional[Callable[[Dict], None]] = None) -> Optional[Dict]:
+    """
+    Render stored side-by-side results with a button to keep each one.
+
+    Args:
+        comparison: Dictionary with the user 'request' and model 'results'
+        key_prefix: Prefix that keeps widget keys unique per page
+        on_select: Optional callback receiving the chosen result before the
+            next rerun, so the choice shows up without forcing another one
+
+    Returns:
+        The result the user chose to continue with, or None
+    """
+    st.subheader("Model Comparison")
+    results = comparison["results"]
+    selected = None
+    for column, result in zip(st.columns(len(results)), results):
+        with column:
+            st.markdown(f"**{result['model']}**")
+            st.caption(f"{result['elapsed']:.1f}s")
+            if result["error"]:
+                st.error(f"Error: {result['error']}")
+                continue
+            if result["thinking"]:
+                with st.expander("View thinking process"):
+                    st.markdown(result["thinking"])
+            st.markdown(result["content"])
+            if result.get("truncated"):
+                st.caption("Cut off before the end; keep it to continue it")
+            if st.button("Continue with this version", key=f"{key_prefix}_pick_{result['model']}",
+                         use_container_width=True, on_click=on_select, args=(result,) if on_select else None):
+                selected = result
+    return selected
+
+
+def find_similar(conversation: Conversation, attributes: Dict, topic: str) -> Optional[SimilarMatch]:
+    """
+    Look up an earlier result for a similar request with the same settings.
+
+    Args:
+        conversation: The page's conversation
+        attributes: The request's other settings, such as genre and style
+        topic: The free-text topic the user entered
+
+    Returns:
+        The best match, or None if there is none or it is already the latest reply
+    """
+    if not topic.strip():
+        return None
+    match = get_similarity_index().lookup(conversation.content_type, attributes, topic)
+    if match is None or (conversation.messages and conversation.messages[-1]["content"] == match.content):
+        return None
+    return match
+
+
+def render_similar(match: SimilarMatch, key_prefix: str,
+                   on_select: Optional[Callable[[SimilarMatch], None]] = None):
+    """
+    Suggest an earlier result for a similar request.
+
+    Args:
+        match: The earlier request and its result
+        key_prefix: Prefix that keeps widget keys unique per page
+        on_select: Callback receiving the match when the user keeps it
+    """
+    with st.expander(f"💡 A {match.similarity:.0%} similar request was answered before"):
+        st.caption(match.request)
+        st.markdown(match.content)
+        st.button("Use this result", key=f"{key_prefix}_use_similar", on_click=on_select,
+                  args=(match,) if on_select else None)
+
+
+def current_session_id() -> str:
+    """
+    Return the conversation session id, creating one on the first visit.
+
+    A session id in the URL resumes that session, and the current id is
+    kept in the URL so reconnecting or reloading picks it back up.
+
+    Returns:
+        The session id
+    """
+    if "session_id" not in st.session_state:
+        store = get_conversation_store()
+        requested = st.query_params.get("session")
+        if requested and store.session_exists(requested):
+            st.session_state.session_id = requested
+        else:
+            st.session_state.session_id = store.create_session()
+    if st.query_params.get("session") != st.session_state.session_id:
+        st.query_params["session"] = st.session_state.session_id
+    return st.session_state.session_id
+
+
+def open_conversation(content_type: str) -> Conversation:
+    """
+    Open a page's conversation in the current session.
+
+    Args:
+        content_type: script, story or poem
+
+    Returns:
+        The conversation with its most recent messages loaded
+    """
+    return Conversation(get_conversation_store(), current_session_id(), content_type)
+
+
+def resume_session(session_id: str):
+    """Switch to another stored session, dropping the loaded conversations."""
+    st.session_state.session_id = session_id
+    st.query_params["session"] = session_id
+    for key in list(st.session_state):
+        if key.endswith(CONVERSATION_KEY_SUFFIXES):
+            del st.session_state[key]
+
+
+def render_session_controls():
+    """Show the session id in the sidebar with a form to resume another session."""
+    st.sidebar.subheader("Session")
+    st.sidebar.caption("Conversations are saved. Keep this id (or the page URL) to resume them later.")
+    st.sidebar.code(current_session_id(), language=None)
+    with st.sidebar.form("resume_session", clear_on_submit=True, border=False):
+        requested = st.text_input("Resume a session", placeholder="Session id").strip()
+        if st.form_submit_button("Resume") and requested:
+            if get_conversation_store().session_exists(requested):
+                resume_session(requested)
+                st.rerun()
+            else:
+                st.error("No saved session with that id.")
+
+
+def render_telemetry_panel():
+    """Show rolling per-model LLM call statistics in the sidebar."""
+    telemetry = get_telemetry()
+    models = telemetry.models()
+    st.sidebar.subheader("LLM Telemetry")
+    if not models:
+        st.sidebar.caption("No model calls recorded yet.")
+        return
+
+    def seconds(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.2f}s"
+
+    for model in models:
+        stats = telemetry.model_stats(model)
+        throughput = stats["p50_tokens_per_second"]
+        st.sidebar.markdown(
+            f"**{model}** · {stats['calls']} calls · {stats['error_rate']:.0%} errors  \n"
+            f"latency p50 {seconds(stats['p50_latency'])} / p95 {seconds(stats['p95_latency'])}  \n"
+            f"TTFT p50 {seconds(stats['p50_ttft'])} / p95 {seconds(stats['p95_ttft'])}  \n"
+            f"throughput p50 {'-' if throughput is None else f'{throughput:.0f} tok/s'}"
+        )